@@ -1,48 +1,84 @@
-import scapy.all as scapy
-from scapy.layers.inet import IP, TCP, UDP, ICMP
-import pandas as pd
 import numpy as np
-import joblib
 import logging
 from datetime import datetime, timedelta
 import time
-import logging
 from .network_feature_extractor import NetworkFeatureExtractor
-from sklearn.preprocessing import StandardScaler
-from collections import deque, Counter
+from .capture import sniff_frames, sniff_packets
+from .ring_capture import sniff_ring
+from .replay import replay_pcap
+from .sharded_extractor import ShardedFeatureExtractor
+from .forest_compiler import load_feature_names, load_model, predict_proba
+from .packet_dissector import dissect_frame, record_from_packet
+from .pipeline import Pipeline, Stage
+from .overload import OverloadManager
+from .record_writer import TRAFFIC_FIELDS, RotatingCSVWriter
+from .columnar_store import ColumnarWriter
+from .event_log import RateLimiter, configure_logging
+from .alert_dispatcher import AlertDispatcher, SMTPConfig
+from .verdict_cache import VerdictCache
+from .feature_encoder import FeatureEncoder
+from collections import Counter
 import threading
-import smtplib
-import psutil
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import csv
 import os 
 import traceback
-from .models import EmailSettings
-from django.core.exceptions import ObjectDoesNotExist
 
 # Absolute paths for important files
 PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 MODELS_DIR = os.path.join(PROJECT_DIR, "models")  # Models directory
 TRAFFIC_DATA_CSV = os.path.join(PROJECT_DIR, "traffic_data.csv")  # Traffic data CSV
+TRAFFIC_STORE_DIR = os.path.join(PROJECT_DIR, "traffic_store")  # Columnar traffic store
 SCALER_FILE = os.path.join(PROJECT_DIR, "scaler.joblib")  # Scaler file
 IDS_LOG = os.path.join(PROJECT_DIR, "ids_log.txt")  # Log file
 
+
 class IntrusionDetectionSystem:
-    def __init__(self, model_path, feature_names_path, interface=None, log_file=IDS_LOG, buffer_size=1000, csv_output=TRAFFIC_DATA_CSV, detect_internal=False):
-        self.model = joblib.load(model_path)
-        self.feature_names = joblib.load(feature_names_path)
+    def __init__(self, model_path, feature_names_path, interface=None, log_file=IDS_LOG, buffer_size=1000, csv_output=TRAFFIC_DATA_CSV, detect_internal=False, fast_path=False, extraction_workers=0, batch_size=100, dissect_workers=1, inference_workers=1, shedding_watermark=0.5, min_sampling_ratio=0.05, csv_max_bytes=64 * 1024 * 1024, csv_max_age=None, csv_compress=False, csv_backup_count=None, record_format='csv', traffic_store=TRAFFIC_STORE_DIR, normal_log_rate=10.0, alert_window=60.0, verdict_cache_size=100000, verdict_min_confidence=0.9, rescore_packets=100, rescore_interval=30.0, emission='packet', interim_packets=0, interim_interval=None, capture_filter=None, smtp_config=None, email_from_database=True, capture_backend='socket', fanout_group=None):
+        # scapy, sklearn, psutil and Django are only imported once they are
+        # needed; a compiled .npz model never loads sklearn at all
+        self.model = load_model(model_path)  # sklearn model (memory-mapped) or compiled .npz forest
+        self.feature_names = load_feature_names(feature_names_path)
         self.setup_logging(log_file)
-        self.scaler = StandardScaler()
-        self.buffer = deque(maxlen=buffer_size)
+        self.buffer_size = buffer_size  # capacity of each pipeline queue
         self.csv_output = csv_output
+        self.csv_max_bytes = csv_max_bytes
+        self.csv_max_age = csv_max_age
+        self.csv_compress = csv_compress
+        self.csv_backup_count = csv_backup_count
+        self.record_format = record_format  # 'csv' or 'columnar'
+        self.traffic_store = traffic_store
+        self.record_writer = None
         self.interface = interface
-        self.feature_extractor = NetworkFeatureExtractor(self.interface, detect_internal=detect_internal)
-        self.feature_set = set(self.feature_names)
+        self.capture_filter = capture_filter  # BPF expression applied by the kernel
+        # 'ring' reads batches of frames from a memory-mapped TPACKET_V3 ring
+        # (Linux); IDS processes in the same fanout_group share the interface
+        self.capture_backend = capture_backend
+        self.fanout_group = fanout_group
+        self.capture_stats = None  # kernel packet/drop counters of the ring
+        self.fast_path = fast_path
+        # emission='flow' scores one record per connection instead of every packet
+        self.extractor_kwargs = {'detect_internal': detect_internal, 'emission': emission,
+                                 'interim_packets': interim_packets, 'interim_interval': interim_interval}
+        self.feature_extractor = NetworkFeatureExtractor(self.interface, **self.extractor_kwargs)
+        self.extraction_workers = extraction_workers
+        self.sharded_extractor = None
+        self.shard_counters = None  # totals of the shard workers, once they stopped
+        self.dissect_workers = dissect_workers
+        self.inference_workers = inference_workers
+        self.pipeline = None
+        self.pipeline_lock = threading.Lock()  # only one caller gets to stop the pipeline
+        self.overload = None
+        self.shedding_watermark = shedding_watermark
+        self.min_sampling_ratio = min_sampling_ratio
+        self.encoder = FeatureEncoder(self.feature_names)  # feature dicts -> model input rows
+        self.batch_size = batch_size
+        self.inference_state = threading.local()  # per-worker model input buffer
+        # Confident normal verdicts are reused per flow until its features move
+        self.verdict_cache = VerdictCache(
+            [name for name, _ in TRAFFIC_FIELDS], max_size=verdict_cache_size, min_confidence=verdict_min_confidence,
+            rescore_packets=rescore_packets, rescore_interval=rescore_interval) if verdict_cache_size else None
         self.packet_count = 0
         self.start_time = time.time()
-        self.buffer_lock = threading.Lock()
-        self.processing_thread = None
+        self.buffer_lock = threading.Lock()  # guards the counters read by the dashboard
         self.stop_flag = threading.Event()
         self.anomaly_count = 0
         self.normal_count = 0
@@ -50,40 +86,36 @@ class IntrusionDetectionSystem:
         self.anomaly_sources = Counter()
         self.normal_index = np.where(self.model.classes_ == "normal")[0][0]
         self.anomaly_index = np.where(self.model.classes_ == "anomaly")[0][0]
-        self.initialize_csv()
-        self.smtp_port = 587
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
+        self.alert_window = alert_window  # seconds of alerts coalesced into one email
+        self.alert_dispatcher = None
+        # At most normal_log_rate normal-traffic records per second are logged
+        self.normal_log_limiter = RateLimiter(normal_log_rate)
         self.is_active = False
         self.packet_count_peroid = 0
         self.normal_count_period = 0
         self.anomaly_count_period = 0
-        
-        try:
-            self.email_settings = EmailSettings.objects.get(pk=1)
-        except ObjectDoesNotExist:
-            self.email_settings = None
+        self.warmed_up = False
+        # Alerts use smtp_config if given, otherwise the settings stored by the
+        # web UI; email_from_database=False keeps Django out of the process
+        self.smtp_config = smtp_config
+        self.email_from_database = email_from_database
+        self.email_settings = None  # read from the database when alerts start
 
     def setup_logging(self, log_file):
-        logging.basicConfig(filename=log_file, level=logging.INFO,
-                            format='%(asctime)s - %(levelname)s - %(message)s',
-                            datefmt='%Y-%m-%d %H:%M:%S')
-        self.logger = logging.getLogger()
+        # Records are written by a background listener; repeated setup with the
+        # same file reuses the existing handler
+        self.log_handler = configure_logging(log_file)
+        self.logger = logging.getLogger(__name__)
 
     @staticmethod
     def get_available_interfaces():
+        import psutil
         interfaces = psutil.net_if_addrs().keys()
         return list(interfaces)
 
     def set_interface(self, interface):
         self.interface = interface
-        self.feature_extractor = NetworkFeatureExtractor(self.interface)
+        self.feature_extractor = NetworkFeatureExtractor(self.interface, **self.extractor_kwargs)
     
 
     def start_detection(self, duration=None):
@@ -91,12 +123,21 @@ class IntrusionDetectionSystem:
         self.is_active = True
         self.start_time = time.time()
         self.stop_flag.clear()
-        self.processing_thread = threading.Thread(target=self.process_buffer)
-        self.processing_thread.start()
+        self.start_pipeline()
 
         try:
-            scapy.sniff(iface=self.interface,
-                        prn=self.capture_packet, store=0, timeout=duration)
+            if self.capture_backend == 'ring':
+                self.capture_stats = sniff_ring(self.interface, self.capture_frames, timeout=duration,
+                                                stop_event=self.stop_flag, bpf_filter=self.capture_filter,
+                                                exclude_internal=self.exclude_internal,
+                                                fanout_group=self.fanout_group)
+            elif self.fast_path:
+                # Raw frames are dissected by the pipeline itself
+                sniff_frames(self.interface, self.capture_frame, timeout=duration, stop_event=self.stop_flag,
+                             bpf_filter=self.capture_filter, exclude_internal=self.exclude_internal)
+            else:
+                sniff_packets(self.interface, self.capture_packet, timeout=duration, stop_event=self.stop_flag,
+                              bpf_filter=self.capture_filter, exclude_internal=self.exclude_internal)
         except KeyboardInterrupt:
             self.logger.info(
                 "Stopping packet capture due to KeyboardInterrupt")
@@ -106,26 +147,147 @@ class IntrusionDetectionSystem:
         finally:
             self.stop_detection()
 
+    def exclude_internal(self):
+        # Internal traffic is dropped by the kernel filter; the capture loop
+        # asks again every second, so the web UI's setting applies at once
+        return not self.feature_extractor.detect_internal
+
+    def start_replay(self, pcap_path, speed=None):
+        # Runs a pcap/pcapng file through the detection pipeline. speed=None
+        # replays as fast as possible, 1.0 in real time, N at N times real time.
+        self.logger.info(f"Replaying capture file: {pcap_path}")
+        self.is_active = True
+        self.start_time = time.time()
+        self.stop_flag.clear()
+        self.start_pipeline()
+
+        try:
+            replay_pcap(pcap_path, self.replay_packet, speed=speed,
+                        raw=self.fast_path, stop_event=self.stop_flag)
+        except KeyboardInterrupt:
+            self.logger.info("Stopping replay due to KeyboardInterrupt")
+        except Exception as e:
+            self.logger.error(f"Unexpected error in replay: {str(e)}")
+            self.logger.error(traceback.format_exc())
+        finally:
+            self.stop_detection()
+
+    def replay_packet(self, packet):
+        # Replay waits for room in the pipeline instead of dropping packets
+        pipeline = self.pipeline
+        if pipeline:
+            pipeline.put(packet)
+
+    def start_pipeline(self):
+        # capture -> dissect -> extract -> infer -> output. Feature extraction
+        # keeps per-connection state, so it runs on one thread unless it is
+        # sharded across processes, in which case the shards also dissect.
+        if self.extraction_workers > 0:
+            self.logger.info(f"Starting {self.extraction_workers} feature extraction workers")
+            self.sharded_extractor = ShardedFeatureExtractor(
+                self.extraction_workers,
+                extractor_kwargs=self.extractor_kwargs)
+            stages = [Stage('extract', self.extract_sharded, 1, self.buffer_size, self.batch_size,
+                            tick=self.extract_tick)]
+        else:
+            # Dissect workers hand records on in capture order
+            stages = [Stage('dissect', self.dissect_packets, self.dissect_workers, self.buffer_size, self.batch_size,
+                            ordered=True),
+                      Stage('extract', self.extract_records, 1, self.buffer_size, self.batch_size,
+                            tick=self.extract_tick)]
+        stages.append(Stage('infer', self.infer_batch, self.inference_workers, self.buffer_size, self.batch_size))
+        stages.append(Stage('output', self.output_results, 1, self.buffer_size, self.batch_size))
+
+        self.warm_up()
+        self.start_record_writer()
+        self.start_alert_dispatcher()
+        self.pipeline = Pipeline(stages)
+        self.overload = OverloadManager(stages[0], low_watermark=self.shedding_watermark,
+                                        min_ratio=self.min_sampling_ratio)
+        self.pipeline.start()
+
+    def warm_up(self):
+        # Scores one dummy batch so that lazy imports, page faults of the
+        # memory-mapped model and first-call setup happen before capture starts
+        if self.warmed_up:
+            return
+        started = time.perf_counter()
+        predict_proba(self.model, self.encoder.encode([{}] * self.batch_size))
+        self.warmed_up = True
+        self.logger.info(f"Model warmed up in {time.perf_counter() - started:.3f}s")
+
+    def reload_model(self, model_path, feature_names_path):
+        # Swaps in a retrained model while detection keeps running. The new
+        # model must use the same features; changing them needs a restart.
+        feature_names = load_feature_names(feature_names_path)
+        if feature_names != self.feature_names:
+            raise ValueError("The new model uses different features; restart the IDS to switch to it")
+        model = load_model(model_path)
+        predict_proba(model, self.encoder.encode([{}] * self.batch_size))
+        self.normal_index = np.where(model.classes_ == "normal")[0][0]
+        self.anomaly_index = np.where(model.classes_ == "anomaly")[0][0]
+        self.model = model
+        if self.verdict_cache:
+            self.verdict_cache.clear()  # verdicts of the old model
+        self.logger.info(f"Reloaded model from {model_path}")
+
+    def stop_pipeline(self):
+        # Returns False if there was no pipeline to stop, e.g. because the web
+        # UI and the capture thread both asked for it
+        with self.pipeline_lock:
+            pipeline, self.pipeline = self.pipeline, None
+        if not pipeline:
+            return False
+        stages = {stage.name: stage for stage in pipeline.stages}
+        if 'dissect' not in stages:
+            # Results still inside the shard workers go straight to inference
+            stages['extract'].stop()
+            for features in self.sharded_extractor.close():
+                stages['infer'].put((features, None))
+            self.shard_counters = self.sharded_extractor.counters()
+            self.sharded_extractor = None
+        else:
+            # Flows still open are emitted once extraction has drained
+            stages['dissect'].stop()
+            stages['extract'].stop()
+            for features in self.feature_extractor.flush():
+                stages['infer'].put((features, None))
+        pipeline.stop()
+        self.stop_record_writer()
+        self.stop_alert_dispatcher()
+        self.logger.info(f"Pipeline stages: {pipeline.stats()}")
+        return True
+
     def stop_detection(self):
-        self.logger.info("Stopping Intrusion Detection System")
         self.is_active = False
         self.stop_flag.set()
-        if self.processing_thread:
-            self.processing_thread.join()
-        self.logger.info("Intrusion Detection System stopped")
-        self.log_performance_metrics()
+        if not self.pipeline:
+            return
+        self.logger.info("Stopping Intrusion Detection System")
+        if self.stop_pipeline():
+            self.logger.info("Intrusion Detection System stopped")
+            self.log_performance_metrics()
 
     def is_running(self):
         return self.is_active
 
     def capture_packet(self, packet):
-        try:
-            with self.buffer_lock:
-                self.buffer.append(packet)
-        except Exception as e:
-            self.logger.error(f"Error capturing packet: {str(e)}")
+        # Live capture never blocks; the overload manager sheds load and
+        # counts every drop when analysis falls behind
+        self.overload.offer(packet)
+
+    def capture_frame(self, frame, timestamp):
+        self.overload.offer((frame, timestamp))
+
+    def capture_frames(self, frames):
+        # Ring frames are views into memory the kernel reuses, so each one is
+        # copied before it is queued
+        offer = self.overload.offer
+        for frame, timestamp in frames:
+            offer((bytes(frame), timestamp))
 
     def detect_network_interface(self):
+        import psutil
         active_interfaces = []
         for interface, addrs in psutil.net_if_addrs().items():
             for addr in addrs:
@@ -158,101 +320,169 @@ class IntrusionDetectionSystem:
                 except ValueError:
                     print("Invalid input. Please enter a number.")
 
-    def process_buffer(self):
-        while not self.stop_flag.is_set() or self.buffer:
-            packets_to_process = []
-            with self.buffer_lock:
-                while self.buffer and len(packets_to_process) < 100:
-                    packets_to_process.append(self.buffer.popleft())
-
-            for packet in packets_to_process:
-                self.process_packet(packet)
-
-            self.print_periodic_summary()
-
-            if not packets_to_process:
-                time.sleep(0.1)  # Avoid busy-waiting
-
-    def process_packet(self, packet):
-        try:
-            features = self.feature_extractor.extract_features(packet)
-
+    def dissect_packets(self, packets):
+        records = []
+        for packet in packets:
+            try:
+                if isinstance(packet, tuple):
+                    record = dissect_frame(*packet)
+                else:
+                    record = record_from_packet(packet)
+            except Exception as e:
+                self.log_packet_error(packet, e)
+                continue
+            if record is not None:
+                records.append((record, packet))
+        return records
+
+    def extract_records(self, records):
+        results = []
+        for record, packet in records:
+            try:
+                features = self.feature_extractor.extract_record(record)
+            except Exception as e:
+                self.log_packet_error(packet, e)
+                continue
             if features:
-                # Ensure all expected keys exist
-                for key in self.feature_names:
-                    if key not in features:
-                        features[key] = 0  # Assign default value for missing keys
-
-                df = pd.DataFrame([features])
-                df_aligned = self.align_features(df, self.feature_names)
-                df_input = df_aligned
-
-                prediction = self.model.predict(df_input)[0]
-                probabilities = self.model.predict_proba(df_input)[0]
-
-                self.save_to_csv(features, prediction)
-
-                with self.buffer_lock:  # Use a lock to ensure atomic updates
-                    self.packet_count += 1
-                    if prediction == "anomaly":
-                        self.anomaly_count_period += 1
-                        self.anomaly_count += 1
-                        self.log_intrusion(
-                            packet, features, probabilities[self.anomaly_index])
-                    elif prediction == "normal":
-                        self.normal_count_period += 1
-                        self.normal_count += 1
-                        self.log_normal(packet, features,
-                                        probabilities[self.normal_index])
-
-        except Exception as e:
-            self.logger.error(f"Error processing packet: {str(e)}")
-            self.logger.error(f"Packet causing error: {packet.summary()}")
-            self.logger.error(traceback.format_exc())
+                results.append((features, packet))
+        # Connections that ended (flow emission mode) have no single packet
+        results.extend((features, None) for features in self.feature_extractor.pop_completed())
+        return results
+
+    def extract_tick(self):
+        # Runs every second on the extract thread: flows on a quiet link time
+        # out and are emitted even when no packet arrives to advance the clock.
+        # Shard workers tick on their own; their results are collected here.
+        if self.sharded_extractor:
+            self.sharded_extractor.flush()
+            completed = self.sharded_extractor.poll()
+        else:
+            completed = self.feature_extractor.tick()
+        return [(features, None) for features in completed]
+
+    def extract_sharded(self, packets):
+        for packet in packets:
+            if isinstance(packet, tuple):
+                self.sharded_extractor.submit(*packet)
+            else:
+                self.sharded_extractor.submit(bytes(packet), float(packet.time))
+        self.sharded_extractor.flush()
+        return [(features, None) for features in self.sharded_extractor.poll()]
+
+    def infer_batch(self, batch):
+        results = [None] * len(batch)
+        pending = []  # (position, features, packet, cache key, signature)
+        leaders = {}  # (cache key, signature) -> row in pending
+        followers = []  # (position, features, packet, leader row)
+        for position, (features, packet) in enumerate(batch):
+            if self.verdict_cache:
+                verdict, key, signature = self.verdict_cache.lookup(features)
+                if verdict is not None:
+                    results[position] = (features, packet) + verdict
+                    continue
+                # Packets of one flow with the same signature are scored once per batch
+                leader = leaders.get((key, signature))
+                if leader is not None:
+                    followers.append((position, features, packet, leader))
+                    continue
+                leaders[(key, signature)] = len(pending)
+            else:
+                key = signature = None
+            pending.append((position, features, packet, key, signature))
+        if not pending:
+            return results
+
+        # Each inference worker reuses its own float32 input matrix
+        matrix = getattr(self.inference_state, 'matrix', None)
+        if matrix is None or len(matrix) < len(pending):
+            matrix = np.zeros((max(len(pending), self.batch_size), len(self.feature_names)), dtype=np.float32)
+            self.inference_state.matrix = matrix
+        matrix = matrix[:len(pending)]
+
+        # One row per packet, columns in feature_names order with one-hot
+        # categoricals; missing features stay 0
+        self.encoder.encode([features for _, features, _, _, _ in pending], matrix)
+
+        # One forest traversal per batch; labels follow from the probabilities
+        model = self.model  # may be swapped by reload_model
+        probabilities = predict_proba(model, matrix)
+        predictions = model.classes_[probabilities.argmax(axis=1)]
+        for (position, features, packet, key, signature), prediction, row_probabilities in zip(
+                pending, predictions, probabilities):
+            results[position] = (features, packet, prediction, row_probabilities)
+            if self.verdict_cache:
+                self.verdict_cache.store(key, signature, features, (prediction, row_probabilities),
+                                         row_probabilities[self.normal_index])
+        for position, features, packet, leader in followers:
+            results[position] = (features, packet) + results[pending[leader][0]][2:]
+        if followers:
+            self.verdict_cache.record_coalesced(len(followers))
+        return results
+
+    def output_results(self, results):
+        for features, packet, prediction, row_probabilities in results:
+            self.record_writer.write((features, prediction))
+
+            with self.buffer_lock:  # Use a lock to ensure atomic updates
+                self.packet_count += 1
+                if prediction == "anomaly":
+                    self.anomaly_count_period += 1
+                    self.anomaly_count += 1
+                    self.anomaly_sources[features.get('src_ip', "Unknown")] += 1
+                elif prediction == "normal":
+                    self.normal_count_period += 1
+                    self.normal_count += 1
+
+            # Logging happens outside the lock the dashboard reads from
+            if prediction == "anomaly":
+                self.log_intrusion(packet, features, row_probabilities[self.anomaly_index])
+                self.overload.flag(features.get('src_ip'), features.get('dst_ip'))
+            elif prediction == "normal":
+                self.log_normal(packet, features, row_probabilities[self.normal_index])
+
+        self.print_periodic_summary()
+
+    def log_packet_error(self, packet, error):
+        self.logger.error(f"Error processing packet: {str(error)}")
+        self.logger.error(f"Packet causing error: {self.describe_packet(packet)}")
+        self.logger.error(traceback.format_exc())
 
     @staticmethod
-    def align_features(sample_data, feature_names):
-        # Create a DataFrame with all expected features, filled with zeros
-        aligned_data = pd.DataFrame(
-            0, index=sample_data.index, columns=feature_names)
-
-        # Update the aligned_data with the values from sample_data where they exist
-        for col in sample_data.columns:
-            if col in feature_names:
-                aligned_data[col] = sample_data[col]
-
-        return aligned_data
-    
+    def describe_packet(packet):
+        if isinstance(packet, tuple):
+            frame, timestamp = packet
+            return f"raw frame of {len(frame)} bytes at {timestamp}"
+        return packet.summary()
 
     def log_intrusion(self, packet, features, probability):
-        src_ip = packet[IP].src if IP in packet else "Unknown"
-        dst_ip = packet[IP].dst if IP in packet else "Unknown"
-        protocol = features.get('protocol_type', 'unknown')  # Use .get() with a default
-        service = features.get('service', 'none')  # Handle missing service key
-
         severity = "HIGH" if probability > 0.8 else "MEDIUM" if probability > 0.6 else "LOW"
-
-        log_message = (f"ALERT: Potential intrusion detected! - {severity}\n"
-                    f"Source IP: {src_ip}, Destination IP: {dst_ip}\n"
-                    f"Protocol: {protocol}, Service: {service}\n"
-                    f"Confidence: {probability:.2f}\n"
-                    f"Features: {features}")
-
-        self.logger.warning(log_message)
-        self.anomaly_sources[src_ip] += 1
+        alert = {
+            'event': 'alert',
+            'severity': severity,
+            'src_ip': features.get('src_ip', "Unknown"),
+            'dst_ip': features.get('dst_ip', "Unknown"),
+            'protocol': features.get('protocol_type', 'unknown'),
+            'service': features.get('service', 'none'),
+            'confidence': round(float(probability), 4),
+            'features': {name: value for name, value in features.items()
+                         if value and name not in ('src_ip', 'dst_ip')},
+        }
+        # One JSON line per alert, serialized by the log writer thread
+        self.logger.warning("Potential intrusion detected", extra={'event': alert})
+        dispatcher = self.alert_dispatcher  # may be replaced by set_smtp_config
+        if dispatcher:
+            dispatcher.submit(alert)
 
     def log_normal(self, packet, features, probability):
-        src_ip = packet[IP].src if IP in packet else "Unknown"
-        dst_ip = packet[IP].dst if IP in packet else "Unknown"
+        if not self.normal_log_limiter.allow():
+            return
+        src_ip = features.get('src_ip', "Unknown")
+        dst_ip = features.get('dst_ip', "Unknown")
         protocol = features.get('protocol_type', 'unknown')  # Use .get() with a default
         service = features.get('service', 'none')  # Handle missing service key
 
-        log_message = (f"Normal traffic detected\n"
-                       f"Source IP: {src_ip}, Destination IP: {dst_ip}\n"
-                       f"Protocol: {protocol}, Service: {service}\n"
-                       f"Confidence: {probability:.2f}")
-
-        self.logger.info(log_message)
+        self.logger.info("Normal traffic detected - %s -> %s, %s/%s, confidence %.2f",
+                         src_ip, dst_ip, protocol, service, probability)
 
     def print_periodic_summary(self):
         current_time = time.time()
@@ -278,104 +508,97 @@ class IntrusionDetectionSystem:
         self.logger.info(f"Total packets: {self.packet_count}")
         self.logger.info(f"Normal packets: {self.normal_count}")
         self.logger.info(f"Anomaly packets: {self.anomaly_count}")
+        if self.shard_counters:
+            self.logger.info(
+                f"Evicted flows: {self.shard_counters['evicted_flows']}, "
+                f"evicted hosts: {self.shard_counters['evicted_hosts']}, shard workers: {self.shard_counters}")
+        else:
+            self.logger.info(
+                f"Evicted flows: {self.feature_extractor.connections.evicted}, "
+                f"evicted hosts: {self.feature_extractor.hosts.evicted}")
+        if self.capture_stats:
+            self.logger.info(f"Kernel capture: {self.capture_stats}")
+        if self.overload:
+            self.logger.info(f"Overload: {self.overload.stats()}")
+        if self.verdict_cache:
+            self.logger.info(f"Verdict cache: {self.verdict_cache.stats()}")
+        self.logger.info(f"Normal records not logged (rate limit): {self.normal_log_limiter.suppressed}, "
+                         f"log records dropped: {self.log_handler.dropped}")
+
+    def get_overload_stats(self):
+        return self.overload.stats() if self.overload else None
 
     def send_alert(self, message):
-        if not self.email_settings:
-            self.logger.warning("Email settings not configured. Alert not sent.")
+        # Queues a free-form message for the next alert digest
+        dispatcher = self.alert_dispatcher
+        if not dispatcher:
+            self.logger.warning("Email alerts are not running. Alert not sent.")
             return
-        
-        msg = MIMEMultipart()
-        msg['From'] = self.email_settings.email_sender
-        msg['To'] = self.email_settings.email_recipient
-        msg['Subject'] = 'IDS Alert'
-
-        html_content = """
-        <html>
-        <head></head>
-        <body>
-            <p>{}</p>
-        </body>
-        </html>
-        """.format(message.replace('\n', '<br>'))
-
-        msg.attach(MIMEText(html_content, 'html'))
+        dispatcher.submit({'severity': 'INFO', 'src_ip': '-', 'dst_ip': '-', 'message': message})
 
+    def load_email_settings(self):
+        # Django is only needed for the stored email settings
         try:
-            with smtplib.SMTP(self.email_settings.smtp_server, self.email_settings.smtp_port) as server:
-                server.starttls()
-                server.login(self.email_settings.email_sender, self.email_settings.email_password)
-                server.send_message(msg)
-                self.logger.info("Alert email sent successfully")
-        except Exception as e:
-            self.logger.error(f"Failed to send alert email: {str(e)}")
-            self.logger.error(traceback.format_exc())
-
-    def initialize_csv(self):
-        header = [
-            "duration", "protocol_type", "service", "flag", "src_bytes", "dst_bytes",
-            "land", "wrong_fragment", "urgent", "hot", "num_failed_logins", "logged_in",
-            "num_compromised", "root_shell", "su_attempted", "num_root",
-            "num_file_creations", "num_shells", "num_access_files", "num_outbound_cmds",
-            "is_host_login", "is_guest_login", "count", "srv_count", "serror_rate",
-            "srv_serror_rate", "rerror_rate", "srv_rerror_rate", "same_srv_rate",
-            "diff_srv_rate", "srv_diff_host_rate", "dst_host_count", "dst_host_srv_count",
-            "dst_host_same_srv_rate", "dst_host_diff_srv_rate", "dst_host_same_src_port_rate",
-            "dst_host_srv_diff_host_rate", "dst_host_serror_rate", "dst_host_srv_serror_rate",
-            "dst_host_rerror_rate", "dst_host_srv_rerror_rate", "class"
-        ]
-        with open(self.csv_output, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(header)
-
-    def save_to_csv(self, features, prediction):
-        row = [
-            features.get('duration', 0),
-            features.get('protocol_type', ''),
-            features.get('service', ''),
-            features.get('flag', ''),
-            features.get('src_bytes', 0),
-            features.get('dst_bytes', 0),
-            features.get('land', 0),
-            features.get('wrong_fragment', 0),
-            features.get('urgent', 0),
-            features.get('hot', 0),
-            features.get('num_failed_logins', 0),
-            features.get('logged_in', 0),
-            features.get('num_compromised', 0),
-            features.get('root_shell', 0),
-            features.get('su_attempted', 0),
-            features.get('num_root', 0),
-            features.get('num_file_creations', 0),
-            features.get('num_shells', 0),
-            features.get('num_access_files', 0),
-            features.get('num_outbound_cmds', 0),
-            features.get('is_host_login', 0),
-            features.get('is_guest_login', 0),
-            features.get('count', 0),
-            features.get('srv_count', 0),
-            features.get('serror_rate', 0),
-            features.get('srv_serror_rate', 0),
-            features.get('rerror_rate', 0),
-            features.get('srv_rerror_rate', 0),
-            features.get('same_srv_rate', 0),
-            features.get('diff_srv_rate', 0),
-            features.get('srv_diff_host_rate', 0),
-            features.get('dst_host_count', 0),
-            features.get('dst_host_srv_count', 0),
-            features.get('dst_host_same_srv_rate', 0),
-            features.get('dst_host_diff_srv_rate', 0),
-            features.get('dst_host_same_src_port_rate', 0),
-            features.get('dst_host_srv_diff_host_rate', 0),
-            features.get('dst_host_serror_rate', 0),
-            features.get('dst_host_srv_serror_rate', 0),
-            features.get('dst_host_rerror_rate', 0),
-            features.get('dst_host_srv_rerror_rate', 0),
-            prediction
-        ]
-        with open(self.csv_output, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(row)
-
+            from .models import EmailSettings
+            return EmailSettings.objects.filter(pk=1).first()
+        except Exception as e:  # no database, or Django is not configured
+            self.logger.warning(f"Email settings unavailable: {e}")
+            return None
+
+    def start_alert_dispatcher(self):
+        config = self.smtp_config
+        if config is None and self.email_from_database:
+            if self.email_settings is None:
+                self.email_settings = self.load_email_settings()
+            if self.email_settings:
+                config = SMTPConfig.from_settings(self.email_settings)
+        if config is None:
+            self.logger.warning("Email settings not configured. Email alerts disabled.")
+            return
+        dispatcher = AlertDispatcher(config, window=self.alert_window)
+        dispatcher.start()
+        self.alert_dispatcher = dispatcher
+
+    def set_smtp_config(self, config):
+        # Applies new SMTP settings; a running dispatcher is replaced and the
+        # old one sends what it already has queued
+        self.smtp_config = config
+        if not self.pipeline or not self.is_active:
+            return
+        old = self.alert_dispatcher
+        self.alert_dispatcher = None
+        self.start_alert_dispatcher()
+        if old:
+            old.close()
+
+    def stop_alert_dispatcher(self):
+        if self.alert_dispatcher:
+            self.alert_dispatcher.close()
+            self.logger.info(f"Email alerts: {self.alert_dispatcher.stats}")
+            self.alert_dispatcher = None
+
+    def traffic_row(self, record):
+        features, prediction = record
+        row = [features.get(name, default) for name, default in TRAFFIC_FIELDS]
+        row.append(prediction)
+        return row
+
+    def start_record_writer(self):
+        if self.record_format == 'columnar':
+            self.record_writer = ColumnarWriter(self.traffic_store)
+        else:
+            self.record_writer = RotatingCSVWriter(
+                self.csv_output, [name for name, _ in TRAFFIC_FIELDS] + ["class"], self.traffic_row,
+                max_bytes=self.csv_max_bytes, max_age=self.csv_max_age, compress=self.csv_compress,
+                backup_count=self.csv_backup_count)
+        self.record_writer.start()
+
+    def stop_record_writer(self):
+        if self.record_writer:
+            self.record_writer.close()
+            self.logger.info(f"Traffic records written: {self.record_writer.written}, "
+                             f"dropped: {self.record_writer.dropped}")
+            self.record_writer = None
 
 if __name__ == "__main__":
     model_path = "models/NSL-KDD-RF-model.joblib"
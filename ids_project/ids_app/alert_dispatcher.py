@@ -0,0 +1,220 @@
+import html
+import logging
+import queue
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+SEVERITIES = ('INFO', 'LOW', 'MEDIUM', 'HIGH')  # lowest first
+_STOP = object()
+
+
+class SMTPConfig(NamedTuple):
+    server: str
+    port: int
+    sender: str
+    recipient: str
+    password: str = ''
+    starttls: bool = True
+
+    @classmethod
+    def from_settings(cls, settings) -> 'SMTPConfig':
+        return cls(settings.smtp_server, settings.smtp_port, settings.email_sender,
+                   settings.email_recipient, settings.email_password)
+
+
+class AlertDispatcher:
+    # Sends alert emails from a worker thread. Alerts with the same source,
+    # destination and severity arriving within `window` seconds are coalesced,
+    # and each window produces at most one digest email. One authenticated
+    # SMTP session is kept open between digests (and reopened after
+    # `session_idle` seconds or a disconnect). Failed sends are retried with
+    # exponential backoff. The queue is bounded: when it is full, new alerts
+    # are counted and dropped, so an alert storm cannot stall detection.
+    # smtp_factory defaults to smtplib.SMTP, imported on the first session.
+    def __init__(self, config: SMTPConfig, window: float = 60.0, queue_size: int = 1000,
+                 max_groups: int = 50, samples_per_group: int = 3, retries: int = 3,
+                 backoff: float = 2.0, max_backoff: float = 60.0, session_idle: float = 240.0,
+                 timeout: float = 30.0, smtp_factory: Optional[Callable] = None):
+        self.config = config
+        self.window = window
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.max_groups = max_groups
+        self.samples_per_group = samples_per_group
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session_idle = session_idle
+        self.timeout = timeout
+        self.smtp_factory = smtp_factory
+        self.session = None
+        self.session_used = 0.0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stats = {'submitted': 0, 'dropped': 0, 'digests_sent': 0, 'digests_failed': 0}
+
+    def start(self) -> None:
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="ids-alert-dispatcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, alert: Dict) -> bool:
+        # alert holds at least 'severity', 'src_ip' and 'dst_ip'
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['submitted'] += 1
+        return True
+
+    def close(self) -> None:
+        # Sends the pending digest, then closes the SMTP session
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self) -> None:
+        groups: Dict[tuple, Dict] = {}
+        window_end = None
+        try:
+            while True:
+                timeout = None if window_end is None else max(0.0, window_end - time.monotonic())
+                try:
+                    alert = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    alert = None
+                if alert is _STOP:
+                    break
+                if alert is not None:
+                    if window_end is None:
+                        window_end = time.monotonic() + self.window
+                    self._add(groups, alert)
+                if window_end is not None and time.monotonic() >= window_end:
+                    self._send_digest(groups)
+                    groups = {}
+                    window_end = None
+            if groups:
+                self._send_digest(groups)
+        finally:
+            self._close_session()
+
+    def _add(self, groups: Dict[tuple, Dict], alert: Dict) -> None:
+        key = (alert.get('src_ip', 'Unknown'), alert.get('dst_ip', 'Unknown'), alert.get('severity', 'LOW'))
+        group = groups.get(key)
+        if group is None:
+            if len(groups) >= self.max_groups:
+                key = ('*', '*', alert.get('severity', 'LOW'))  # everything past max_groups
+                group = groups.get(key)
+            if group is None:
+                group = groups[key] = {'count': 0, 'first': time.time(), 'last': 0.0, 'samples': []}
+        group['count'] += 1
+        group['last'] = time.time()
+        if len(group['samples']) < self.samples_per_group:
+            group['samples'].append(alert)
+
+    def _send_digest(self, groups: Dict[tuple, Dict]) -> None:
+        message = self._build_digest(groups)
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                self._session().send_message(message)
+                self.session_used = time.monotonic()
+                self.stats['digests_sent'] += 1
+                logger.info(f"Alert digest sent ({sum(g['count'] for g in groups.values())} alerts)")
+                return
+            except OSError as e:  # smtplib.SMTPException included
+                logger.warning(f"Sending alert digest failed (attempt {attempt + 1}): {e}")
+                self._close_session()
+                if attempt < self.retries:
+                    self.stop_event.wait(delay)  # no waiting once close() was called
+                    delay = min(delay * 2, self.max_backoff)
+        self.stats['digests_failed'] += 1
+        logger.error("Alert digest dropped after retries")
+
+    def _session(self):
+        if self.session is not None and time.monotonic() - self.session_used > self.session_idle:
+            self._close_session()  # servers drop idle sessions; start a fresh one
+        if self.session is None:
+            factory = self.smtp_factory
+            if factory is None:
+                import smtplib
+                factory = smtplib.SMTP
+            session = factory(self.config.server, self.config.port, timeout=self.timeout)
+            try:
+                if self.config.starttls:
+                    session.starttls()
+                if self.config.password:
+                    session.login(self.config.sender, self.config.password)
+            except Exception:
+                session.close()
+                raise
+            self.session = session
+            self.session_used = time.monotonic()
+        return self.session
+
+    def _close_session(self) -> None:
+        if self.session is None:
+            return
+        try:
+            self.session.quit()
+        except OSError:
+            self.session.close()
+        self.session = None
+
+    def _build_digest(self, groups: Dict[tuple, Dict]) -> MIMEMultipart:
+        total = sum(group['count'] for group in groups.values())
+        by_severity = {severity: sum(g['count'] for (_, _, s), g in groups.items() if s == severity)
+                       for severity in SEVERITIES}
+        top = max((s for s in SEVERITIES if by_severity[s]), key=_rank, default='INFO')
+
+        msg = MIMEMultipart()
+        msg['From'] = self.config.sender
+        msg['To'] = self.config.recipient
+        msg['Subject'] = f"IDS Alert: {total} alert{'s' if total != 1 else ''} ({top})"
+
+        rows: List[str] = []
+        ordered = sorted(groups.items(), key=lambda item: (-_rank(item[0][2]), -item[1]['count']))
+        for (src_ip, dst_ip, severity), group in ordered:
+            details = '<br>'.join(html.escape(_describe(sample)) for sample in group['samples'])
+            rows.append(
+                f"<tr><td>{html.escape(severity)}</td><td>{html.escape(str(src_ip))}</td>"
+                f"<td>{html.escape(str(dst_ip))}</td><td>{group['count']}</td>"
+                f"<td>{time.strftime('%H:%M:%S', time.localtime(group['first']))}-"
+                f"{time.strftime('%H:%M:%S', time.localtime(group['last']))}</td><td>{details}</td></tr>")
+
+        summary = ', '.join(f"{severity}: {by_severity[severity]}" for severity in reversed(SEVERITIES))
+        html_content = f"""
+        <html>
+        <head></head>
+        <body>
+            <p>{total} alerts in the last {self.window:g} seconds ({summary})</p>
+            <table border="1" cellpadding="4">
+                <tr><th>Severity</th><th>Source</th><th>Destination</th><th>Alerts</th><th>Time</th><th>Examples</th></tr>
+                {''.join(rows)}
+            </table>
+        </body>
+        </html>
+        """
+        msg.attach(MIMEText(html_content, 'html'))
+        return msg
+
+
+def _rank(severity: str) -> int:
+    return SEVERITIES.index(severity) if severity in SEVERITIES else -1
+
+
+def _describe(alert: Dict) -> str:
+    if 'message' in alert:
+        return str(alert['message'])
+    parts = [f"{alert.get('protocol', '')}/{alert.get('service', '')}"]
+    if 'confidence' in alert:
+        parts.append(f"confidence {alert['confidence']:.2f}")
+    return ', '.join(parts)
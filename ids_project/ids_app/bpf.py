@@ -0,0 +1,123 @@
+import ctypes
+import ipaddress
+import socket
+import struct
+from typing import List, Optional, Sequence, Tuple
+
+# Traffic between two of these networks is "internal" and skipped unless
+# detect_internal is set (RFC 1918)
+PRIVATE_NETWORKS: Tuple[str, ...] = ('10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16')
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+# Classic BPF opcodes used below
+_LD_H_ABS = 0x28
+_LD_W_ABS = 0x20
+_ALU_AND_K = 0x54
+_JMP_JEQ_K = 0x15
+_RET_K = 0x06
+
+_ETHERTYPE_OFFSET = 12
+_ETHERTYPE_IPV4 = 0x0800
+_IP_SRC_OFFSET = 26  # Ethernet header + offset in the IPv4 header
+_IP_DST_OFFSET = 30
+_ACCEPT = 0x40000  # bytes of each packet passed to user space
+_DROP = 0
+
+Instruction = Tuple[int, int, int, int]  # (code, jt, jf, k)
+
+
+def internal_traffic_expression(networks: Sequence[str] = PRIVATE_NETWORKS) -> str:
+    # tcpdump syntax of the exclusion, e.g. for sniff(filter=...)
+    src = ' or '.join(f'src net {network}' for network in networks)
+    dst = ' or '.join(f'dst net {network}' for network in networks)
+    return f'not (ip and ({src}) and ({dst}))'
+
+
+def capture_expression(user_filter: Optional[str] = None, exclude_internal: bool = False,
+                       networks: Sequence[str] = PRIVATE_NETWORKS) -> Optional[str]:
+    # Combines a user filter with the internal-traffic exclusion
+    parts = []
+    if exclude_internal:
+        parts.append(internal_traffic_expression(networks))
+    if user_filter:
+        parts.append(f'({user_filter})')
+    return ' and '.join(parts) or None
+
+
+def internal_traffic_program(networks: Sequence[str] = PRIVATE_NETWORKS) -> List[Instruction]:
+    # The exclusion as a classic BPF program for Ethernet frames, built
+    # without libpcap: IPv4 packets whose source and destination are both in
+    # `networks` are dropped, everything else is accepted.
+    masks = []
+    for network in networks:
+        network = ipaddress.IPv4Network(network)
+        masks.append((int(network.netmask), int(network.network_address)))
+    tests = 3 * len(masks)
+
+    def block(offset: int, matched: int) -> List[Instruction]:
+        # One load/mask/compare per network; a match jumps `matched`
+        # instructions past the end of the block
+        program = []
+        for index, (mask, address) in enumerate(masks):
+            remaining = tests - 3 * index - 3
+            program += [(_LD_W_ABS, 0, 0, offset), (_ALU_AND_K, 0, 0, mask),
+                        (_JMP_JEQ_K, remaining + matched, 0, address)]
+        return program
+
+    # ethertype check, source block, accept, destination block, accept, drop
+    program: List[Instruction] = [(_LD_H_ABS, 0, 0, _ETHERTYPE_OFFSET),
+                                  (_JMP_JEQ_K, 0, tests, _ETHERTYPE_IPV4)]
+    program += block(_IP_SRC_OFFSET, 1)
+    program.append((_RET_K, 0, 0, _ACCEPT))
+    program += block(_IP_DST_OFFSET, 1)
+    program += [(_RET_K, 0, 0, _ACCEPT), (_RET_K, 0, 0, _DROP)]
+    return program
+
+
+def attach_program(sock: socket.socket, program: Sequence[Instruction]) -> None:
+    instructions = (ctypes.c_uint8 * (8 * len(program)))()
+    for index, instruction in enumerate(program):
+        struct.pack_into('HBBI', instructions, 8 * index, *instruction)
+    fprog = struct.pack('HL', len(program), ctypes.addressof(instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def detach_program(sock: socket.socket) -> None:
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+    except OSError:
+        pass  # no filter attached
+
+
+def compile_expression(expression: str, iface: Optional[str] = None):
+    # Compiles a tcpdump expression with libpcap. Raises ValueError if
+    # libpcap is missing or rejects the expression.
+    try:
+        from scapy.arch.common import compile_filter
+        return compile_filter(expression, iface)
+    except Exception as e:
+        raise ValueError(f"Cannot compile capture filter {expression!r}: {e}") from None
+
+
+def apply_filter(sock: socket.socket, iface: Optional[str], user_filter: Optional[str] = None,
+                 exclude_internal: bool = False) -> None:
+    # Installs the kernel filter on a packet socket, replacing any previous
+    # one. The internal-traffic exclusion alone is attached as a prebuilt
+    # program; user filters are compiled by libpcap. A user filter that
+    # cannot be installed raises ValueError instead of leaving the socket to
+    # capture traffic the user asked to skip.
+    if not user_filter:
+        if exclude_internal:
+            attach_program(sock, internal_traffic_program())
+        else:
+            detach_program(sock)
+        return
+
+    expression = capture_expression(user_filter, exclude_internal)
+    try:
+        from scapy.arch.linux import attach_filter
+        attach_filter(sock, expression, iface)
+    except Exception as e:  # libpcap missing or invalid expression
+        raise ValueError(f"Cannot install capture filter {expression!r}: {e}") from None
@@ -0,0 +1,74 @@
+import socket
+import threading
+import time
+from typing import Callable, Optional, Union
+
+from .bpf import apply_filter
+
+FILTER_CHECK_INTERVAL = 1.0  # seconds between checks of a callable exclude_internal
+
+ExcludeInternal = Union[bool, Callable[[], bool]]
+
+
+def _listen(iface: Optional[str], receive: Callable, timeout: Optional[float],
+            stop_event: Optional[threading.Event], bpf_filter: Optional[str],
+            exclude_internal: ExcludeInternal) -> None:
+    # Calls receive(sock) until the timeout passes or stop_event is set. The
+    # kernel drops what bpf_filter and the internal-traffic exclusion reject;
+    # a callable exclude_internal is polled and the filter replaced when its
+    # answer changes.
+    import scapy.arch  # noqa: F401  sets conf.L2listen for this platform
+    import scapy.layers.l2  # noqa: F401  link types of the capture socket
+    from scapy.config import conf
+
+    sock = conf.L2listen(iface=iface)
+    sock.ins.settimeout(0.5)  # wake up regularly to check stop_event and timeout
+    current = exclude_internal() if callable(exclude_internal) else exclude_internal
+    next_check = time.time() + FILTER_CHECK_INTERVAL
+    deadline = time.time() + timeout if timeout else None
+    try:
+        apply_filter(sock.ins, iface, bpf_filter, current)
+        while stop_event is None or not stop_event.is_set():
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                break
+            if callable(exclude_internal) and now >= next_check:
+                next_check = now + FILTER_CHECK_INTERVAL
+                if exclude_internal() != current:
+                    current = not current
+                    apply_filter(sock.ins, iface, bpf_filter, current)
+            try:
+                receive(sock)
+            except socket.timeout:
+                continue
+    finally:
+        sock.close()
+
+
+def sniff_frames(iface: Optional[str], prn: Callable[[bytes, float], None], timeout: Optional[float] = None,
+                 stop_event: Optional[threading.Event] = None, bpf_filter: Optional[str] = None,
+                 exclude_internal: ExcludeInternal = False) -> None:
+    # Receives raw link-layer frames and hands (frame, timestamp) to `prn`
+    # without building scapy packets.
+    def receive(sock) -> None:
+        _, frame, timestamp = sock.recv_raw()
+        if frame is not None:
+            prn(frame, timestamp or time.time())
+
+    _listen(iface, receive, timeout, stop_event, bpf_filter, exclude_internal)
+
+
+def sniff_packets(iface: Optional[str], prn: Callable[[object], None], timeout: Optional[float] = None,
+                  stop_event: Optional[threading.Event] = None, bpf_filter: Optional[str] = None,
+                  exclude_internal: ExcludeInternal = False) -> None:
+    # Like scapy's sniff(), but stops as soon as stop_event is set, even on
+    # an idle interface, so the capture can be ended from another thread or
+    # a signal handler.
+    import scapy.all  # noqa: F401  loads every layer for dissection
+
+    def receive(sock) -> None:
+        packet = sock.recv()
+        if packet is not None:
+            prn(packet)
+
+    _listen(iface, receive, timeout, stop_event, bpf_filter, exclude_internal)
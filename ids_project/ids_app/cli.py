@@ -0,0 +1,324 @@
+import argparse
+import atexit
+import configparser
+import csv
+import inspect
+import os
+import signal
+import sys
+import threading
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .IDS import MODELS_DIR, IntrusionDetectionSystem
+from .alert_dispatcher import SMTPConfig
+from .bpf import compile_expression
+from .feature_encoder import FeatureEncoder
+from .forest_compiler import load_feature_names, load_model, predict_proba
+
+ENGINE_SECTION = 'ids'
+SMTP_SECTION = 'smtp'
+MODEL_FILE = os.path.join(MODELS_DIR, "NSL-KDD-RF-model.joblib")
+FEATURE_NAMES_FILE = os.path.join(MODELS_DIR, "feature_names.pkl")
+
+# Engine parameters that are not read from the [ids] section
+_NOT_CONFIGURABLE = ('self', 'smtp_config', 'email_from_database')
+# Engine parameters holding file system paths, made absolute before daemonizing
+PATH_PARAMETERS = ('model_path', 'feature_names_path', 'log_file', 'csv_output', 'traffic_store')
+# Engine parameters a SIGHUP applies without a restart
+RELOADABLE = ('model_path', 'feature_names_path')
+
+# Command line flag -> engine parameter
+FLAG_PARAMETERS = {
+    'model': 'model_path',
+    'feature_names': 'feature_names_path',
+    'interface': 'interface',
+    'filter': 'capture_filter',
+    'backend': 'capture_backend',
+    'fanout_group': 'fanout_group',
+    'fast_path': 'fast_path',
+    'detect_internal': 'detect_internal',
+    'workers': 'extraction_workers',
+    'dissect_workers': 'dissect_workers',
+    'inference_workers': 'inference_workers',
+    'batch_size': 'batch_size',
+    'emission': 'emission',
+    'format': 'record_format',
+    'csv': 'csv_output',
+    'store': 'traffic_store',
+    'log': 'log_file',
+}
+
+
+def engine_parameters() -> Dict[str, inspect.Parameter]:
+    parameters = inspect.signature(IntrusionDetectionSystem.__init__).parameters
+    return {name: parameter for name, parameter in parameters.items() if name not in _NOT_CONFIGURABLE}
+
+
+def _coerce(name: str, value: str, default):
+    # Config values are typed after the engine parameter's default
+    if isinstance(default, bool):
+        state = configparser.ConfigParser.BOOLEAN_STATES.get(value.lower())
+        if state is None:
+            raise ValueError(f"{name}: expected a boolean, got {value!r}")
+        return state
+    if value.lower() in ('', 'none'):
+        return None
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    if default is None:  # optional number or string
+        for convert in (int, float):
+            try:
+                return convert(value)
+            except ValueError:
+                pass
+    return value
+
+
+def read_config(path: Optional[str]) -> Tuple[Dict, Optional[SMTPConfig]]:
+    # Returns (engine keyword arguments, SMTP settings) from an INI file with
+    # an [ids] section of engine parameters and an optional [smtp] section
+    parser = configparser.ConfigParser()
+    if path and not parser.read(path):
+        raise FileNotFoundError(f"Config file not found: {path}")
+    parameters = engine_parameters()
+    engine = {}
+    if parser.has_section(ENGINE_SECTION):
+        for name, value in parser.items(ENGINE_SECTION):
+            parameter = parameters.get(name)
+            if parameter is None:
+                raise ValueError(f"Unknown setting in [{ENGINE_SECTION}]: {name}")
+            default = None if parameter.default is inspect.Parameter.empty else parameter.default
+            engine[name] = _coerce(name, value, default)
+
+    smtp = None
+    if parser.has_section(SMTP_SECTION):
+        section = parser[SMTP_SECTION]
+        smtp = SMTPConfig(section['server'], section.getint('port', 587), section['sender'],
+                          section['recipient'], section.get('password', ''),
+                          section.getboolean('starttls', True))
+    return engine, smtp
+
+
+def engine_settings(args) -> Tuple[Dict, Optional[SMTPConfig]]:
+    # Config file values, overridden by the command line flags that were given
+    engine, smtp = read_config(args.config)
+    engine.setdefault('model_path', MODEL_FILE)
+    engine.setdefault('feature_names_path', FEATURE_NAMES_FILE)
+    for flag, name in FLAG_PARAMETERS.items():
+        value = getattr(args, flag, None)
+        if value is not None:
+            engine[name] = value
+    if getattr(args, 'no_email', False):
+        smtp = None
+    return engine, smtp
+
+
+def absolute_paths(engine: Dict) -> Dict:
+    return {name: os.path.abspath(value) if name in PATH_PARAMETERS and isinstance(value, str) else value
+            for name, value in engine.items()}
+
+
+def daemonize(pidfile: Optional[str] = None) -> None:
+    # Detaches from the terminal (double fork); the IDS logs to its log file
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    os.chdir('/')
+    os.umask(0o022)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for stream in (sys.stdin, sys.stdout, sys.stderr):
+        os.dup2(devnull, stream.fileno())
+    os.close(devnull)
+    if pidfile:
+        with open(pidfile, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+        atexit.register(lambda: os.path.exists(pidfile) and os.remove(pidfile))
+
+
+class SignalHandler:
+    # SIGTERM/SIGINT stop capture; the IDS then drains its pipeline, emits
+    # open flows and flushes its outputs before the process exits. SIGHUP
+    # re-reads the config file, swaps in the model file and applies new SMTP
+    # settings on a background thread, so capture never pauses.
+    def __init__(self, ids: IntrusionDetectionSystem, args, engine: Dict):
+        self.ids = ids
+        self.args = args
+        self.engine = engine
+        self.reload_lock = threading.Lock()
+
+    def install(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.reload)
+
+    def stop(self, signum, frame) -> None:
+        self.ids.logger.info(f"Received {signal.Signals(signum).name}, stopping")
+        self.ids.stop_flag.set()
+
+    def reload(self, signum, frame) -> None:
+        threading.Thread(target=self._reload, name="ids-reload", daemon=True).start()
+
+    def _reload(self) -> None:
+        if not self.reload_lock.acquire(blocking=False):
+            return  # a reload is already running
+        try:
+            engine, smtp = engine_settings(self.args)
+            engine = absolute_paths(engine)
+            self.ids.reload_model(engine['model_path'], engine['feature_names_path'])
+            if smtp != self.ids.smtp_config:
+                self.ids.set_smtp_config(smtp)
+            restart = sorted(name for name in set(engine) | set(self.engine)
+                             if name not in RELOADABLE and engine.get(name) != self.engine.get(name))
+            if restart:
+                self.ids.logger.warning(f"Changed settings need a restart: {', '.join(restart)}")
+            self.engine.update((name, engine[name]) for name in RELOADABLE)
+        except Exception as e:
+            self.ids.logger.error(f"Reload failed, keeping the current settings: {e}")
+        finally:
+            self.reload_lock.release()
+
+
+def _rows(reader: csv.DictReader, numeric_names: List[str], batch_size: int) -> Iterator[List[Tuple[Dict, Dict]]]:
+    # Yields batches of (input row, feature dict)
+    batch = []
+    for row in reader:
+        features = dict(row)
+        for name in numeric_names:
+            value = row.get(name)
+            features[name] = float(value) if value not in (None, '') else 0.0
+        batch.append((row, features))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def score_csv(source, output, model, encoder: FeatureEncoder, batch_size: int = 1000) -> Counter:
+    # Scores every row of a CSV file with feature columns (such as the
+    # traffic records the IDS writes) and writes it back with the model's
+    # prediction and confidence appended. Returns the count per prediction.
+    reader = csv.DictReader(source)
+    writer = csv.writer(output)
+    writer.writerow(list(reader.fieldnames or []) + ['prediction', 'confidence'])
+    counts = Counter()
+    matrix = np.zeros((batch_size, encoder.width), dtype=np.float32)
+    for batch in _rows(reader, encoder.numeric_names, batch_size):
+        probabilities = predict_proba(model, encoder.encode([features for _, features in batch], matrix))
+        best = probabilities.argmax(axis=1)
+        for (row, _), label, probability in zip(batch, model.classes_[best], probabilities.max(axis=1)):
+            writer.writerow([row[name] for name in reader.fieldnames] + [label, round(float(probability), 4)])
+            counts[str(label)] += 1
+    return counts
+
+
+def run_score(args) -> int:
+    engine, _ = engine_settings(args)
+    model = load_model(engine['model_path'])
+    encoder = FeatureEncoder(load_feature_names(engine['feature_names_path']))
+    batch_size = engine.get('batch_size') or 1000
+    with open(args.input, newline='') as source:
+        if args.output == '-':
+            counts = score_csv(source, sys.stdout, model, encoder, batch_size)
+        else:
+            with open(args.output, 'w', newline='') as output:
+                counts = score_csv(source, output, model, encoder, batch_size)
+    print(f"Scored {sum(counts.values())} rows: {dict(counts)}", file=sys.stderr)
+    return 0
+
+
+def run_engine(args) -> int:
+    # Live capture or pcap replay until the input ends or a signal stops it
+    engine, smtp = engine_settings(args)
+    engine = absolute_paths(engine)
+    if args.command == 'capture' and not engine.get('interface'):
+        print("No interface given: pass --interface or set interface in the config file", file=sys.stderr)
+        return 2
+    if args.command == 'capture' and engine.get('capture_filter'):
+        # Capturing everything instead of the requested traffic is not an option
+        try:
+            compile_expression(engine['capture_filter'], engine.get('interface'))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+    # SIGHUP re-reads args after the daemon changed to /
+    for flag in ('config', 'model', 'feature_names', 'csv', 'store', 'log'):
+        if getattr(args, flag, None):
+            setattr(args, flag, os.path.abspath(getattr(args, flag)))
+    if getattr(args, 'daemon', False):
+        daemonize(os.path.abspath(args.pidfile) if args.pidfile else None)
+
+    ids = IntrusionDetectionSystem(smtp_config=smtp, email_from_database=False, **engine)
+    SignalHandler(ids, args, engine).install()
+    if args.command == 'replay':
+        ids.start_replay(os.path.abspath(args.pcap), speed=args.speed)
+    else:
+        ids.start_detection(duration=args.duration)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-c', '--config', help="INI file with [ids] engine settings and an optional [smtp] section")
+    common.add_argument('--model', help="model file (.joblib or compiled .npz)")
+    common.add_argument('--feature-names', help="feature names file")
+    common.add_argument('--batch-size', type=int, help="records per pipeline batch")
+
+    engine = argparse.ArgumentParser(add_help=False)
+    engine.add_argument('-i', '--interface', help="network interface to capture on")
+    engine.add_argument('-f', '--filter', help="BPF filter expression, e.g. 'tcp port 80'")
+    engine.add_argument('--backend', choices=('socket', 'ring'),
+                        help="capture through a packet socket or a memory-mapped TPACKET_V3 ring")
+    engine.add_argument('--fanout-group', type=int,
+                        help="ring fanout group id; processes in one group split the traffic by flow")
+    engine.add_argument('--fast-path', action='store_true', default=None,
+                        help="dissect raw frames without scapy")
+    engine.add_argument('--detect-internal', action='store_true', default=None,
+                        help="also analyse traffic between private addresses")
+    engine.add_argument('--workers', type=int, help="feature extraction processes (0 extracts in-process)")
+    engine.add_argument('--dissect-workers', type=int, help="dissection threads")
+    engine.add_argument('--inference-workers', type=int, help="inference threads")
+    engine.add_argument('--emission', choices=('packet', 'flow'), help="score every packet or every connection")
+    engine.add_argument('--format', choices=('csv', 'columnar'), help="traffic record format")
+    engine.add_argument('--csv', help="traffic CSV file (csv format)")
+    engine.add_argument('--store', help="traffic store directory (columnar format)")
+    engine.add_argument('--log', help="IDS log file")
+    engine.add_argument('--no-email', action='store_true', help="ignore the [smtp] section")
+
+    parser = argparse.ArgumentParser(prog='ids', description="Run the intrusion detection engine without the web UI")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    capture = commands.add_parser('capture', parents=[common, engine], help="analyse live traffic")
+    capture.add_argument('--duration', type=float, help="stop after this many seconds")
+    capture.add_argument('--daemon', action='store_true', help="detach from the terminal")
+    capture.add_argument('--pidfile', help="write the daemon's process id to this file")
+
+    replay = commands.add_parser('replay', parents=[common, engine], help="analyse a pcap/pcapng file")
+    replay.add_argument('pcap', help="capture file")
+    replay.add_argument('--speed', type=float, help="replay speed (1.0 is real time; default as fast as possible)")
+
+    score = commands.add_parser('score', parents=[common], help="score a CSV file of feature records")
+    score.add_argument('input', help="CSV file with one column per feature")
+    score.add_argument('-o', '--output', default='-', help="scored CSV to write ('-' for stdout)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'score':
+        return run_score(args)
+    return run_engine(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
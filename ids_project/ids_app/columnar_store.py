@@ -0,0 +1,283 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .record_writer import TRAFFIC_FIELDS, BackgroundWriter
+
+CATEGORICAL_COLUMNS = ('protocol_type', 'service', 'flag', 'class')
+NUMERIC_COLUMNS = tuple(name for name, _ in TRAFFIC_FIELDS if name not in CATEGORICAL_COLUMNS)
+
+META_FILE = 'meta.json'
+SEGMENT_PREFIX = 'segment-'
+
+
+def _numeric_dtype(name: str) -> str:
+    # Rates and durations keep full precision so the CSV export matches the
+    # CSV writer exactly; everything else is a count
+    if name == 'duration' or name.endswith('_rate'):
+        return '<f8'
+    return '<i8'
+
+
+SCHEMA: Dict[str, str] = {'timestamp': '<f8'}
+SCHEMA.update((name, _numeric_dtype(name)) for name in NUMERIC_COLUMNS)
+SCHEMA.update((name, '<u2') for name in CATEGORICAL_COLUMNS)  # dictionary codes
+
+
+def columnar_row(record) -> tuple:
+    # (features, prediction) -> (timestamp, numeric values, categorical values)
+    features, prediction = record
+    return (features.get('timestamp') or time.time(),
+            [features.get(name, 0) for name in NUMERIC_COLUMNS],
+            [str(features.get(name, '')) for name in CATEGORICAL_COLUMNS[:-1]] + [str(prediction)])
+
+
+def _write_meta(directory: str, meta: Dict) -> None:
+    # Readers must never see a half-written index
+    path = os.path.join(directory, META_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+
+class ColumnarWriter(BackgroundWriter):
+    # Stores scored records as one directory per segment, holding a fixed-width
+    # little-endian file per column and a meta.json index with the row count,
+    # the timestamp range and the dictionaries of the categorical columns.
+    # Column files are preallocated to `segment_rows` and memory-mapped; a
+    # segment is sealed (truncated to its row count) once full or on close.
+    def __init__(self, directory: str, segment_rows: int = 1 << 20, flush_rows: int = 500,
+                 flush_interval: float = 1.0, queue_size: int = 10000):
+        super().__init__(columnar_row, flush_rows, flush_interval, queue_size, name="ids-columnar-writer")
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.segment_dir = None
+        self.columns: Dict[str, np.memmap] = {}
+        self.meta: Dict = {}
+        self.codes: Dict[str, Dict[str, int]] = {}
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # A segment left open by a crash is sealed; a restart always starts a new one
+        for segment in ColumnarStore(self.directory).segments(include_open=True):
+            if not segment.meta['sealed']:
+                _seal(segment.path, segment.meta)
+        self._new_segment()
+
+    def _close(self) -> None:
+        self._seal_current()
+
+    def _new_segment(self) -> None:
+        existing = [name for name in os.listdir(self.directory) if name.startswith(SEGMENT_PREFIX)]
+        number = max((int(name[len(SEGMENT_PREFIX):]) for name in existing), default=0) + 1
+        self.segment_dir = os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}")
+        os.makedirs(self.segment_dir)
+        self.columns = {name: np.memmap(os.path.join(self.segment_dir, f"{name}.bin"), dtype=dtype, mode='w+',
+                                        shape=(self.segment_rows,))
+                        for name, dtype in SCHEMA.items()}
+        self.codes = {name: {} for name in CATEGORICAL_COLUMNS}
+        self.meta = {'rows': 0, 'sealed': False, 'timestamp_min': None, 'timestamp_max': None,
+                     'columns': SCHEMA, 'dictionaries': {name: [] for name in CATEGORICAL_COLUMNS}}
+        _write_meta(self.segment_dir, self.meta)
+
+    def _seal_current(self) -> None:
+        if self.segment_dir is None:
+            return
+        for column in self.columns.values():
+            column.flush()
+        self.columns = {}
+        _seal(self.segment_dir, self.meta)
+        self.segment_dir = None
+
+    def _write_rows(self, rows: List) -> None:
+        while rows:
+            start = self.meta['rows']
+            chunk = rows[:self.segment_rows - start]
+            rows = rows[len(chunk):]
+            end = start + len(chunk)
+
+            timestamps = np.fromiter((row[0] for row in chunk), dtype=np.float64, count=len(chunk))
+            self.columns['timestamp'][start:end] = timestamps
+            numeric = np.array([row[1] for row in chunk], dtype=np.float64)
+            for index, name in enumerate(NUMERIC_COLUMNS):
+                self.columns[name][start:end] = numeric[:, index]
+            for index, name in enumerate(CATEGORICAL_COLUMNS):
+                codes = self.codes[name]
+                dictionary = self.meta['dictionaries'][name]
+                values = []
+                for row in chunk:
+                    value = row[2][index]
+                    code = codes.get(value)
+                    if code is None:
+                        code = codes[value] = len(dictionary)
+                        dictionary.append(value)
+                    values.append(code)
+                self.columns[name][start:end] = values
+
+            for column in self.columns.values():
+                column.flush()
+            self.meta['rows'] = end
+            low, high = float(timestamps.min()), float(timestamps.max())
+            if self.meta['timestamp_min'] is None:
+                self.meta['timestamp_min'], self.meta['timestamp_max'] = low, high
+            else:
+                self.meta['timestamp_min'] = min(self.meta['timestamp_min'], low)
+                self.meta['timestamp_max'] = max(self.meta['timestamp_max'], high)
+            _write_meta(self.segment_dir, self.meta)
+
+            if end >= self.segment_rows:
+                self._seal_current()
+                self._new_segment()
+
+
+def _seal(path: str, meta: Dict) -> None:
+    for name, dtype in meta['columns'].items():
+        column_path = os.path.join(path, f"{name}.bin")
+        if os.path.exists(column_path):
+            os.truncate(column_path, meta['rows'] * np.dtype(dtype).itemsize)
+    meta['sealed'] = True
+    _write_meta(path, meta)
+
+
+class Segment:
+    __slots__ = ('path', 'meta')
+
+    def __init__(self, path: str, meta: Dict):
+        self.path = path
+        self.meta = meta
+
+    @property
+    def rows(self) -> int:
+        return self.meta['rows']
+
+    def column(self, name: str) -> np.ndarray:
+        # Read-only view of the column; categorical columns return their codes
+        dtype = np.dtype(self.meta['columns'][name])
+        if not self.rows:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=dtype, mode='r', shape=(self.rows,))
+
+    def dictionary(self, name: str) -> np.ndarray:
+        return np.array(self.meta['dictionaries'][name], dtype=object)
+
+    def labels(self, name: str) -> np.ndarray:
+        return self.dictionary(name)[self.column(name)]
+
+    def time_mask(self, start: Optional[float], end: Optional[float]) -> Optional[np.ndarray]:
+        # None when every row of the segment is inside [start, end]
+        if not self.rows:
+            return None
+        if (start is None or self.meta['timestamp_min'] >= start) and \
+                (end is None or self.meta['timestamp_max'] <= end):
+            return None
+        timestamps = self.column('timestamp')
+        mask = np.ones(self.rows, dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps <= end
+        return mask
+
+
+class ColumnarStore:
+    # Read side of a ColumnarWriter directory. Segments are selected through
+    # their timestamp index, so time-bounded queries skip whole segments.
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def segments(self, start: Optional[float] = None, end: Optional[float] = None,
+                 include_open: bool = True) -> List[Segment]:
+        if not os.path.isdir(self.directory):
+            return []
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            meta_path = os.path.join(self.directory, name, META_FILE)
+            if not name.startswith(SEGMENT_PREFIX) or not os.path.exists(meta_path):
+                continue
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if not include_open and not meta['sealed']:
+                continue
+            if meta['rows'] and ((start is not None and meta['timestamp_max'] < start) or
+                                 (end is not None and meta['timestamp_min'] > end)):
+                continue
+            segments.append(Segment(os.path.join(self.directory, name), meta))
+        return segments
+
+    def count(self, start: Optional[float] = None, end: Optional[float] = None) -> int:
+        total = 0
+        for segment in self.segments(start, end):
+            mask = segment.time_mask(start, end)
+            total += segment.rows if mask is None else int(mask.sum())
+        return total
+
+    def value_counts(self, name: str, start: Optional[float] = None, end: Optional[float] = None) -> Counter:
+        # Occurrences of each value of a categorical column
+        counts = Counter()
+        for segment in self.segments(start, end):
+            codes = segment.column(name)
+            mask = segment.time_mask(start, end)
+            if mask is not None:
+                codes = codes[mask]
+            dictionary = segment.meta['dictionaries'][name]
+            for code, n in enumerate(np.bincount(codes, minlength=len(dictionary))):
+                if n:
+                    counts[dictionary[code]] += int(n)
+        return counts
+
+    def iter_rows(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[list]:
+        # Rows in the traffic CSV column order, class last
+        names = [name for name, _ in TRAFFIC_FIELDS] + ['class']
+        for segment in self.segments(start, end):
+            mask = segment.time_mask(start, end)
+            columns = []
+            for name in names:
+                values = segment.labels(name) if name in CATEGORICAL_COLUMNS else segment.column(name)
+                columns.append((values if mask is None else values[mask]).tolist())
+            yield from (list(row) for row in zip(*columns))
+
+    def export_csv(self, output, start: Optional[float] = None, end: Optional[float] = None) -> int:
+        # Writes the same layout as the traffic CSV to a path or file object
+        if isinstance(output, str):
+            with open(output, 'w', newline='') as f:
+                return self.export_csv(f, start, end)
+        writer = csv.writer(output)
+        writer.writerow([name for name, _ in TRAFFIC_FIELDS] + ['class'])
+        count = 0
+        for row in self.iter_rows(start, end):
+            writer.writerow(row)
+            count += 1
+        return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect or export a columnar traffic store")
+    parser.add_argument('store', help="traffic store directory")
+    parser.add_argument('--start', type=float, help="first timestamp to include (epoch seconds)")
+    parser.add_argument('--end', type=float, help="last timestamp to include (epoch seconds)")
+    parser.add_argument('--export', metavar='CSV', help="write the selected rows as CSV ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    store = ColumnarStore(args.store)
+    if args.export:
+        output = sys.stdout if args.export == '-' else args.export
+        count = store.export_csv(output, args.start, args.end)
+        if args.export != '-':
+            print(f"Exported {count} rows to {args.export}")
+        return 0
+
+    print(f"Rows: {store.count(args.start, args.end)}")
+    for name in CATEGORICAL_COLUMNS:
+        print(f"{name}: {dict(store.value_counts(name, args.start, args.end).most_common(5))}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Hands records to a background listener without formatting them on the
+    # calling thread. When the queue is full the record is counted and
+    # dropped instead of blocking the caller.
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in this process, so the record can be passed as
+        # is and formatted on the writer thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventFormatter(logging.Formatter):
+    # Records logged with extra={'event': {...}} become one compact JSON line;
+    # everything else keeps the plain text format.
+    def format(self, record: logging.LogRecord) -> str:
+        event = getattr(record, 'event', None)
+        if event is None:
+            return super().format(record)
+        entry = {'time': self.formatTime(record, self.datefmt), 'level': record.levelname,
+                 'message': record.getMessage()}
+        entry.update(event)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class RateLimiter:
+    # Token bucket allowing `rate` events per second with bursts of `burst`.
+    # rate=None allows everything, rate=0 nothing.
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate) if rate else 0.0
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.rate is None:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            self.suppressed += 1
+            return False
+
+
+_configured = {}  # 'log_file', 'handler', 'listener' of the active setup
+_configure_lock = threading.Lock()
+
+
+def configure_logging(log_file: str, level: int = logging.INFO, queue_size: int = 10000) -> DroppingQueueHandler:
+    # Routes the root logger through a single queue handler whose listener
+    # writes `log_file` on a background thread. Calling it again with the same
+    # file reuses the existing setup, so handlers are never stacked.
+    with _configure_lock:
+        if _configured.get('log_file') == log_file:
+            return _configured['handler']
+        _shutdown()
+
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(EventFormatter(LOG_FORMAT, DATE_FORMAT))
+        handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        listener = QueueListener(handler.queue, file_handler, respect_handler_level=True)
+        listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(level)
+        if not _configured.get('atexit'):
+            atexit.register(shutdown_logging)
+        _configured.update(log_file=log_file, handler=handler, listener=listener, file_handler=file_handler,
+                           atexit=True)
+        return handler
+
+
+def _shutdown() -> None:
+    handler = _configured.pop('handler', None)
+    if handler is None:
+        return
+    logging.getLogger().removeHandler(handler)
+    _configured.pop('listener').stop()  # writes out what is still queued
+    _configured.pop('file_handler').close()
+    _configured.pop('log_file', None)
+
+
+def shutdown_logging() -> None:
+    with _configure_lock:
+        _shutdown()
@@ -0,0 +1,85 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+CATEGORICAL_FEATURES = ('protocol_type', 'service', 'flag')
+
+# Extractor service names that the NSL-KDD training data spells differently
+SERVICE_ALIASES = {'https': 'http_443', 'pop3': 'pop_3', 'imap': 'imap4'}
+# Services the training data names per protocol, e.g. DNS over UDP
+PROTOCOL_SERVICES = {('udp', 'domain'): 'domain_u'}
+
+
+class FeatureEncoder:
+    # Turns feature dicts into model input rows. The column of every numeric
+    # feature and of every one-hot categorical value ("service_http") is
+    # looked up once from the model's feature names; encoding a batch is then
+    # one dict lookup per value and two NumPy assignments. Categorical values
+    # without a column of their own fall back to "<name>_other" if the model
+    # has one, or stay all zero.
+    def __init__(self, feature_names: Sequence[str]):
+        self.feature_names = list(feature_names)
+        self.width = len(self.feature_names)
+        self.numeric_names: List[str] = []
+        numeric_columns = []
+        self.categorical_columns: Dict[str, Dict[str, int]] = {name: {} for name in CATEGORICAL_FEATURES}
+        for column, name in enumerate(self.feature_names):
+            prefix = next((p for p in CATEGORICAL_FEATURES if name.startswith(p + '_')), None)
+            if prefix is None:
+                self.numeric_names.append(name)
+                numeric_columns.append(column)
+            else:
+                self.categorical_columns[prefix][name[len(prefix) + 1:]] = column
+        self.numeric_columns = np.array(numeric_columns, dtype=np.intp)
+        # Numeric columns are usually one contiguous run; a slice avoids fancy indexing
+        if numeric_columns and numeric_columns == list(range(numeric_columns[0], numeric_columns[-1] + 1)):
+            self.numeric_slice: Optional[slice] = slice(numeric_columns[0], numeric_columns[-1] + 1)
+        else:
+            self.numeric_slice = None
+        self.fallback = {prefix: columns.get('other') for prefix, columns in self.categorical_columns.items()}
+        self.resolved: Dict[tuple, Optional[int]] = {}  # (name, value, protocol) -> column
+
+    def categorical_column(self, name: str, value: str, protocol: str = '') -> Optional[int]:
+        columns = self.categorical_columns[name]
+        if name == 'service':
+            value = PROTOCOL_SERVICES.get((protocol, value)) or SERVICE_ALIASES.get(value, value)
+        column = columns.get(value)
+        return self.fallback[name] if column is None else column
+
+    def encode(self, batch: Sequence[Dict], out: Optional[np.ndarray] = None) -> np.ndarray:
+        # Fills rows 0..len(batch)-1 of `out` (float32, width columns) and
+        # returns that view; a new matrix is allocated when out is None
+        count = len(batch)
+        if out is None:
+            out = np.zeros((count, self.width), dtype=np.float32)
+        else:
+            out = out[:count]
+            out.fill(0)
+        if not count:
+            return out
+
+        names = self.numeric_names
+        values = np.array([[features.get(name, 0) for name in names] for features in batch], dtype=np.float32)
+        if self.numeric_slice is not None:
+            out[:, self.numeric_slice] = values
+        else:
+            out[:, self.numeric_columns] = values
+
+        rows, columns = [], []
+        resolved = self.resolved
+        for row, features in enumerate(batch):
+            protocol = features.get('protocol_type', '')
+            for name in CATEGORICAL_FEATURES:
+                value = features.get(name)
+                if value is None:
+                    continue
+                key = (name, value, protocol)
+                column = resolved.get(key, -1)
+                if column == -1:
+                    column = resolved[key] = self.categorical_column(name, value, protocol)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        if rows:
+            out[rows, columns] = 1.0
+        return out
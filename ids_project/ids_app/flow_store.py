@@ -0,0 +1,569 @@
+import socket
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .tcp_state import FLAG_NAMES, STATUS, SF
+
+_EMPTY = -1
+_COUNTER_MAX = 0xffff
+_BYTES_MAX = 0xffffffff  # byte counts saturate at 4 GiB, well above NSL-KDD's largest
+_RATE_SCALE = 200  # rates in steps of 0.005, exact for NSL-KDD's two decimals
+_REBASE_AFTER = 0x7fffffff / 1000  # seconds of 'I' milliseconds before the time base moves
+
+# Bits of FlowStore.bits
+ORIG_B = 0x01  # the initiator is endpoint b of the key
+LOGGED_IN = 0x02
+ROOT_SHELL = 0x04
+SU_ATTEMPTED = 0x08
+IS_HOST_LOGIN = 0x10
+IS_GUEST_LOGIN = 0x20
+
+PROTO_TCP = 6
+
+# Two-second window statistics as of the last packet, stored for flow records
+RATE_COLUMNS = ('serror_rate', 'srv_serror_rate', 'rerror_rate', 'srv_rerror_rate',
+                'same_srv_rate', 'diff_srv_rate', 'srv_diff_host_rate')
+# Per-connection content counters, saturating at the column's maximum: the
+# ones NSL-KDD keeps in single digits get one byte
+COUNTER_COLUMNS = (('urgent', 'B'), ('hot', 'H'), ('num_failed_logins', 'B'), ('num_compromised', 'H'),
+                   ('num_root', 'H'), ('num_file_creations', 'B'), ('num_shells', 'B'),
+                   ('num_access_files', 'B'), ('num_outbound_cmds', 'B'), ('wrong_fragment', 'B'))
+
+
+def ip_to_int(ip: str) -> int:
+    return int.from_bytes(socket.inet_aton(ip), 'big')
+
+
+def int_to_ip(value: int) -> str:
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+
+class SlotTable:
+    # Struct-of-arrays table: every field is an `array` column indexed by a
+    # slot id. Keys map to slots through an open-addressing index (linear
+    # probing with backward-shift deletion, so there are no tombstones) and
+    # released slots are reused from a free list. Columns start small and
+    # double up to `capacity`. A slot is live while its `live_column` is
+    # non-zero. Live slots are also chained in a doubly linked list from
+    # least to most recently used (lru_head .. lru_tail), so the eviction
+    # victim is found in O(1).
+    COLUMNS: Tuple[Tuple[str, str], ...] = ()
+    live_column = ''
+
+    def __init__(self, capacity: int, initial_size: int = 1024):
+        self.capacity = capacity
+        self.size = 0  # slots allocated in every column
+        self.top = 0  # slots handed out so far; the ones below are live or free
+        self.used = 0
+        self.free = array('i')
+        self.index = array('i')
+        self.lru_prev = array('i')
+        self.lru_next = array('i')
+        self.lru_head = self.lru_tail = _EMPTY
+        for name, code in self.COLUMNS:
+            setattr(self, name, array(code))
+        self._grow(max(1, min(capacity, initial_size)))
+
+    def __len__(self) -> int:
+        return self.used
+
+    @classmethod
+    def slot_bytes(cls) -> int:
+        # Column bytes per slot, including the LRU links but not the index
+        return sum(array(code).itemsize for _, code in cls.COLUMNS) + 2 * array('i').itemsize
+
+    def _key(self, slot: int) -> tuple:
+        raise NotImplementedError
+
+    def find(self, key: tuple) -> int:
+        index = self.index
+        mask = len(index) - 1
+        i = hash(key) & mask
+        while True:
+            slot = index[i]
+            if slot == _EMPTY:
+                return _EMPTY
+            if self._key(slot) == key:
+                return slot
+            i = (i + 1) & mask
+
+    def _allocate(self, key: tuple) -> int:
+        # Returns a fresh slot for `key` (not yet indexed: the caller fills the
+        # key columns first), or _EMPTY when the table is full
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.top == self.size:
+                if self.size >= self.capacity:
+                    return _EMPTY
+                self._grow(min(self.capacity, self.size * 2))
+            slot = self.top
+            self.top += 1
+        self.used += 1
+        self._link(slot)
+        return slot
+
+    def _insert(self, slot: int, key: tuple) -> None:
+        index = self.index
+        mask = len(index) - 1
+        i = hash(key) & mask
+        while index[i] != _EMPTY:
+            i = (i + 1) & mask
+        index[i] = slot
+
+    def _release(self, slot: int) -> None:
+        self._unlink(slot)
+        self._unindex(slot)
+        for name, _ in self.COLUMNS:
+            getattr(self, name)[slot] = 0
+        self.free.append(slot)
+        self.used -= 1
+
+    def _unindex(self, slot: int) -> None:
+        index = self.index
+        mask = len(index) - 1
+        i = hash(self._key(slot)) & mask
+        while index[i] != slot:
+            i = (i + 1) & mask
+        # Shift later entries of the probe run back into the hole
+        j = i
+        while True:
+            j = (j + 1) & mask
+            other = index[j]
+            if other == _EMPTY:
+                break
+            home = hash(self._key(other)) & mask
+            if (i < j and i < home <= j) or (i > j and (home > i or home <= j)):
+                continue
+            index[i] = other
+            i = j
+        index[i] = _EMPTY
+
+    def _link(self, slot: int) -> None:
+        # Appends a slot at the most recently used end of the list
+        tail = self.lru_tail
+        self.lru_prev[slot] = tail
+        self.lru_next[slot] = _EMPTY
+        if tail == _EMPTY:
+            self.lru_head = slot
+        else:
+            self.lru_next[tail] = slot
+        self.lru_tail = slot
+
+    def _unlink(self, slot: int) -> None:
+        prev, next_ = self.lru_prev[slot], self.lru_next[slot]
+        if prev == _EMPTY:
+            self.lru_head = next_
+        else:
+            self.lru_next[prev] = next_
+        if next_ == _EMPTY:
+            self.lru_tail = prev
+        else:
+            self.lru_prev[next_] = prev
+
+    def _touch(self, slot: int) -> None:
+        # Marks a slot as most recently used
+        if slot != self.lru_tail:
+            self._unlink(slot)
+            self._link(slot)
+
+    def _grow(self, size: int) -> None:
+        extra = size - self.size
+        for name, code in self.COLUMNS:
+            column = getattr(self, name)
+            column.frombytes(bytes(extra * column.itemsize))
+        for column in (self.lru_prev, self.lru_next):
+            column.frombytes(bytes(extra * column.itemsize))
+        self.size = size
+
+        # Keep the index at most half full
+        index_size = 8
+        while index_size < size * 2:
+            index_size *= 2
+        old = self.index
+        self.index = array('i', [_EMPTY]) * index_size
+        for slot in old:
+            if slot != _EMPTY:
+                self._insert(slot, self._key(slot))
+
+    def live_slots(self) -> np.ndarray:
+        return np.nonzero(self.snapshot(self.live_column))[0]
+
+    def snapshot(self, name: str) -> np.ndarray:
+        # Copy of a column over the slots handed out so far (free slots read
+        # as 0), for vectorized aggregation
+        column = getattr(self, name)
+        return np.frombuffer(column, dtype=column.typecode, count=self.top).copy()
+
+
+class FlowStore(SlotTable):
+    # Connection table. The key is the canonical bidirectional 4-tuple
+    # (ip_a, ip_b, port_a << 16 | port_b, proto) of integers. Times are kept
+    # as milliseconds since `epoch`, which moves forward before they overflow.
+    # Flows expire after `idle_timeout` seconds without packets or
+    # `active_timeout` seconds after they started. Expiry is driven by a
+    # hashed timer wheel with `tick` seconds of packet time per wheel slot,
+    # kept intrusively: `wheel` holds the first flow of every wheel slot and
+    # the flows of one wheel slot are chained through wheel_next/wheel_prev
+    # (the first one's wheel_prev encodes the wheel slot). Every flow sits in
+    # the wheel slot of its earliest possible deadline, touching a flow does
+    # not move it, and when its wheel slot fires the real deadline is
+    # re-checked and the flow is either expired or rescheduled. When the
+    # table is full, the least recently active flow is evicted.
+    COLUMNS = ((('ip_a', 'I'), ('ip_b', 'I'), ('ports', 'I'), ('proto', 'B'),
+                ('start_ms', 'I'), ('last_ms', 'I'),
+                ('src_bytes', 'I'), ('dst_bytes', 'I'), ('src_packets', 'I'), ('dst_packets', 'I'),
+                ('tcp_state', 'B'), ('bits', 'B'), ('count', 'H'), ('srv_count', 'H'))
+               + tuple((name, 'B') for name in RATE_COLUMNS)
+               + COUNTER_COLUMNS
+               + (('interim_intervals', 'H'), ('host_entry', 'H'), ('window_bucket', 'I'),
+                  ('wheel_next', 'i'), ('wheel_prev', 'i')))
+    live_column = 'last_ms'
+
+    def __init__(self, idle_timeout: float = 30.0, active_timeout: float = 300.0, max_flows: int = 100000,
+                 tick: float = 1.0, wheel_size: int = 512,
+                 on_expire: Optional[Callable[[int, str], None]] = None):
+        super().__init__(max_flows)
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.tick = tick
+        self.on_expire = on_expire
+        self.wheel = array('i', [_EMPTY]) * wheel_size
+        self.current_tick: Optional[int] = None
+        self.epoch: Optional[float] = None
+        self.latest = _EMPTY
+        self.evicted = {'idle': 0, 'active': 0, 'lru': 0}
+
+    def _key(self, slot: int) -> tuple:
+        return (self.ip_a[slot], self.ip_b[slot], self.ports[slot], self.proto[slot])
+
+    def start_time(self, slot: int) -> float:
+        return self.epoch + self.start_ms[slot] / 1000
+
+    def last_time(self, slot: int) -> float:
+        return self.epoch + self.last_ms[slot] / 1000
+
+    def duration(self, slot: int) -> float:
+        return (self.last_ms[slot] - self.start_ms[slot]) / 1000
+
+    def _ms(self, now: float) -> int:
+        # Never 0: a zero last_ms marks a free slot
+        if self.epoch is None:
+            self.epoch = now - 1.0
+        elif now - self.epoch > _REBASE_AFTER:
+            self._rebase(now)
+        return max(1, int(round((now - self.epoch) * 1000)))
+
+    def _rebase(self, now: float) -> None:
+        # Moves the epoch up to shortly before the oldest flow that can still
+        # be open; anything older is clamped
+        keep = min(2 * (self.idle_timeout + self.active_timeout), _REBASE_AFTER / 2)
+        shift = int((now - self.epoch - keep) * 1000)
+        self.epoch += shift / 1000
+        for column in (self.start_ms, self.last_ms):
+            times = np.frombuffer(column, dtype=np.uint32, count=self.top)
+            live = times != 0
+            times[live] = np.maximum(times[live].astype(np.int64) - shift, 1)
+            del times  # release the buffer so the column can grow
+
+    def lookup(self, key: tuple, now: float) -> int:
+        # Returns the slot of `key`, creating the flow if needed. Flows that
+        # timed out are expired first.
+        self.advance(now)
+        slot = self.find(key)
+        ms = self._ms(now)
+        if slot == _EMPTY:
+            slot = self._allocate(key)
+            if slot == _EMPTY:
+                self.end(self.lru_head, 'lru')
+                slot = self._allocate(key)
+            self.ip_a[slot], self.ip_b[slot], self.ports[slot], self.proto[slot] = key
+            self._insert(slot, key)
+            self.start_ms[slot] = self.last_ms[slot] = ms
+            self.wheel_prev[slot] = _EMPTY
+            self._schedule(slot, now + min(self.idle_timeout, self.active_timeout))
+        else:
+            self._touch(slot)
+            self.last_ms[slot] = ms
+        self.latest = slot
+        return slot
+
+    def advance(self, now: float) -> None:
+        # Fires the wheel slots of every tick up to `now`
+        now_tick = int(now / self.tick)
+        if self.current_tick is None:
+            self.current_tick = now_tick
+            return
+        if now_tick <= self.current_tick:
+            return
+
+        wheel = self.wheel
+        wheel_size = len(wheel)
+        start = max(self.current_tick + 1, now_tick - wheel_size + 1)
+        self.current_tick = now_tick
+        for t in range(start, now_tick + 1):
+            index = t % wheel_size
+            later = []  # flows due in a later revolution of the wheel
+            while wheel[index] != _EMPTY:
+                slot = wheel[index]
+                self._unschedule(slot)
+                idle_deadline = self.last_time(slot) + self.idle_timeout
+                deadline = min(idle_deadline, self.start_time(slot) + self.active_timeout)
+                if deadline <= now:
+                    self.end(slot, 'idle' if idle_deadline <= now else 'active')
+                elif self._due(deadline) % wheel_size == index:
+                    later.append(slot)
+                else:
+                    self._schedule(slot, deadline)
+            for slot in later:
+                self._wheel_link(slot, index)
+
+    def _due(self, deadline: float) -> int:
+        due = int(deadline / self.tick) + 1
+        if self.current_tick is not None and due <= self.current_tick:
+            due = self.current_tick + 1
+        return due
+
+    def _schedule(self, slot: int, deadline: float) -> None:
+        self._wheel_link(slot, self._due(deadline) % len(self.wheel))
+
+    def _wheel_link(self, slot: int, index: int) -> None:
+        head = self.wheel[index]
+        self.wheel_next[slot] = head
+        self.wheel_prev[slot] = -2 - index
+        if head != _EMPTY:
+            self.wheel_prev[head] = slot
+        self.wheel[index] = slot
+
+    def _unschedule(self, slot: int) -> None:
+        prev, next_ = self.wheel_prev[slot], self.wheel_next[slot]
+        if prev == _EMPTY:
+            return  # not in the wheel
+        if prev < 0:
+            self.wheel[-2 - prev] = next_
+        else:
+            self.wheel_next[prev] = next_
+        if next_ != _EMPTY:
+            self.wheel_prev[next_] = prev
+        self.wheel_prev[slot] = _EMPTY
+
+    def end(self, slot: int, reason: str) -> None:
+        # Ends a flow, e.g. on timeout or TCP FIN/RST
+        self.evicted[reason] = self.evicted.get(reason, 0) + 1
+        if self.on_expire is not None:
+            self.on_expire(slot, reason)
+        if self.latest == slot:
+            self.latest = _EMPTY
+        self._release(slot)
+
+    def _release(self, slot: int) -> None:
+        self._unschedule(slot)
+        super()._release(slot)
+
+    def expire_all(self, reason: str = 'idle') -> None:
+        # Oldest first
+        while self.lru_head != _EMPTY:
+            self.end(self.lru_head, reason)
+
+    def memory_bytes(self) -> int:
+        # Bytes held by the columns, links, index, free list and wheel
+        arrays = [getattr(self, name) for name, _ in self.COLUMNS]
+        arrays += [self.lru_prev, self.lru_next, self.index, self.free, self.wheel]
+        return sum(column.itemsize * len(column) for column in arrays)
+
+    def endpoints(self, slot: int) -> Tuple[str, str, int, int]:
+        # (src_ip, dst_ip, src_port, dst_port) with the initiator as source
+        ports = self.ports[slot]
+        a = (int_to_ip(self.ip_a[slot]), ports >> 16)
+        b = (int_to_ip(self.ip_b[slot]), ports & 0xffff)
+        src, dst = (b, a) if self.bits[slot] & ORIG_B else (a, b)
+        return src[0], dst[0], src[1], dst[1]
+
+    def flag(self, slot: int) -> int:
+        return STATUS[self.tcp_state[slot]] if self.proto[slot] == PROTO_TCP else SF
+
+    def flag_name(self, slot: int) -> str:
+        return FLAG_NAMES[self.flag(slot)]
+
+    def add_counter(self, name: str, slot: int, n: int = 1) -> None:
+        column = getattr(self, name)
+        column[slot] = min((1 << 8 * column.itemsize) - 1, column[slot] + n)
+
+    def add_bytes(self, slot: int, forward: bool, n: int) -> None:
+        # Counts a packet and its payload bytes in one direction
+        if forward:
+            self.src_bytes[slot] = min(_BYTES_MAX, self.src_bytes[slot] + n)
+            self.src_packets[slot] += 1
+        else:
+            self.dst_bytes[slot] = min(_BYTES_MAX, self.dst_bytes[slot] + n)
+            self.dst_packets[slot] += 1
+
+    def store_window(self, slot: int, stats: tuple) -> None:
+        # Keeps the two-second window statistics of the last packet
+        self.count[slot] = min(_COUNTER_MAX, stats[0])
+        self.srv_count[slot] = min(_COUNTER_MAX, stats[1])
+        (self.serror_rate[slot], self.srv_serror_rate[slot], self.rerror_rate[slot], self.srv_rerror_rate[slot],
+         self.same_srv_rate[slot], self.diff_srv_rate[slot], self.srv_diff_host_rate[slot]) = \
+            [int(round(rate * _RATE_SCALE)) for rate in stats[2:]]
+
+    def window(self, slot: int) -> tuple:
+        # Stored statistics in the order of TwoSecondWindow.stats()
+        return (self.count[slot], self.srv_count[slot], self.serror_rate[slot] / _RATE_SCALE,
+                self.srv_serror_rate[slot] / _RATE_SCALE, self.rerror_rate[slot] / _RATE_SCALE,
+                self.srv_rerror_rate[slot] / _RATE_SCALE, self.same_srv_rate[slot] / _RATE_SCALE,
+                self.diff_srv_rate[slot] / _RATE_SCALE, self.srv_diff_host_rate[slot] / _RATE_SCALE)
+
+
+class HostStore(SlotTable):
+    # Per destination host, a ring buffer over its last `window_size`
+    # connections (source address, ports and error bits, stored in flat
+    # columns of capacity * window_size entries) with running sums. The
+    # per-port counters of all hosts live in three shared dicts keyed by
+    # integers, so the dst_host_* rates never rescan a window. When the table
+    # is full, the least recently seen host is evicted.
+    COLUMNS = (('ip', 'I'), ('last_seen', 'd'), ('head', 'H'), ('length', 'H'),
+               ('serror', 'H'), ('rerror', 'H'))
+    WINDOW_COLUMNS = (('win_src', 'I'), ('win_ports', 'I'), ('win_err', 'B'))
+    live_column = 'last_seen'
+
+    def __init__(self, max_hosts: int = 10000, window_size: int = 100):
+        self.window_size = window_size
+        for name, code in self.WINDOW_COLUMNS:
+            setattr(self, name, array(code))
+        super().__init__(max_hosts, initial_size=256)
+        self.evicted = 0
+        # host slot << 16 | dst port -> [connections, serror, rerror]
+        self.port_counts: Dict[int, List[int]] = {}
+        # host slot << 16 | src port -> connections
+        self.src_port_counts: Dict[int, int] = {}
+        # host slot << 48 | dst port << 32 | src ip -> connections
+        self.port_src_counts: Dict[int, int] = {}
+
+    @classmethod
+    def slot_bytes(cls, window_size: int = 100) -> int:
+        return super().slot_bytes() + window_size * sum(array(code).itemsize for _, code in cls.WINDOW_COLUMNS)
+
+    def _key(self, slot: int) -> tuple:
+        return (self.ip[slot],)
+
+    def _grow(self, size: int) -> None:
+        extra = (size - self.size) * self.window_size
+        for name, _ in self.WINDOW_COLUMNS:
+            column = getattr(self, name)
+            column.frombytes(bytes(extra * column.itemsize))
+        super()._grow(size)
+
+    def lookup(self, ip: int, now: float) -> int:
+        key = (ip,)
+        slot = self.find(key)
+        if slot == _EMPTY:
+            slot = self._allocate(key)
+            if slot == _EMPTY:
+                self._release(self.lru_head)
+                self.evicted += 1
+                slot = self._allocate(key)
+            self.ip[slot] = ip
+            self._insert(slot, key)
+        else:
+            self._touch(slot)
+        self.last_seen[slot] = now
+        return slot
+
+    def add(self, slot: int, src_ip: int, src_port: int, dst_port: int, serror: bool, rerror: bool) -> int:
+        # Adds a connection to the host's window and returns the offset of its
+        # entry in the host's ring
+        offset = self.head[slot]
+        position = slot * self.window_size + offset
+        if self.length[slot] == self.window_size:
+            self._apply(slot, self.win_src[position], self.win_ports[position], self.win_err[position], -1)
+        else:
+            self.length[slot] += 1
+
+        ports = src_port << 16 | dst_port
+        err = (1 if serror else 0) | (2 if rerror else 0)
+        self.win_src[position], self.win_ports[position], self.win_err[position] = src_ip, ports, err
+        self._apply(slot, src_ip, ports, err, 1)
+        self.head[slot] = (offset + 1) % self.window_size
+        return offset
+
+    def update(self, slot: int, offset: int, src_ip: int, src_port: int, dst_port: int,
+               serror: bool, rerror: bool) -> None:
+        # Sets the error bits of a connection's entry when its status changed.
+        # Entries that already left the window (or whose host was evicted) are
+        # left alone.
+        err = (1 if serror else 0) | (2 if rerror else 0)
+        position = slot * self.window_size + offset
+        old = self.win_err[position]
+        if old == err:
+            return
+        age = (self.head[slot] - 1 - offset) % self.window_size
+        ports = src_port << 16 | dst_port
+        if age >= self.length[slot] or self.win_src[position] != src_ip or self.win_ports[position] != ports:
+            return
+        self._apply(slot, src_ip, ports, old, -1)
+        self.win_err[position] = err
+        self._apply(slot, src_ip, ports, err, 1)
+
+    def _apply(self, slot: int, src_ip: int, ports: int, err: int, n: int) -> None:
+        src_port, dst_port = ports >> 16, ports & 0xffff
+        if err & 1:
+            self.serror[slot] += n
+        if err & 2:
+            self.rerror[slot] += n
+
+        key = slot << 16 | dst_port
+        port = self.port_counts.get(key)
+        if port is None:
+            port = self.port_counts[key] = [0, 0, 0]
+        port[0] += n
+        port[1] += n if err & 1 else 0
+        port[2] += n if err & 2 else 0
+        if port[0] == 0:
+            del self.port_counts[key]
+
+        key = slot << 16 | src_port
+        same_src_port = self.src_port_counts.get(key, 0) + n
+        if same_src_port:
+            self.src_port_counts[key] = same_src_port
+        else:
+            del self.src_port_counts[key]
+
+        key = slot << 48 | dst_port << 32 | src_ip
+        same_src = self.port_src_counts.get(key, 0) + n
+        if same_src:
+            self.port_src_counts[key] = same_src
+        else:
+            del self.port_src_counts[key]
+
+    def stats(self, slot: int, src_ip: int, src_port: int, dst_port: int) -> Tuple:
+        # Returns (count, srv_count, same_srv_rate, diff_srv_rate,
+        #          same_src_port_rate, srv_diff_host_rate, serror_rate,
+        #          srv_serror_rate, rerror_rate, srv_rerror_rate)
+        count = self.length[slot] if slot != _EMPTY else 0
+        if not count:
+            return (0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+        port = self.port_counts.get(slot << 16 | dst_port, (0, 0, 0))
+        srv_count = port[0]
+        same_srv_rate = srv_count / count
+        if srv_count:
+            same_src = self.port_src_counts.get(slot << 48 | dst_port << 32 | src_ip, 0)
+            srv_diff_host_rate = (srv_count - same_src) / srv_count
+            srv_serror_rate = port[1] / srv_count
+            srv_rerror_rate = port[2] / srv_count
+        else:
+            srv_diff_host_rate = srv_serror_rate = srv_rerror_rate = 0.0
+
+        return (count, srv_count, same_srv_rate, 1.0 - same_srv_rate,
+                self.src_port_counts.get(slot << 16 | src_port, 0) / count, srv_diff_host_rate,
+                self.serror[slot] / count, srv_serror_rate, self.rerror[slot] / count, srv_rerror_rate)
+
+    def _release(self, slot: int) -> None:
+        start = slot * self.window_size
+        head, length = self.head[slot], self.length[slot]
+        for i in range(length):
+            position = start + (head - 1 - i) % self.window_size
+            self._apply(slot, self.win_src[position], self.win_ports[position], self.win_err[position], -1)
+        super()._release(slot)
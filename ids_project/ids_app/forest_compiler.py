@@ -0,0 +1,207 @@
+import argparse
+import sys
+import warnings
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+COMPILED_SUFFIX = '.npz'
+
+
+def _tree_order(tree, reorder: bool) -> List[int]:
+    # Node ids of one sklearn tree in their new order. sklearn stores trees
+    # depth first; breadth first keeps every level contiguous, which is what
+    # the level-by-level walk in CompiledForest touches.
+    if not reorder:
+        return list(range(tree.node_count))
+    order = []
+    queue = deque([0])
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        if tree.children_left[node] != -1:
+            queue.append(tree.children_left[node])
+            queue.append(tree.children_right[node])
+    return order
+
+
+class CompiledForest:
+    # A RandomForestClassifier flattened into NumPy node arrays. All trees
+    # share one set of arrays; roots holds the index of each tree's root.
+    # Leaves point to themselves, so a cursor that stops moving has reached
+    # its leaf.
+    __slots__ = ('classes_', 'n_features_in_', 'feature', 'threshold', 'left', 'right', 'value',
+                 'roots', 'depth')
+
+    def __init__(self, classes, n_features: int, feature, threshold, left, right, value, roots, depth: int):
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = int(n_features)
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.intp)
+        self.right = np.asarray(right, dtype=np.intp)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.depth = int(depth)
+
+    @classmethod
+    def from_sklearn(cls, model, reorder: bool = True) -> 'CompiledForest':
+        if getattr(model, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests can be compiled")
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            order = _tree_order(tree, reorder)
+            position = np.empty(tree.node_count, dtype=np.intp)
+            position[order] = np.arange(tree.node_count) + offset
+
+            is_leaf = tree.children_left[order] == -1
+            own = position[order]
+            features.append(np.where(is_leaf, 0, tree.feature[order]))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold[order]))
+            lefts.append(np.where(is_leaf, own, position[np.maximum(tree.children_left[order], 0)]))
+            rights.append(np.where(is_leaf, own, position[np.maximum(tree.children_right[order], 0)]))
+
+            # Per-tree class probabilities, as DecisionTreeClassifier.predict_proba
+            # returns them (older sklearn versions store raw counts)
+            value = tree.value[order, 0, :]
+            totals = value.sum(axis=1, keepdims=True)
+            if not np.allclose(totals[is_leaf], 1.0):
+                totals[totals == 0.0] = 1.0
+                value = value / totals
+            values.append(value)
+
+            roots.append(offset)
+            offset += tree.node_count
+            depth = max(depth, tree.max_depth)
+
+        return cls(model.classes_, model.n_features_in_, np.concatenate(features), np.concatenate(thresholds),
+                   np.concatenate(lefts), np.concatenate(rights), np.concatenate(values), roots, depth)
+
+    def predict_proba(self, X) -> np.ndarray:
+        # Trees compare float32 features against float64 thresholds, exactly
+        # like sklearn, and are summed in estimator order so the result is
+        # bit-identical to RandomForestClassifier.predict_proba.
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected input of shape (n, {self.n_features_in_}), got {X.shape}")
+
+        # One cursor per (sample, tree). Each step advances the cursors that
+        # are not on a leaf yet and drops the ones that just reached one.
+        n_trees = len(self.roots)
+        nodes = np.tile(self.roots, X.shape[0])
+        row_offsets = np.repeat(np.arange(X.shape[0]) * X.shape[1], n_trees)
+        flat_X = X.ravel()
+        active = np.arange(len(nodes))
+        for _ in range(self.depth):
+            current = nodes[active]
+            go_left = flat_X[row_offsets[active] + self.feature[current]] <= self.threshold[current]
+            nxt = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = nxt
+            active = active[nxt != current]
+            if not len(active):
+                break
+
+        nodes = nodes.reshape(X.shape[0], n_trees)
+        leaf_values = self.value[nodes]  # (samples, trees, classes)
+        proba = np.zeros((X.shape[0], len(self.classes_)), dtype=np.float64)
+        for tree in range(n_trees):
+            proba += leaf_values[:, tree]
+        proba /= n_trees
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def save(self, path: str) -> None:
+        np.savez(path, classes=self.classes_, n_features=self.n_features_in_, feature=self.feature,
+                 threshold=self.threshold, left=self.left, right=self.right, value=self.value,
+                 roots=self.roots, depth=self.depth)
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledForest':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['classes'], data['n_features'], data['feature'], data['threshold'], data['left'],
+                       data['right'], data['value'], data['roots'], data['depth'])
+
+
+def load_model(path: str, mmap_mode: Optional[str] = 'r'):
+    # Loads either a compiled forest (.npz) or a joblib-pickled sklearn model.
+    # The arrays of an uncompressed joblib file are memory-mapped instead of
+    # read, so loading is quick and the pages are shared between processes.
+    if path.endswith(COMPILED_SUFFIX):
+        return CompiledForest.load(path)
+    import joblib
+    with warnings.catch_warnings():
+        # compressed files cannot be mapped and are read as usual
+        warnings.filterwarnings("ignore", message="mmap_mode .* is not compatible")
+        return joblib.load(path, mmap_mode=mmap_mode)
+
+
+def predict_proba(model, X) -> np.ndarray:
+    # Scores a NumPy batch whose columns are in the model's feature order. An
+    # sklearn model fitted on a DataFrame warns that X has no feature names;
+    # that warning is only silenced for this call.
+    if not hasattr(model, 'feature_names_in_'):
+        return model.predict_proba(X)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        return model.predict_proba(X)
+
+
+def load_feature_names(path: str) -> List[str]:
+    import joblib
+    return list(joblib.load(path))
+
+
+def verify(model, compiled: CompiledForest, samples: int = 10000, seed: int = 0) -> Tuple[float, bool]:
+    # Scores random inputs spread around the split thresholds of every feature
+    # with both models. Returns the largest probability difference and whether
+    # all labels agree.
+    rng = np.random.default_rng(seed)
+    X = np.zeros((samples, compiled.n_features_in_), dtype=np.float32)
+    split = compiled.left != np.arange(len(compiled.left))
+    for f in range(compiled.n_features_in_):
+        thresholds = compiled.threshold[split & (compiled.feature == f)]
+        if len(thresholds):
+            picks = rng.choice(thresholds, samples)
+            X[:, f] = picks + rng.choice([-1.0, 0.0, 1.0], samples) * rng.random(samples)
+
+    expected = predict_proba(model, X)
+    actual = compiled.predict_proba(X)
+    labels_match = bool(np.array_equal(model.classes_[expected.argmax(axis=1)],
+                                       compiled.classes_[actual.argmax(axis=1)]))
+    return float(np.abs(expected - actual).max()), labels_match
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compile a RandomForest model into flat node arrays")
+    parser.add_argument('model', help="joblib file with a fitted RandomForestClassifier")
+    parser.add_argument('output', help=f"compiled model to write ({COMPILED_SUFFIX})")
+    parser.add_argument('--no-reorder', action='store_true', help="keep sklearn's depth-first node order")
+    parser.add_argument('--verify', action='store_true', help="check the compiled model against sklearn")
+    args = parser.parse_args(argv)
+
+    if not args.output.endswith(COMPILED_SUFFIX):
+        parser.error(f"output must end with {COMPILED_SUFFIX}")
+
+    model = load_model(args.model, mmap_mode=None)
+    compiled = CompiledForest.from_sklearn(model, reorder=not args.no_reorder)
+    compiled.save(args.output)
+    print(f"Compiled {len(compiled.roots)} trees, {len(compiled.feature)} nodes, depth {compiled.depth} "
+          f"into {args.output}")
+
+    if args.verify:
+        difference, labels_match = verify(model, CompiledForest.load(args.output))
+        print(f"Max probability difference: {difference:.3g}, labels match: {labels_match}")
+        if difference != 0.0 or not labels_match:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,70 +1,22 @@
-import scapy.all as scapy
-from scapy.layers.inet import IP, TCP, UDP, ICMP
-from scapy.layers.http import HTTP
-from scapy.layers.dns import DNS
-from scapy.layers.l2 import ARP
-from collections import defaultdict, deque
+from collections import OrderedDict
 import time
-import re
-from typing import Dict, Tuple, Set, List, Optional
-from dataclasses import dataclass, field
-
-
-@dataclass
-class Connection:
-    start_time: float = 0
-    last_time: float = 0
-    src_bytes: int = 0
-    dst_bytes: int = 0
-    count: int = 0
-    srv_count: int = 0
-    serror_rate: float = 0
-    srv_serror_rate: float = 0
-    rerror_rate: float = 0
-    srv_rerror_rate: float = 0
-    same_srv_rate: float = 0
-    diff_srv_rate: float = 0
-    srv_diff_host_rate: float = 0
-    urgent: int = 0
-    hot: int = 0
-    num_failed_logins: int = 0
-    logged_in: int = 0
-    num_compromised: int = 0
-    root_shell: int = 0
-    su_attempted: int = 0
-    num_root: int = 0
-    num_file_creations: int = 0
-    num_shells: int = 0
-    num_access_files: int = 0
-    num_outbound_cmds: int = 0
-    is_host_login: int = 0
-    is_guest_login: int = 0
-    land: int = 0
-    wrong_fragment: int = 0
-    same_srv_connections: List[Tuple] = field(default_factory=list)
-    diff_host_services: Set[int] = field(default_factory=set)
-    flags: List[str] = field(default_factory=list)
-
-
-@dataclass
-class HostStats:
-    count: int = 0
-    srv_count: int = 0
-    same_srv_rate: float = 0
-    diff_srv_rate: float = 0
-    same_src_port_rate: float = 0
-    srv_diff_host_rate: float = 0
-    serror_rate: float = 0
-    srv_serror_rate: float = 0
-    rerror_rate: float = 0
-    srv_rerror_rate: float = 0
-    last_port: int = 0
-    connections: deque = field(default_factory=lambda: deque(maxlen=100))
+from typing import Dict, Tuple, List, Optional
+from .traffic_windows import TwoSecondWindow
+from .flow_store import (FlowStore, HostStore, ip_to_int, ORIG_B, LOGGED_IN, ROOT_SHELL, SU_ATTEMPTED,
+                         IS_HOST_LOGIN, IS_GUEST_LOGIN)
+from .tcp_state import FLAG_NAMES, SERROR, RERROR, INITIATOR_BITS, RESPONDER_BITS, BOTH_FIN
+from .payload_scanner import PayloadScanner, load_signatures
+from .packet_dissector import (HeaderRecord, dissect_frame, record_from_packet,
+                               PROTO_ARP, PROTO_TCP, PROTO_UDP)
+
+# Feature records are emitted per packet or once per connection
+EMISSION_MODES = ('packet', 'flow')
 
 
 class NetworkFeatureExtractor:
-    __slots__ = ('interface', 'timeout', 'connections', 'host_stats',
-                 'recent_connections', 'two_second_connections', 'detect_internal')
+    __slots__ = ('interface', 'timeout', 'connections', 'hosts', 'two_second_window', 'detect_internal',
+                 'payload_scanner', 'emission', 'interim_packets', 'interim_interval', 'closed_linger',
+                 'closed', 'completed', 'clock')
 
     COMMON_PORTS = {
         80: 'http', 443: 'https', 22: 'ssh', 21: 'ftp', 20: 'ftp_data',
@@ -74,21 +26,37 @@ class NetworkFeatureExtractor:
 
     PROTOCOL_TYPES = {6: 'tcp', 17: 'udp', 1: 'icmp'}
 
-    def __init__(self, interface: str = "wlp1s0", timeout: int = 60, detect_internal: bool = False):
+    def __init__(self, interface: str = "wlp1s0", timeout: int = 60, detect_internal: bool = False,
+                 host_window_size: int = 100, flow_idle_timeout: float = 30.0,
+                 flow_active_timeout: float = 300.0, max_flows: int = 100000, max_hosts: int = 10000,
+                 signatures_path: Optional[str] = None, emission: str = 'packet', interim_packets: int = 0,
+                 interim_interval: Optional[float] = None, closed_linger: float = 2.0):
+        if emission not in EMISSION_MODES:
+            raise ValueError(f"Unknown emission mode: {emission}")
         self.interface = interface
         self.timeout = timeout
-        self.connections: Dict[Tuple, Connection] = defaultdict(Connection)
-        self.host_stats: Dict[str, HostStats] = defaultdict(HostStats)
-        self.recent_connections: deque = deque(maxlen=100)
-        self.two_second_connections: List[Tuple[Connection, float]] = []
+        # emission='flow' emits one record per connection when it ends (FIN,
+        # RST, idle or active timeout, eviction), plus an interim record every
+        # `interim_packets` packets or `interim_interval` seconds if set
+        self.emission = emission
+        self.interim_packets = interim_packets
+        self.interim_interval = interim_interval
+        self.closed_linger = closed_linger
+        self.closed: OrderedDict = OrderedDict()  # flows ended by FIN/RST -> end time
+        self.completed: List[Dict] = []
+        self.clock: Optional[Tuple[float, float]] = None  # (last packet time, time.monotonic() then)
+        # Connection and per-host state live in array columns indexed by slot
+        self.connections = FlowStore(idle_timeout=flow_idle_timeout, active_timeout=flow_active_timeout,
+                                     max_flows=max_flows,
+                                     on_expire=self._flow_expired if emission == 'flow' else None)
+        self.hosts = HostStore(max_hosts=max_hosts, window_size=host_window_size)
+        self.two_second_window = TwoSecondWindow()
         self.detect_internal = detect_internal
+        self.payload_scanner = PayloadScanner(load_signatures(signatures_path)) \
+            if signatures_path else PayloadScanner()
     
-    def _is_internal_traffic(self, packet: scapy.Packet) -> bool:
-        if IP in packet:
-            src_ip = packet[IP].src
-            dst_ip = packet[IP].dst
-            return self._is_internal_ip(src_ip) and self._is_internal_ip(dst_ip)
-        return False
+    def _is_internal_traffic(self, record: HeaderRecord) -> bool:
+        return self._is_internal_ip(record.src) and self._is_internal_ip(record.dst)
 
     @staticmethod
     def _is_internal_ip(ip: str) -> bool:
@@ -96,260 +64,330 @@ class NetworkFeatureExtractor:
                             '172.22.', '172.23.', '172.24.', '172.25.', '172.26.', '172.27.', 
                             '172.28.', '172.29.', '172.30.', '172.31.', '192.168.'))
         
-    def extract_features(self, packet: scapy.Packet) -> Optional[Dict]:
-        if ARP in packet:
+    def extract_features(self, packet: 'scapy.packet.Packet') -> Optional[Dict]:
+        record = record_from_packet(packet)
+        if record is None:
+            # If it's not an ARP or TCP/UDP/ICMP packet, return None
+            return None
+        return self.extract_record(record)
+
+    def extract_frame(self, frame, timestamp: float) -> Optional[Dict]:
+        # Fast path: parse the raw Ethernet frame without scapy
+        record = dissect_frame(frame, timestamp)
+        if record is None:
+            return None
+        return self.extract_record(record)
+
+    def extract_record(self, record: HeaderRecord) -> Optional[Dict]:
+        if record.proto == PROTO_ARP:
             # Handle ARP packets
-            return self._extract_arp_features(packet)
-        elif IP in packet:
-            if not self.detect_internal and self._is_internal_traffic(packet):
-                return None
-            
-            if TCP in packet or UDP in packet or ICMP in packet:
-                return self._extract_ip_features(packet)
-        
-        # If it's not an ARP or IP packet, return None
-        return None
+            return self._extract_arp_features(record)
 
-    def _extract_arp_features(self, packet: scapy.Packet) -> Dict:
+        if not self.detect_internal and self._is_internal_traffic(record):
+            return None
+        return self._extract_ip_features(record)
+
+    def _extract_arp_features(self, record: HeaderRecord) -> Dict:
         return {
             'protocol_type': 'arp',
-            'src_ip': packet[ARP].psrc,
-            'dst_ip': packet[ARP].pdst,
-            'operation': 'request' if packet[ARP].op == 1 else 'reply',
+            'src_ip': record.src,
+            'dst_ip': record.dst,
+            'timestamp': record.timestamp or time.time(),
+            'operation': 'request' if record.arp_op == 1 else 'reply',
             'service': 'none'  # Add a default service for ARP packets
         }
 
-    def _extract_ip_features(self, packet: scapy.Packet) -> Dict:
-        ip = packet[IP]
-        transport = packet.getlayer(TCP) or packet.getlayer(
-            UDP) or packet.getlayer(ICMP)
-
-        conn_key = self._get_connection_key(ip, transport)
-        conn = self.connections[conn_key]
-
-        current_time = time.time()
-
-        self._update_connection(conn, packet, current_time)
-        self._update_host_stats(ip.src, ip.dst, getattr(
-            transport, 'sport', 0), getattr(transport, 'dport', 0), ip.proto)
-
-        return self._extract_features_dict(ip, transport, conn, conn_key)
-
-    def _get_connection_key(self, ip: IP, transport) -> Tuple:
-        return (ip.src, ip.dst, getattr(transport, 'sport', 0), getattr(transport, 'dport', 0), ip.proto)
-
-    def _update_connection(self, conn: Connection, packet: scapy.Packet, current_time: float) -> None:
-        if conn.start_time == 0:
-            conn.start_time = current_time
-
-        conn.last_time = current_time
-        conn.src_bytes += len(packet)
-        conn.dst_bytes += len(packet.payload)
-
-        self._update_two_second_stats(conn)
-        self._update_connection_services(conn, packet)
-        self._update_urgent_and_hot(conn, packet)
-        self._update_additional_features(conn, packet)
-        self._update_flags(conn, packet)
-
-    def _update_two_second_stats(self, conn: Connection) -> None:
-        current_time = time.time()
-
-        self.two_second_connections = [
-            (c, t) for c, t in self.two_second_connections if current_time - t <= 2]
-        self.two_second_connections.append((conn, current_time))
-
-        conn.count = sum(
-            1 for c, _ in self.two_second_connections if c == conn)
-        conn.srv_count = sum(
-            1 for c, _ in self.two_second_connections if c.same_srv_connections == conn.same_srv_connections)
-
-    def _update_connection_services(self, conn: Connection, packet: scapy.Packet) -> None:
-        if TCP in packet or UDP in packet:
-            transport = packet[TCP] if TCP in packet else packet[UDP]
-            if transport.dport == transport.sport:
-                conn.same_srv_connections.append(
-                    (packet[IP].src, packet[IP].dst, transport.sport, transport.dport))
-            else:
-                conn.diff_host_services.add(transport.dport)
-
-    def _update_urgent_and_hot(self, conn: Connection, packet: scapy.Packet) -> None:
-        conn.urgent += self._get_urgent(packet)
-        conn.hot += self._get_hot(packet, conn)
-
-    def _detect_outbound_cmds(self, packet: scapy.Packet) -> int:
-        if TCP in packet and packet[TCP].dport == 80:  # HTTP traffic
-            payload = str(packet[TCP].payload)
-
-            # Check for HTTP layer
-            if HTTP in packet:
-                http_method = packet[HTTP].Method.decode() if hasattr(
-                    packet[HTTP], 'Method') else ""
-                http_path = packet[HTTP].Path.decode() if hasattr(
-                    packet[HTTP], 'Path') else ""
-
-                # Look for common HTTP-based command patterns
-                if http_method in ["GET", "POST"] and any(cmd in http_path.lower() for cmd in ["cmd", "exec", "command", "run"]):
+    def _extract_ip_features(self, record: HeaderRecord) -> Optional[Dict]:
+        src, dst = ip_to_int(record.src), ip_to_int(record.dst)
+        conn_key, from_a = self._get_connection_key(record, src, dst)
+        # All timing features follow the packet clock, so replayed captures
+        # give the same results as live traffic
+        current_time = record.timestamp or time.time()
+        self.clock = (current_time, time.monotonic())
+        if self.emission == 'flow' and self._is_closed(conn_key, record, current_time):
+            return None
+        flows = self.connections
+        slot = flows.lookup(conn_key, current_time)
+        new = not flows.src_packets[slot] and not flows.dst_packets[slot]
+        previous_flag = flows.flag(slot)
+
+        # Endpoints with the initiator as source
+        if self._update_connection(slot, record, from_a):
+            endpoints = (record.src, record.dst, record.sport, record.dport)
+        else:
+            endpoints = (record.dst, record.src, record.dport, record.sport)
+            src, dst = dst, src
+        flag = flows.flag(slot)
+        serror, rerror = SERROR[flag], RERROR[flag]
+        window = self._update_two_second_stats(slot, new, endpoints[1], endpoints[3], previous_flag, flag,
+                                               current_time)
+        host_stats = self._update_host_stats(slot, new, src, dst, endpoints[2], endpoints[3], serror, rerror,
+                                             current_time)
+
+        if self.emission == 'flow':
+            flows.store_window(slot, window)
+            self._track_flow(conn_key, slot, record, current_time)
+            return None
+        return self._extract_features_dict(slot, endpoints, flag, window, host_stats, current_time)
+
+    def _track_flow(self, conn_key: Tuple, slot: int, record: HeaderRecord, current_time: float) -> None:
+        flows = self.connections
+
+        # The connection ends on RST or once both sides sent FIN
+        rst = record.proto == PROTO_TCP and (record.tcp_flags or 0) & 0x04
+        if rst or flows.tcp_state[slot] & BOTH_FIN == BOTH_FIN:
+            # Trailing ACKs and retransmissions of the closed flow are ignored
+            # for a while instead of opening a new one
+            self.closed[conn_key] = current_time
+            self.closed.move_to_end(conn_key)
+            while len(self.closed) > flows.capacity:
+                self.closed.popitem(last=False)
+            flows.end(slot, 'rst' if rst else 'fin')
+            return
+
+        # Interim records every interim_packets packets and at every multiple
+        # of interim_interval since the flow started
+        packets = flows.src_packets[slot] + flows.dst_packets[slot]
+        intervals = int(flows.duration(slot) / self.interim_interval) if self.interim_interval else 0
+        if (self.interim_packets and packets % self.interim_packets == 0) or \
+                intervals > flows.interim_intervals[slot]:
+            flows.interim_intervals[slot] = max(flows.interim_intervals[slot], min(0xffff, intervals))
+            self.completed.append(self._flow_record(slot, 'interim'))
+
+    def _is_closed(self, conn_key: Tuple, record: HeaderRecord, current_time: float) -> bool:
+        closed = self.closed
+        while closed:
+            key, ended = next(iter(closed.items()))
+            if current_time - ended < self.closed_linger:
+                break
+            del closed[key]
+        if conn_key not in closed:
+            return False
+        if record.tcp_flags is not None and record.tcp_flags & 0x02:  # SYN: the 5-tuple is reused
+            del closed[conn_key]
+            return False
+        return True
+
+    def _flow_expired(self, slot: int, reason: str) -> None:
+        self.completed.append(self._flow_record(slot, reason))
+
+    def _flow_record(self, slot: int, reason: str) -> Dict:
+        flows = self.connections
+        endpoints = flows.endpoints(slot)
+        src, dst = flows.ip_a[slot], flows.ip_b[slot]
+        if flows.bits[slot] & ORIG_B:
+            src, dst = dst, src
+        host_stats = self.hosts.stats(self.hosts.find((dst,)), src, endpoints[2], endpoints[3])
+        features = self._extract_features_dict(slot, endpoints, flows.flag(slot), flows.window(slot), host_stats,
+                                               flows.last_time(slot))
+        features['flow_end'] = reason
+        features['packets'] = flows.src_packets[slot] + flows.dst_packets[slot]
+        return features
+
+    def pop_completed(self) -> List[Dict]:
+        # Flow records emitted since the last call
+        completed, self.completed = self.completed, []
+        return completed
+
+    def tick(self, now: Optional[float] = None) -> List[Dict]:
+        # Expires flows without waiting for the next packet, so connections
+        # on a quiet link still end on time. `now` is in packet time and
+        # defaults to the last packet's timestamp plus the wall-clock time
+        # since it was processed. Returns the flow records emitted.
+        if now is None:
+            if self.clock is None:
+                return []
+            packet_time, seen = self.clock
+            now = packet_time + time.monotonic() - seen
+        self.connections.advance(now)
+        return self.pop_completed()
+
+    def flush(self) -> List[Dict]:
+        # Ends every tracked flow, e.g. when capture stops
+        if self.emission == 'flow':
+            self.connections.expire_all('flush')
+        return self.pop_completed()
+
+    @staticmethod
+    def _get_connection_key(record: HeaderRecord, src: int, dst: int) -> Tuple[Tuple, bool]:
+        # Both directions of a conversation share one key: the endpoints in
+        # sorted order (a, b), protocol last. Also returns whether the packet
+        # was sent by endpoint a.
+        if (src, record.sport) <= (dst, record.dport):
+            return (src, dst, record.sport << 16 | record.dport, record.proto), True
+        return (dst, src, record.dport << 16 | record.sport, record.proto), False
+
+    @staticmethod
+    def _sent_by_initiator(record: HeaderRecord) -> bool:
+        # For the first packet seen of a connection. A SYN-ACK or a packet from
+        # a well-known port to an ephemeral one (capture started mid-flow) comes
+        # from the responder.
+        if record.proto == PROTO_TCP and record.tcp_flags is not None and record.tcp_flags & 0x12 == 0x12:
+            return False
+        return not (record.sport < 1024 <= record.dport)
+
+    def _update_connection(self, slot: int, record: HeaderRecord, from_a: bool) -> bool:
+        # Returns whether the packet was sent by the initiator
+        flows = self.connections
+        if not flows.src_packets[slot] and not flows.dst_packets[slot]:
+            if (not from_a) == self._sent_by_initiator(record):
+                flows.bits[slot] |= ORIG_B
+
+        # NSL-KDD counts data bytes in each direction
+        forward = from_a != bool(flows.bits[slot] & ORIG_B)
+        flows.add_bytes(slot, forward, len(record.payload))
+        if record.proto == PROTO_TCP and record.tcp_flags is not None:
+            flows.tcp_state[slot] |= (INITIATOR_BITS if forward else RESPONDER_BITS)[record.tcp_flags]
+        if record.wrong_fragment:
+            flows.add_counter('wrong_fragment', slot, record.wrong_fragment)
+
+        hits = self.payload_scanner.scan(record.payload)
+
+        self._update_urgent_and_hot(slot, record, hits)
+        self._update_additional_features(slot, record, hits)
+        return forward
+
+    def _update_two_second_stats(self, slot: int, new: bool, dst_ip: str, dst_port: int, previous_flag: int,
+                                 flag: int, current_time: float) -> Tuple:
+        # Like the host window, counts connections rather than packets, each
+        # with the error bits of its current status
+        window = self.two_second_window
+        flows = self.connections
+        if new:
+            flows.window_bucket[slot] = window.add(dst_ip, dst_port, SERROR[flag], RERROR[flag], current_time)
+        else:
+            window.advance(current_time)
+            old = (SERROR[previous_flag], RERROR[previous_flag])
+            current = (SERROR[flag], RERROR[flag])
+            if old != current:
+                window.update(flows.window_bucket[slot], dst_ip, dst_port, old, current)
+        return window.stats(dst_ip, dst_port)
+
+    def _update_urgent_and_hot(self, slot: int, record: HeaderRecord, hits: Dict[str, int]) -> None:
+        if record.urgptr:
+            self.connections.add_counter('urgent', slot, self._get_urgent(record))
+        if hits:
+            self.connections.add_counter('hot', slot, self._get_hot(hits, slot))
+
+    def _detect_outbound_cmds(self, record: HeaderRecord, hits: Dict[str, int]) -> int:
+        if record.proto == PROTO_TCP and record.dport == 80:  # HTTP traffic
+            # Look for common HTTP-based command patterns in the request line
+            payload = record.payload
+            if payload.startswith((b'GET ', b'POST ')):
+                http_path = payload.split(b' ', 2)[1].lower()
+                if any(cmd in http_path for cmd in (b'cmd', b'exec', b'command', b'run')):
                     return 1
 
             # Check for common command patterns in the payload
-            command_patterns = [
-                r"\bexec\b",
-                r"\beval\b",
-                r"\bsystem\b",
-                r"\bshell_exec\b",
-                r"\bpassthru\b",
-                r"\bcmd\.exe\b",
-                r"\bbash\b",
-                r"\bsh\b",
-                r"/bin/",
-                r"\bcurl\b",
-                r"\bwget\b"
-            ]
-
-            if any(re.search(pattern, payload, re.IGNORECASE) for pattern in command_patterns):
+            if hits.get('outbound_cmds'):
                 return 1
 
-        elif DNS in packet:  # DNS traffic
-            if packet[DNS].qr == 0:  # DNS query
-                query = packet[DNS].qd.qname.decode()
+        elif record.proto == PROTO_UDP and record.dport == 53 and record.payload:  # DNS traffic
+            # Only DNS needs a full dissection, leave it to scapy
+            from scapy.layers.dns import DNS
+            dns = DNS(record.payload)
+            if dns.qr == 0 and dns.qd:  # DNS query
+                query = dns.qd.qname.decode(errors='replace')
                 # Look for potential command and control domain patterns
                 if any(pattern in query for pattern in [".dyndns.", ".no-ip.", ".serveo.net"]):
                     return 1
 
         return 0
 
-    def _update_additional_features(self, conn: Connection, packet: scapy.Packet) -> None:
-        payload = str(packet.payload)
+    def _update_additional_features(self, slot: int, record: HeaderRecord, hits: Dict[str, int]) -> None:
+        flows = self.connections
+        if hits:
+            if hits.get('num_file_creations'):
+                flows.add_counter('num_file_creations', slot)
 
-        if 'create' in payload or 'touch' in payload or 'mkdir' in payload or 'mkfile' in payload:
-            conn.num_file_creations += 1
+            if hits.get('is_host_login'):
+                flows.bits[slot] |= IS_HOST_LOGIN
 
-        if 'rlogin' in payload or 'rsh' in payload or 'telnet' in payload:
-            conn.is_host_login = 1
+            if hits.get('is_guest_login'):
+                flows.bits[slot] |= IS_GUEST_LOGIN
 
-        if 'guest' in payload or 'anonymous' in payload:
-            conn.is_guest_login = 1
+            if hits.get('num_compromised'):
+                flows.add_counter('num_compromised', slot)
 
-        if any(word in payload for word in ['rootkit', 'exploit', 'vulnerab', 'backdoor']):
-            conn.num_compromised += 1
+            if hits.get('num_root'):
+                flows.add_counter('num_root', slot)
 
-        if 'root' in payload or 'sudo' in payload or 'su' in payload:
-            conn.num_root += 1
+            if hits.get('logged_in'):
+                flows.bits[slot] |= LOGGED_IN
 
-        if 'login successful' in payload or 'authenticated' in payload:
-            conn.logged_in = 1
-
-        if any(word in payload for word in ['chmod', 'chown', 'ls -l', 'ls -la']):
-            conn.num_access_files += 1
+            if hits.get('num_access_files'):
+                flows.add_counter('num_access_files', slot)
 
         # Update num_outbound_cmds
-        conn.num_outbound_cmds += self._detect_outbound_cmds(packet)
-
-    def _update_flags(self, conn: Connection, packet: scapy.Packet) -> None:
-        if TCP in packet:
-            flag = self._get_flag(packet[TCP])
-            conn.flags.append(flag)
-
-    def _update_host_stats(self, src_ip: str, dst_ip: str, src_port: int, dst_port: int, proto: int) -> None:
-        host_stats = self.host_stats[dst_ip]
-        host_stats.count += 1
-        host_stats.srv_count += 1 if host_stats.last_port == dst_port else 0
-        host_stats.last_port = dst_port
-
-        recent_connections = list(self.recent_connections)
-        recent_connections.append(
-            (src_ip, dst_ip, src_port, dst_port, proto, time.time()))
-
-        host_stats.same_srv_rate = sum(
-            1 for conn in recent_connections if conn[3] == dst_port) / len(recent_connections)
-        host_stats.diff_srv_rate = sum(
-            1 for conn in recent_connections if conn[3] != dst_port) / len(recent_connections)
-        host_stats.same_src_port_rate = sum(
-            1 for conn in recent_connections if conn[2] == src_port) / len(recent_connections)
-        host_stats.srv_diff_host_rate = sum(
-            1 for conn in recent_connections if conn[1] != dst_ip) / len(recent_connections)
-        host_stats.serror_rate = sum(1 for conn in recent_connections if self._is_serror(
-            self.connections[(conn[0], conn[1], conn[2], conn[3], conn[4])])) / len(recent_connections)
-        host_stats.srv_serror_rate = sum(1 for conn in recent_connections if self._is_serror(
-            self.connections[(conn[0], conn[1], conn[2], conn[3], conn[4])])) / len(recent_connections)
-        host_stats.rerror_rate = sum(1 for conn in recent_connections if self._is_rerror(
-            self.connections[(conn[0], conn[1], conn[2], conn[3], conn[4])])) / len(recent_connections)
-        host_stats.srv_rerror_rate = sum(1 for conn in recent_connections if self._is_rerror(
-            self.connections[(conn[0], conn[1], conn[2], conn[3], conn[4])])) / len(recent_connections)
-
-        self.recent_connections = deque(recent_connections, maxlen=100)
-
-    def _extract_features_dict(self, ip: IP, transport, conn: Connection, conn_key: Tuple) -> Dict:
+        if self._detect_outbound_cmds(record, hits):
+            flows.add_counter('num_outbound_cmds', slot)
+
+    def _update_host_stats(self, slot: int, new: bool, src: int, dst: int, src_port: int, dst_port: int,
+                           serror: bool, rerror: bool, current_time: float) -> Tuple:
+        # A connection enters the host window with its first packet; later
+        # packets only refresh its error bits as the status changes
+        hosts = self.hosts
+        host = hosts.lookup(dst, current_time)
+        if new:
+            self.connections.host_entry[slot] = hosts.add(host, src, src_port, dst_port, serror, rerror)
+        else:
+            hosts.update(host, self.connections.host_entry[slot], src, src_port, dst_port, serror, rerror)
+        return hosts.stats(host, src, src_port, dst_port)
+
+    def _extract_features_dict(self, slot: int, endpoints: Tuple, flag: int, window: Tuple,
+                               host_stats: Tuple, timestamp: float) -> Dict:
+        flows = self.connections
+        src_ip, dst_ip, src_port, dst_port = endpoints
+        bits = flows.bits[slot]
         return {
-            'duration': conn.last_time - conn.start_time,
-            'protocol_type': self._get_protocol_type(ip.proto),
-            'service': self._get_service(transport.dport),
-            'flag': self._get_flag(transport),
-            'src_bytes': conn.src_bytes,
-            'dst_bytes': conn.dst_bytes,
-            'land': int(ip.src == ip.dst and getattr(transport, 'sport', 0) == getattr(transport, 'dport', 0)),
-            'wrong_fragment': self._get_wrong_fragment(ip),
-            'urgent': conn.urgent,
-            'hot': conn.hot,
-            'num_failed_logins': conn.num_failed_logins,
-            'logged_in': conn.logged_in,
-            'num_compromised': conn.num_compromised,
-            'root_shell': conn.root_shell,
-            'su_attempted': conn.su_attempted,
-            'num_root': conn.num_root,
-            'num_file_creations': conn.num_file_creations,
-            'num_shells': conn.num_shells,
-            'num_access_files': conn.num_access_files,
-            'num_outbound_cmds': conn.num_outbound_cmds,
-            'is_host_login': conn.is_host_login,
-            'is_guest_login': conn.is_guest_login,
-            'count': conn.count,
-            'srv_count': conn.srv_count,
-            'serror_rate': self._calculate_rate(conn, self._is_serror),
-            'srv_serror_rate': self._calculate_srv_rate(conn, self._is_serror),
-            'rerror_rate': self._calculate_rate(conn, self._is_rerror),
-            'srv_rerror_rate': self._calculate_srv_rate(conn, self._is_rerror),
-            'same_srv_rate': self._calculate_rate(conn, self._is_same_srv),
-            'diff_srv_rate': self._calculate_rate(conn, self._is_diff_srv),
-            'srv_diff_host_rate': self._calculate_srv_rate(conn, self._is_diff_host),
-            'dst_host_count': self.host_stats[ip.dst].count,
-            'dst_host_srv_count': self.host_stats[ip.dst].srv_count,
-            'dst_host_same_srv_rate': self.host_stats[ip.dst].same_srv_rate,
-            'dst_host_diff_srv_rate': self.host_stats[ip.dst].diff_srv_rate,
-            'dst_host_same_src_port_rate': self.host_stats[ip.dst].same_src_port_rate,
-            'dst_host_srv_diff_host_rate': self.host_stats[ip.dst].srv_diff_host_rate,
-            'dst_host_serror_rate': self.host_stats[ip.dst].serror_rate,
-            'dst_host_srv_serror_rate': self.host_stats[ip.dst].srv_serror_rate,
-            'dst_host_rerror_rate': self.host_stats[ip.dst].rerror_rate,
-            'dst_host_srv_rerror_rate': self.host_stats[ip.dst].srv_rerror_rate
+            'src_ip': src_ip,
+            'dst_ip': dst_ip,
+            'src_port': src_port,
+            'dst_port': dst_port,
+            'timestamp': timestamp,
+            'duration': flows.duration(slot),
+            'protocol_type': self._get_protocol_type(flows.proto[slot]),
+            'service': self._get_service(dst_port),
+            'flag': FLAG_NAMES[flag],
+            'src_bytes': flows.src_bytes[slot],
+            'dst_bytes': flows.dst_bytes[slot],
+            'land': int(src_ip == dst_ip and src_port == dst_port),
+            'wrong_fragment': flows.wrong_fragment[slot],
+            'urgent': flows.urgent[slot],
+            'hot': flows.hot[slot],
+            'num_failed_logins': flows.num_failed_logins[slot],
+            'logged_in': 1 if bits & LOGGED_IN else 0,
+            'num_compromised': flows.num_compromised[slot],
+            'root_shell': 1 if bits & ROOT_SHELL else 0,
+            'su_attempted': 1 if bits & SU_ATTEMPTED else 0,
+            'num_root': flows.num_root[slot],
+            'num_file_creations': flows.num_file_creations[slot],
+            'num_shells': flows.num_shells[slot],
+            'num_access_files': flows.num_access_files[slot],
+            'num_outbound_cmds': flows.num_outbound_cmds[slot],
+            'is_host_login': 1 if bits & IS_HOST_LOGIN else 0,
+            'is_guest_login': 1 if bits & IS_GUEST_LOGIN else 0,
+            'count': window[0],
+            'srv_count': window[1],
+            'serror_rate': window[2],
+            'srv_serror_rate': window[3],
+            'rerror_rate': window[4],
+            'srv_rerror_rate': window[5],
+            'same_srv_rate': window[6],
+            'diff_srv_rate': window[7],
+            'srv_diff_host_rate': window[8],
+            'dst_host_count': host_stats[0],
+            'dst_host_srv_count': host_stats[1],
+            'dst_host_same_srv_rate': host_stats[2],
+            'dst_host_diff_srv_rate': host_stats[3],
+            'dst_host_same_src_port_rate': host_stats[4],
+            'dst_host_srv_diff_host_rate': host_stats[5],
+            'dst_host_serror_rate': host_stats[6],
+            'dst_host_srv_serror_rate': host_stats[7],
+            'dst_host_rerror_rate': host_stats[8],
+            'dst_host_srv_rerror_rate': host_stats[9]
         }
 
-    def _calculate_rate(self, conn: Connection, condition) -> float:
-        if conn.count == 0:
-            return 0.0
-        return sum(1 for c, _ in self.two_second_connections if condition(c)) / conn.count
-
-    def _calculate_srv_rate(self, conn: Connection, condition) -> float:
-        if conn.srv_count == 0:
-            return 0.0
-        return sum(1 for c, _ in self.two_second_connections if condition(c)) / conn.srv_count
-
-    def _is_serror(self, conn: Connection) -> bool:
-        return any('S' in flag and 'F' not in flag and 'A' not in flag for flag in conn.flags)
-
-    def _is_rerror(self, conn: Connection) -> bool:
-        return any('R' in flag for flag in conn.flags)
-
-    def _is_same_srv(self, conn: Connection) -> bool:
-        return len(set(conn.same_srv_connections)) == 1
-
-    def _is_diff_srv(self, conn: Connection) -> bool:
-        return len(set(conn.same_srv_connections)) > 1
-
-    def _is_diff_host(self, conn: Connection) -> bool:
-        return len(conn.diff_host_services) > 1
-
     @staticmethod
     def _get_protocol_type(protocol: int) -> str:
         return NetworkFeatureExtractor.PROTOCOL_TYPES.get(protocol, 'other')
@@ -359,76 +397,38 @@ class NetworkFeatureExtractor:
         return NetworkFeatureExtractor.COMMON_PORTS.get(port, 'other')
 
     @staticmethod
-    def _get_flag(transport) -> str:
-        if isinstance(transport, ICMP):
-            return 'SF'
-
-        if not hasattr(transport, 'flags'):
-            return 'OTH'
-
-        flags = ''.join(flag for bit, flag in [
-            (0x01, 'F'), (0x02, 'S'), (0x04, 'R'),
-            (0x08, 'P'), (0x10, 'A'), (0x20, 'U')
-        ] if transport.flags & bit)
-
-        if not flags:
-            return 'OTH'
-        elif 'S' in flags and 'F' in flags:
-            return 'SF'
-        elif 'S' in flags:
-            return 'S0'
-        elif 'F' in flags:
-            return 'REJ'
-        elif 'R' in flags:
-            return 'RSTO'
-        elif 'R' in flags and 'A' in flags:
-            return 'RSTR'
-        else:
-            return flags
-
-    @staticmethod
-    def _get_wrong_fragment(ip: IP) -> int:
-        return int(ip.frag != 0 or ip.flags.MF)
-
-    @staticmethod
-    def _get_urgent(packet: scapy.Packet) -> int:
-        return int(getattr(packet.getlayer(TCP), 'urgptr', 0) > 0)
-
-    @staticmethod
-    def _get_hot(packet: scapy.Packet, conn: Connection) -> int:
-        hot = 0
-        payload = str(packet.payload)
-
-        sensitive_paths = ['/etc/', '/usr/', '/var/', '/root/']
-        sensitive_files = ['/etc/passwd', '/etc/shadow', '.ssh/id_rsa']
-        sensitive_commands = ['gcc', 'make', 'sudo', 'su']
+    def _get_urgent(record: HeaderRecord) -> int:
+        return int(record.urgptr > 0)
 
-        hot += sum(2 for file in sensitive_files if file in payload)
-        hot += sum(1 for path in sensitive_paths if path in payload)
-        hot += sum(1 for cmd in sensitive_commands if cmd in payload)
+    def _get_hot(self, hits: Dict[str, int], slot: int) -> int:
+        # Sensitive files weigh 2, sensitive paths and commands 1
+        flows = self.connections
+        hot = hits.get('hot', 0)
 
-        if 'root' in payload and ('shell' in payload or 'bash' in payload):
+        if hits.get('root_marker') and hits.get('shell_marker'):
             hot += 2
-            conn.root_shell = 1
+            flows.bits[slot] |= ROOT_SHELL
 
-        if 'su ' in payload:
+        if hits.get('su_attempted'):
             hot += 1
-            conn.su_attempted = 1
+            flows.bits[slot] |= SU_ATTEMPTED
 
-        if 'login failed' in payload.lower():
-            conn.num_failed_logins += 1
+        if hits.get('num_failed_logins'):
+            flows.add_counter('num_failed_logins', slot)
 
-        if 'shell' in payload.lower():
-            conn.num_shells += 1
+        if hits.get('num_shells'):
+            flows.add_counter('num_shells', slot)
 
         return hot
 
     def start_capture(self) -> None:
+        from .capture import sniff_packets
         print(f"Starting packet capture on interface {self.interface}")
-        scapy.sniff(iface=self.interface, prn=self.process_packet,
-                    store=False, timeout=self.timeout)
+        # Internal traffic is already dropped in the kernel when it is not wanted
+        sniff_packets(self.interface, self.process_packet, timeout=self.timeout,
+                      exclude_internal=lambda: not self.detect_internal)
 
-    def process_packet(self, packet: scapy.Packet) -> Optional[Dict]:
+    def process_packet(self, packet: 'scapy.packet.Packet') -> Optional[Dict]:
         features = self.extract_features(packet)
         return features
 
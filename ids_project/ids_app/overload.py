@@ -0,0 +1,135 @@
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from .packet_dissector import frame_summary
+from .sharded_extractor import symmetric_flow_hash
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+SETUP_FLAGS = TCP_FIN | TCP_SYN | TCP_RST
+
+DROP_REASONS = ('queue_full', 'sampled', 'unparsed')
+
+
+class OverloadManager:
+    # Admission control in front of the first pipeline stage. While the queue
+    # is below `low_watermark` every packet is admitted. Above it, the share of
+    # flows kept (the sampling ratio) falls linearly to `min_ratio` at a full
+    # queue. Sampling hashes the flow symmetrically, so a kept flow is kept in
+    # both directions and as a whole, instead of losing random packets of every
+    # flow. Packets that open or close a connection (SYN/FIN/RST) and packets
+    # between hosts recently flagged as anomalous bypass sampling; they are
+    # only dropped when the queue is actually full.
+    def __init__(self, stage, low_watermark: float = 0.5, min_ratio: float = 0.05,
+                 flagged_ttl: float = 300.0, max_flagged: int = 10000, rate_interval: float = 1.0):
+        if not 0.0 <= low_watermark < 1.0:
+            raise ValueError("low_watermark must be in [0, 1)")
+        self.stage = stage
+        self.capacity = stage.queue.maxsize
+        self.low_watermark = low_watermark
+        self.min_ratio = min_ratio
+        self.flagged_ttl = flagged_ttl
+        self.max_flagged = max_flagged
+        self.flagged: OrderedDict = OrderedDict()  # host pair -> expiry time
+        self.flagged_lock = threading.Lock()
+
+        self.sampling_ratio = 1.0
+        self.admitted = 0
+        self.drops: Dict[str, int] = dict.fromkeys(DROP_REASONS, 0)
+        self.rate_interval = rate_interval
+        self.interval_start = time.monotonic()
+        self.interval_offered = 0
+        self.interval_dropped = 0
+        self.drop_rate = 0.0
+
+    def offer(self, item) -> bool:
+        # Called by the capture thread for every packet; returns whether it
+        # entered the pipeline. drop_rate covers the last rate_interval.
+        self.interval_offered += 1
+        self._update_rate()
+
+        depth = self.stage.queue.qsize()
+        fill = depth / self.capacity if self.capacity else 0.0
+        if fill <= self.low_watermark:
+            self.sampling_ratio = 1.0
+        else:
+            excess = (fill - self.low_watermark) / (1.0 - self.low_watermark)
+            self.sampling_ratio = max(self.min_ratio, 1.0 - excess * (1.0 - self.min_ratio))
+            reason = self._shed_reason(item)
+            if reason:
+                return self._drop(reason)
+
+        if self.stage.put(item, block=False):
+            self.admitted += 1
+            return True
+        return self._drop('queue_full')
+
+    def _shed_reason(self, item) -> Optional[str]:
+        frame = item[0] if isinstance(item, tuple) else getattr(item, 'original', None) or bytes(item)
+        summary = frame_summary(frame)
+        if summary is None:
+            return 'unparsed'
+        if summary[5] & SETUP_FLAGS or self._is_flagged(summary[1], summary[3]):
+            return None
+        # Keep the flows whose hash falls below the sampling ratio
+        if (symmetric_flow_hash(summary[:5]) & 0xffff) < self.sampling_ratio * 0x10000:
+            return None
+        return 'sampled'
+
+    def _drop(self, reason: str) -> bool:
+        self.drops[reason] += 1
+        self.interval_dropped += 1
+        return False
+
+    def _update_rate(self) -> None:
+        now = time.monotonic()
+        if now - self.interval_start >= self.rate_interval:
+            self.drop_rate = self.interval_dropped / self.interval_offered
+            self.interval_start = now
+            self.interval_offered = 0
+            self.interval_dropped = 0
+
+    @staticmethod
+    def _host_pair(a: bytes, b: bytes) -> tuple:
+        return (a, b) if a <= b else (b, a)
+
+    def flag(self, src_ip: str, dst_ip: str) -> None:
+        # Marks traffic between two hosts as anomalous, so it is preferred
+        # when shedding load
+        try:
+            pair = self._host_pair(socket.inet_aton(src_ip), socket.inet_aton(dst_ip))
+        except (OSError, TypeError):
+            return
+        with self.flagged_lock:
+            self.flagged[pair] = time.monotonic() + self.flagged_ttl
+            self.flagged.move_to_end(pair)
+            while len(self.flagged) > self.max_flagged:
+                self.flagged.popitem(last=False)
+
+    def _is_flagged(self, src: bytes, dst: bytes) -> bool:
+        if not self.flagged:
+            return False
+        pair = self._host_pair(src, dst)
+        with self.flagged_lock:
+            expiry = self.flagged.get(pair)
+            if expiry is None:
+                return False
+            if expiry < time.monotonic():
+                del self.flagged[pair]
+                return False
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            'queue_depth': self.stage.queue.qsize(),
+            'queue_capacity': self.capacity,
+            'sampling_ratio': round(self.sampling_ratio, 3),
+            'drop_rate': round(self.drop_rate, 3),
+            'admitted': self.admitted,
+            'dropped': dict(self.drops),
+            'flagged_host_pairs': len(self.flagged),
+        }
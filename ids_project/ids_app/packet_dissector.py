@@ -0,0 +1,176 @@
+import socket
+import struct
+from typing import Optional
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88a8
+
+PROTO_ICMP = 1
+PROTO_TCP = 6
+PROTO_UDP = 17
+PROTO_ARP = -1  # not an IP protocol number, marks ARP records
+
+_ETHERTYPE = struct.Struct('!H')
+_IPV4 = struct.Struct('!BBHHHBBH4s4s')
+_TCP = struct.Struct('!HHIIBBHHH')
+_UDP = struct.Struct('!HHHH')
+_ICMP = struct.Struct('!BBH')
+_ARP = struct.Struct('!HHBBH6s4s6s4s')
+_PORTS = struct.Struct('!HH')
+
+_inet_ntoa = socket.inet_ntoa
+
+
+class HeaderRecord:
+    # Compact summary of the headers NetworkFeatureExtractor needs from one
+    # frame. Ports are 0 and tcp_flags is None when they do not apply.
+    __slots__ = ('timestamp', 'length', 'ip_length', 'proto', 'src', 'dst', 'sport', 'dport',
+                 'tcp_flags', 'urgptr', 'icmp_type', 'wrong_fragment', 'arp_op', 'payload')
+
+    def __init__(self, timestamp: float, length: int, ip_length: int, proto: int, src: str, dst: str,
+                 sport: int = 0, dport: int = 0, tcp_flags: Optional[int] = None, urgptr: int = 0,
+                 icmp_type: int = 0, wrong_fragment: int = 0, arp_op: int = 0, payload=b''):
+        self.timestamp = timestamp
+        self.length = length
+        self.ip_length = ip_length
+        self.proto = proto
+        self.src = src
+        self.dst = dst
+        self.sport = sport
+        self.dport = dport
+        self.tcp_flags = tcp_flags
+        self.urgptr = urgptr
+        self.icmp_type = icmp_type
+        self.wrong_fragment = wrong_fragment
+        self.arp_op = arp_op
+        self.payload = payload
+
+    def __repr__(self) -> str:
+        return (f"HeaderRecord(proto={self.proto}, {self.src}:{self.sport} > {self.dst}:{self.dport}, "
+                f"length={self.length})")
+
+
+def dissect_frame(frame, timestamp: float = 0.0) -> Optional[HeaderRecord]:
+    # Parses an Ethernet frame (optionally 802.1Q/802.1ad tagged). Returns None
+    # for anything that is not ARP or TCP/UDP/ICMP over IPv4.
+    if len(frame) < 14:
+        return None
+    ethertype, = _ETHERTYPE.unpack_from(frame, 12)
+    offset = 14
+    while ethertype in (ETH_P_8021Q, ETH_P_8021AD):
+        if len(frame) < offset + 4:
+            return None
+        ethertype, = _ETHERTYPE.unpack_from(frame, offset + 2)
+        offset += 4
+
+    if ethertype == ETH_P_IP:
+        return dissect_ip(frame, timestamp, offset, len(frame))
+    if ethertype == ETH_P_ARP:
+        return dissect_arp(frame, timestamp, offset, len(frame))
+    return None
+
+
+def dissect_ip(buf, timestamp: float = 0.0, offset: int = 0,
+               length: Optional[int] = None) -> Optional[HeaderRecord]:
+    if len(buf) < offset + 20:
+        return None
+    (version_ihl, _, total_length, _, flags_frag, _, proto, _,
+     src, dst) = _IPV4.unpack_from(buf, offset)
+    if version_ihl >> 4 != 4:
+        return None
+    header_length = (version_ihl & 0x0f) * 4
+    frag = flags_frag & 0x1fff
+    if frag or proto not in (PROTO_TCP, PROTO_UDP, PROTO_ICMP):
+        # Non-first fragments carry no transport header
+        return None
+
+    end = min(len(buf), offset + total_length) if total_length else len(buf)
+    start = offset + header_length
+    record = HeaderRecord(timestamp, len(buf) if length is None else length, total_length, proto,
+                          _inet_ntoa(src), _inet_ntoa(dst),
+                          wrong_fragment=int(bool(flags_frag & 0x2000)))
+
+    if proto == PROTO_TCP:
+        if end < start + 20:
+            return None
+        sport, dport, _, _, data_offset, flags, _, _, urgptr = _TCP.unpack_from(buf, start)
+        record.sport = sport
+        record.dport = dport
+        record.tcp_flags = flags
+        record.urgptr = urgptr
+        payload_start = start + (data_offset >> 4) * 4
+    elif proto == PROTO_UDP:
+        if end < start + 8:
+            return None
+        record.sport, record.dport, _, _ = _UDP.unpack_from(buf, start)
+        payload_start = start + 8
+    else:
+        if end < start + 4:
+            return None
+        record.icmp_type = _ICMP.unpack_from(buf, start)[0]
+        payload_start = start + 8
+
+    if payload_start < end:
+        record.payload = bytes(buf[payload_start:end])
+    return record
+
+
+def dissect_arp(buf, timestamp: float = 0.0, offset: int = 0,
+                length: Optional[int] = None) -> Optional[HeaderRecord]:
+    if len(buf) < offset + _ARP.size:
+        return None
+    _, ptype, hlen, plen, op, _, psrc, _, pdst = _ARP.unpack_from(buf, offset)
+    if ptype != ETH_P_IP or hlen != 6 or plen != 4:
+        return None
+    return HeaderRecord(timestamp, len(buf) if length is None else length, 0, PROTO_ARP,
+                        _inet_ntoa(psrc), _inet_ntoa(pdst), arp_op=op)
+
+
+def record_from_packet(packet) -> Optional[HeaderRecord]:
+    # Builds a HeaderRecord from an already dissected scapy packet, whatever
+    # its link layer.
+    timestamp = float(getattr(packet, 'time', 0.0))
+    arp = packet.getlayer('ARP')
+    if arp is not None:
+        return dissect_arp(bytes(arp), timestamp, length=len(packet))
+    ip = packet.getlayer('IP')
+    if ip is not None:
+        return dissect_ip(bytes(ip), timestamp, length=len(packet))
+    return None
+
+
+def frame_endpoints(frame) -> Optional[tuple]:
+    # Cheap header peek used to dispatch frames before full dissection.
+    # Returns (proto, src, sport, dst, dport) with raw 4-byte addresses.
+    summary = frame_summary(frame)
+    return summary[:5] if summary is not None else None
+
+
+def frame_summary(frame) -> Optional[tuple]:
+    # frame_endpoints plus the TCP flags byte (0 for other protocols):
+    # (proto, src, sport, dst, dport, tcp_flags)
+    if len(frame) < 14:
+        return None
+    ethertype, = _ETHERTYPE.unpack_from(frame, 12)
+    offset = 14
+    while ethertype in (ETH_P_8021Q, ETH_P_8021AD) and len(frame) >= offset + 4:
+        ethertype, = _ETHERTYPE.unpack_from(frame, offset + 2)
+        offset += 4
+
+    if ethertype == ETH_P_ARP:
+        if len(frame) < offset + _ARP.size:
+            return None
+        fields = _ARP.unpack_from(frame, offset)
+        return PROTO_ARP, fields[6], 0, fields[8], 0, 0
+    if ethertype != ETH_P_IP or len(frame) < offset + 20:
+        return None
+
+    version_ihl, _, _, _, flags_frag, _, proto, _, src, dst = _IPV4.unpack_from(frame, offset)
+    start = offset + (version_ihl & 0x0f) * 4
+    if proto in (PROTO_TCP, PROTO_UDP) and not flags_frag & 0x1fff and len(frame) >= start + 4:
+        sport, dport = _PORTS.unpack_from(frame, start)
+        tcp_flags = frame[start + 13] if proto == PROTO_TCP and len(frame) > start + 13 else 0
+        return proto, src, sport, dst, dport, tcp_flags
+    return proto, src, 0, dst, 0, 0
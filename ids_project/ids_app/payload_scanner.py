@@ -0,0 +1,187 @@
+import codecs
+import re
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+class Signature(NamedTuple):
+    counter: str
+    pattern: bytes
+    weight: int = 1
+    nocase: bool = False
+    word: bool = False
+
+
+def _signatures(counter: str, patterns: Iterable[bytes], weight: int = 1,
+                nocase: bool = False, word: bool = False) -> List[Signature]:
+    return [Signature(counter, pattern, weight, nocase, word) for pattern in patterns]
+
+
+DEFAULT_SIGNATURES = tuple(
+    # hot indicators
+    _signatures('hot', [b'/etc/passwd', b'/etc/shadow', b'.ssh/id_rsa'], weight=2)
+    + _signatures('hot', [b'/etc/', b'/usr/', b'/var/', b'/root/'])
+    + _signatures('hot', [b'gcc', b'make', b'sudo', b'su'])
+    # root_shell needs both a root marker and a shell marker
+    + _signatures('root_marker', [b'root'])
+    + _signatures('shell_marker', [b'shell', b'bash'])
+    + _signatures('su_attempted', [b'su '])
+    + _signatures('num_failed_logins', [b'login failed'], nocase=True)
+    + _signatures('num_shells', [b'shell'], nocase=True)
+    + _signatures('num_file_creations', [b'create', b'touch', b'mkdir', b'mkfile'])
+    + _signatures('is_host_login', [b'rlogin', b'rsh', b'telnet'])
+    + _signatures('is_guest_login', [b'guest', b'anonymous'])
+    + _signatures('num_compromised', [b'rootkit', b'exploit', b'vulnerab', b'backdoor'])
+    + _signatures('num_root', [b'root', b'sudo', b'su'])
+    + _signatures('logged_in', [b'login successful', b'authenticated'])
+    + _signatures('num_access_files', [b'chmod', b'chown', b'ls -l', b'ls -la'])
+    # command patterns in HTTP payloads
+    + _signatures('outbound_cmds', [b'exec', b'eval', b'system', b'shell_exec', b'passthru',
+                                    b'cmd.exe', b'bash', b'sh', b'curl', b'wget'],
+                  nocase=True, word=True)
+    + _signatures('outbound_cmds', [b'/bin/'], nocase=True)
+)
+
+
+def load_signatures(path: str) -> List[Signature]:
+    # One signature per line: counter<TAB>weight<TAB>flags<TAB>pattern
+    # flags is any combination of "i" (ignore case) and "w" (word boundaries),
+    # or "-" for none. The pattern may use backslash escapes such as \x20.
+    signatures = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            try:
+                counter, weight, flags, pattern = line.split('\t', 3)
+                pattern_bytes = codecs.escape_decode(pattern.encode('utf-8'))[0]
+                weight = int(weight)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid signature line: {e}") from None
+            if not pattern_bytes:
+                raise ValueError(f"{path}:{line_number}: empty pattern")
+            signatures.append(Signature(counter, pattern_bytes, weight, 'i' in flags, 'w' in flags))
+    return signatures
+
+
+_WORD_BYTES = frozenset(b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+
+
+def _trie_pattern(literals: Iterable[bytes]) -> bytes:
+    # Alternation of the literals factored by common prefixes, so the regex
+    # engine tries one branch per distinct next byte instead of every
+    # literal. Optional tails are greedy: the longest literal at an offset
+    # wins.
+    trie: Dict = {}
+    for literal in literals:
+        node = trie
+        for byte in literal:
+            node = node.setdefault(byte, {})
+        node[None] = {}
+
+    def emit(node: Dict) -> bytes:
+        ends = None in node
+        children = sorted(byte for byte in node if byte is not None)
+        branches = [re.escape(bytes([byte])) + emit(node[byte]) for byte in children]
+        if not branches:
+            return b''
+        body = branches[0] if len(branches) == 1 else b'(?:' + b'|'.join(branches) + b')'
+        return b'(?:' + body + b')?' if ends else body
+
+    return emit(trie)
+
+
+class PayloadScanner:
+    # The payload is lowercased once and scanned with a single regex: the
+    # distinct lowercased literals of all signatures, as a prefix-factored
+    # alternation that consumes the longest literal at each match. Literals
+    # that the consumed match hides are resolved from tables built here:
+    # shorter literals matching at the same offset (its prefixes), literals
+    # lying entirely inside it, and offsets inside it where a literal may
+    # start and run past its end, which get one anchored match each. Case
+    # and word-boundary conditions are checked against the original bytes.
+    __slots__ = ('signatures', 'counters', 'regex', 'candidates', 'inner', 'crossing', 'final')
+
+    def __init__(self, signatures: Iterable[Signature] = DEFAULT_SIGNATURES):
+        self.signatures = list(signatures)
+        self.counters = sorted({sig.counter for sig in self.signatures})
+
+        by_literal: Dict[bytes, List[int]] = {}
+        for index, sig in enumerate(self.signatures):
+            by_literal.setdefault(sig.pattern.lower(), []).append(index)
+
+        literals = sorted(by_literal, key=len, reverse=True)
+        self.regex = re.compile(_trie_pattern(literals))
+
+        def starting(text: bytes) -> List[int]:
+            # Signatures whose literal is a prefix of `text`
+            return [index for other in literals if text.startswith(other) for index in by_literal[other]]
+
+        # literal -> signatures that may match at the same offset
+        self.candidates: Dict[bytes, List[int]] = {literal: starting(literal) for literal in literals}
+        # literal -> [(offset, signatures)] of literals inside it
+        self.inner: Dict[bytes, List[Tuple[int, List[int]]]] = {
+            literal: [(offset, starting(literal[offset:])) for offset in range(1, len(literal))
+                      if starting(literal[offset:])]
+            for literal in literals
+        }
+        # literal -> offsets where a longer literal could start and cross its end
+        self.crossing: Dict[bytes, List[int]] = {
+            literal: [offset for offset in range(1, len(literal))
+                      if any(len(other) > len(literal) - offset and other.startswith(literal[offset:])
+                             for other in literals)]
+            for literal in literals
+        }
+        # literal -> every signature a match of it can decide, for literals
+        # without crossing offsets: once all are seen, later matches are skipped
+        self.final: Dict[bytes, frozenset] = {
+            literal: frozenset(self.candidates[literal]).union(*(indices for _, indices in self.inner[literal]))
+            for literal in literals if not self.crossing[literal]
+        }
+
+    def scan(self, payload: bytes) -> Dict[str, int]:
+        # Returns the summed weights of the distinct signatures found in
+        # `payload`, per counter.
+        hits: Dict[str, int] = {}
+        if not payload or not self.signatures:
+            return hits
+
+        lowered = payload.lower()
+        regex = self.regex
+        candidates = self.candidates
+        final = self.final
+        seen = set()
+        done = set()
+        for match in regex.finditer(lowered):
+            literal = match.group()
+            if literal in done:
+                continue
+            start = match.start()
+            self._match(payload, start, candidates[literal], seen, hits)
+            for offset, indices in self.inner[literal]:
+                self._match(payload, start + offset, indices, seen, hits)
+            for offset in self.crossing[literal]:
+                crossing = regex.match(lowered, start + offset)
+                if crossing is not None:
+                    self._match(payload, start + offset, candidates[crossing.group()], seen, hits)
+            if len(seen) == len(self.signatures):
+                break
+            if literal in final and final[literal] <= seen:
+                done.add(literal)
+        return hits
+
+    def _match(self, payload: bytes, start: int, indices: List[int], seen: set, hits: Dict[str, int]) -> None:
+        # Counts the signatures among `indices` that match at `start`
+        size = len(payload)
+        for index in indices:
+            if index in seen:
+                continue
+            sig = self.signatures[index]
+            end = start + len(sig.pattern)
+            if not sig.nocase and payload[start:end] != sig.pattern:
+                continue
+            if sig.word and ((start > 0 and payload[start - 1] in _WORD_BYTES) or
+                             (end < size and payload[end] in _WORD_BYTES)):
+                continue
+            seen.add(index)
+            hits[sig.counter] = hits.get(sig.counter, 0) + sig.weight
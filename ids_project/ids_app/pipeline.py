@@ -0,0 +1,180 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    # A pool of worker threads fed by one bounded queue. Each worker blocks
+    # until an item arrives, takes up to `batch_size` queued items, passes the
+    # batch to `handler` and forwards every item the handler returns to the
+    # next stage. Nothing sleeps or polls: idle workers wait on the queue and a
+    # full queue blocks the producer (or drops, if it asked not to block).
+    # A single-worker stage can also be given a `tick` callback, called every
+    # `tick_interval` seconds of wall-clock time whether or not items arrive;
+    # its results are forwarded like the handler's. An `ordered` stage with
+    # several workers numbers its batches as they are taken from the queue
+    # and forwards them in that order, so a stateful stage downstream still
+    # sees items in arrival order.
+    def __init__(self, name: str, handler: Callable[[List], Optional[Iterable]], workers: int = 1,
+                 queue_size: int = 1000, batch_size: int = 1,
+                 tick: Optional[Callable[[], Optional[Iterable]]] = None, tick_interval: float = 1.0,
+                 ordered: bool = False):
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        if tick is not None and workers > 1:
+            raise ValueError(f"Stage {name} can only tick with one worker")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.tick = tick
+        self.tick_interval = tick_interval
+        self.ordered = ordered and workers > 1
+        self.take_lock = threading.Lock()  # taking a batch and its sequence number is atomic
+        self.forwarded = threading.Condition()
+        self.next_sequence = 0  # of the next batch taken
+        self.next_forward = 0  # of the next batch to forward
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.downstream: Optional['Stage'] = None
+        self.threads: List[threading.Thread] = []
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.count_lock = threading.Lock()
+
+    def start(self) -> None:
+        self.threads = [threading.Thread(target=self._run, name=f"ids-{self.name}-{i}", daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item, block: bool = True) -> bool:
+        try:
+            self.queue.put(item, block=block)
+            return True
+        except queue.Full:
+            with self.count_lock:
+                self.dropped += 1
+            return False
+
+    def stop(self) -> None:
+        # Lets the workers finish everything queued so far, then joins them
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self) -> None:
+        next_tick = time.monotonic() + self.tick_interval
+        while True:
+            if self.tick is not None:
+                now = time.monotonic()
+                if now >= next_tick:
+                    next_tick = now + self.tick_interval
+                    self._call(self.tick)
+                try:
+                    batch, stopping, sequence = self._take(timeout=max(0.0, next_tick - now))
+                except queue.Empty:
+                    continue
+            elif self.ordered:
+                with self.take_lock:
+                    batch, stopping, sequence = self._take()
+            else:
+                batch, stopping, sequence = self._take()
+            if batch:
+                self._call(self.handler, batch, sequence=sequence)
+                with self.count_lock:
+                    self.processed += len(batch)
+            if stopping:
+                return
+
+    def _take(self, timeout: Optional[float] = None):
+        # Blocks for the first item, then takes what is queued up to
+        # batch_size. Returns (batch, stop seen, sequence number).
+        item = self.queue.get(timeout=timeout)
+        if item is _STOP:
+            return [], True, None
+        batch = [item]
+        stopping = False
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        sequence = None
+        if self.ordered:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+        return batch, stopping, sequence
+
+    def _call(self, function: Callable, *args, sequence: Optional[int] = None) -> None:
+        # Runs the handler or tick and forwards its results; numbered batches
+        # wait for the ones before them
+        try:
+            results = function(*args)
+        except Exception:
+            logger.exception(f"Error in pipeline stage {self.name}")
+            results = None
+            with self.count_lock:
+                self.errors += 1
+
+        if sequence is None:
+            self._forward(results)
+            return
+        with self.forwarded:
+            while self.next_forward != sequence:
+                self.forwarded.wait()
+            try:
+                self._forward(results)
+            finally:
+                self.next_forward += 1
+                self.forwarded.notify_all()
+
+    def _forward(self, results: Optional[Iterable]) -> None:
+        if results and self.downstream is not None:
+            for result in results:
+                self.downstream.put(result)
+
+
+class Pipeline:
+    # Stages chained in order; items put into the pipeline enter the first
+    # stage. Stopping drains the stages front to back so that no accepted item
+    # is lost.
+    def __init__(self, stages: List[Stage]):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        for stage, downstream in zip(stages, stages[1:]):
+            stage.downstream = downstream
+        self.running = False
+
+    def start(self) -> None:
+        for stage in reversed(self.stages):
+            stage.start()
+        self.running = True
+
+    def put(self, item, block: bool = True) -> bool:
+        return self.stages[0].put(item, block)
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        self.running = False
+        for stage in self.stages:
+            stage.stop()
+
+    def stats(self) -> dict:
+        return {stage.name: {'workers': stage.workers, 'queued': stage.queue.qsize(),
+                             'processed': stage.processed, 'dropped': stage.dropped, 'errors': stage.errors}
+                for stage in self.stages}
@@ -0,0 +1,194 @@
+import csv
+import glob
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Columns of the traffic CSV with their default values, followed by "class"
+TRAFFIC_FIELDS = (
+    ("duration", 0), ("protocol_type", ''), ("service", ''), ("flag", ''), ("src_bytes", 0), ("dst_bytes", 0),
+    ("land", 0), ("wrong_fragment", 0), ("urgent", 0), ("hot", 0), ("num_failed_logins", 0), ("logged_in", 0),
+    ("num_compromised", 0), ("root_shell", 0), ("su_attempted", 0), ("num_root", 0),
+    ("num_file_creations", 0), ("num_shells", 0), ("num_access_files", 0), ("num_outbound_cmds", 0),
+    ("is_host_login", 0), ("is_guest_login", 0), ("count", 0), ("srv_count", 0), ("serror_rate", 0),
+    ("srv_serror_rate", 0), ("rerror_rate", 0), ("srv_rerror_rate", 0), ("same_srv_rate", 0),
+    ("diff_srv_rate", 0), ("srv_diff_host_rate", 0), ("dst_host_count", 0), ("dst_host_srv_count", 0),
+    ("dst_host_same_srv_rate", 0), ("dst_host_diff_srv_rate", 0), ("dst_host_same_src_port_rate", 0),
+    ("dst_host_srv_diff_host_rate", 0), ("dst_host_serror_rate", 0), ("dst_host_srv_serror_rate", 0),
+    ("dst_host_rerror_rate", 0), ("dst_host_srv_rerror_rate", 0),
+)
+
+
+class BackgroundWriter:
+    # Buffers records for a sink running on its own thread. Records are queued
+    # by the caller and turned into rows by `row_builder` on the writer thread.
+    # Rows are handed to _write_rows in batches every `flush_rows` rows or
+    # `flush_interval` seconds, whichever comes first.
+    def __init__(self, row_builder: Optional[Callable] = None, flush_rows: int = 500,
+                 flush_interval: float = 1.0, queue_size: int = 10000, name: str = "ids-record-writer"):
+        self.row_builder = row_builder
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.name = name
+        self.dropped = 0
+        self.written = 0
+        self.thread = None
+
+    def start(self) -> None:
+        self._open()
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def write(self, record) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        # Writes everything queued so far, then closes the sink
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+        self._close()
+
+    def _run(self) -> None:
+        rows: List = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                record = None
+            else:
+                if record is _STOP:
+                    self._flush(rows)
+                    return
+                try:
+                    rows.append(self.row_builder(record) if self.row_builder else record)
+                except Exception:
+                    logger.exception("Error building traffic record")
+
+            if len(rows) >= self.flush_rows or time.monotonic() >= deadline:
+                self._flush(rows)
+                rows = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, rows: List) -> None:
+        try:
+            if rows:
+                self._write_rows(rows)
+                self.written += len(rows)
+            self._after_flush()
+        except OSError:
+            logger.exception(f"Error writing traffic records from {self.name}")
+
+    def _open(self) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def _write_rows(self, rows: List) -> None:
+        raise NotImplementedError
+
+    def _after_flush(self) -> None:
+        pass
+
+
+class RotatingCSVWriter(BackgroundWriter):
+    # Appends CSV rows through a BackgroundWriter. The file stays open and is
+    # rotated once it reaches `max_bytes` or is older than `max_age` seconds:
+    # the closed segment is renamed with a timestamp suffix and optionally
+    # gzipped, and `backup_count` limits how many are kept.
+    def __init__(self, path: str, header: Sequence[str], row_builder: Optional[Callable] = None,
+                 max_bytes: int = 64 * 1024 * 1024, max_age: Optional[float] = None, compress: bool = False,
+                 backup_count: Optional[int] = None, flush_rows: int = 500, flush_interval: float = 1.0,
+                 queue_size: int = 10000):
+        super().__init__(row_builder, flush_rows, flush_interval, queue_size)
+        self.path = path
+        self.header = list(header)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.backup_count = backup_count
+        self.file = None
+        self.writer = None
+        self.opened_at = 0.0
+
+    def _open(self) -> None:
+        # Appends to an existing file so restarts keep earlier records
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(self.header)
+            self.file.flush()
+        self.opened_at = time.time()
+
+    def _close(self) -> None:
+        self.file.close()
+        self.file = None
+
+    def _write_rows(self, rows: List) -> None:
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def _after_flush(self) -> None:
+        if self._should_rotate():
+            self._rotate()
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            return True
+        return bool(self.max_age) and time.time() - self.opened_at >= self.max_age and self.file.tell() > 0
+
+    def _rotate(self) -> None:
+        self.file.close()
+        root, ext = os.path.splitext(self.path)
+        segment = f"{root}-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+        suffix = 1
+        while os.path.exists(segment) or os.path.exists(segment + '.gz'):
+            segment = f"{root}-{time.strftime('%Y%m%d-%H%M%S')}-{suffix}{ext}"
+            suffix += 1
+        os.replace(self.path, segment)
+        self._open()
+
+        if self.compress:
+            threading.Thread(target=self._compress, args=(segment,), daemon=True).start()
+        else:
+            self._prune()
+
+    def _compress(self, segment: str) -> None:
+        try:
+            with open(segment, 'rb') as src, gzip.open(segment + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(segment)
+        except OSError:
+            logger.exception(f"Error compressing {segment}")
+        self._prune()
+
+    def _prune(self) -> None:
+        if self.backup_count is None:
+            return
+        root, ext = os.path.splitext(self.path)
+        segments = sorted(glob.glob(f"{glob.escape(root)}-*{ext}") + glob.glob(f"{glob.escape(root)}-*{ext}.gz"),
+                          key=os.path.getmtime)
+        for segment in segments[:max(0, len(segments) - self.backup_count)]:
+            try:
+                os.remove(segment)
+            except OSError:
+                pass
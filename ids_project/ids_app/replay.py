@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Callable, Iterator, Optional, Tuple
+
+DLT_EN10MB = 1
+
+
+def _raw_timestamp(reader, metadata) -> Tuple[int, float]:
+    # Returns (linktype, timestamp) for a RawPcapReader/RawPcapNgReader record
+    if hasattr(metadata, 'sec'):
+        scale = 1e9 if getattr(reader, 'nano', False) else 1e6
+        return reader.linktype, metadata.sec + metadata.usec / scale
+    return metadata.linktype, ((metadata.tshigh << 32) | metadata.tslow) / metadata.tsresol
+
+
+def iter_pcap(path: str, raw: bool = False) -> Iterator[Tuple[object, float]]:
+    # Streams (item, timestamp) pairs from a pcap or pcapng file without
+    # loading it into memory. Items are scapy packets, or (frame, timestamp)
+    # tuples for Ethernet frames when `raw` is set, which is what
+    # NetworkFeatureExtractor.extract_frame expects. Scapy's layers are only
+    # loaded once a packet actually has to be dissected by scapy.
+    if not raw:
+        from scapy.all import PcapReader
+        with PcapReader(path) as reader:
+            for packet in reader:
+                yield packet, float(packet.time)
+        return
+
+    from scapy.utils import RawPcapReader
+    reader = RawPcapReader(path)
+    try:
+        for frame, metadata in reader:
+            linktype, timestamp = _raw_timestamp(reader, metadata)
+            if linktype == DLT_EN10MB:
+                yield (frame, timestamp), timestamp
+            else:
+                # Other link layers still go through scapy
+                from scapy.all import conf
+                packet = conf.l2types.num2layer[linktype](frame)
+                packet.time = timestamp
+                yield packet, timestamp
+    finally:
+        reader.close()
+
+
+def replay_pcap(path: str, handler: Callable[[object], None], speed: Optional[float] = None,
+                raw: bool = False, stop_event: Optional[threading.Event] = None) -> int:
+    # Feeds every packet of `path` to `handler`. With speed=None packets are
+    # replayed as fast as possible; otherwise the original inter-packet gaps
+    # are kept, divided by `speed` (1.0 is real time). Returns the number of
+    # packets replayed.
+    count = 0
+    first_timestamp = None
+    start = 0.0
+    for item, timestamp in iter_pcap(path, raw):
+        if stop_event is not None and stop_event.is_set():
+            break
+
+        if speed:
+            if first_timestamp is None:
+                first_timestamp, start = timestamp, time.monotonic()
+            else:
+                delay = (timestamp - first_timestamp) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    if stop_event is not None:
+                        if stop_event.wait(delay):
+                            break
+                    else:
+                        time.sleep(delay)
+
+        handler(item)
+        count += 1
+    return count
@@ -0,0 +1,222 @@
+import argparse
+import mmap
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .bpf import apply_filter
+from .capture import FILTER_CHECK_INTERVAL, ExcludeInternal
+
+# linux/if_packet.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+
+PACKET_FANOUT_HASH = 0  # by flow, both directions of a connection go to one socket
+PACKET_FANOUT_LB = 1
+PACKET_FANOUT_CPU = 2
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000  # reassemble IP fragments before hashing
+FANOUT_MODES = {'hash': PACKET_FANOUT_HASH, 'lb': PACKET_FANOUT_LB, 'cpu': PACKET_FANOUT_CPU}
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+_REQ3 = struct.Struct('7I')  # struct tpacket_req3
+_BLOCK_STATUS = struct.Struct('I')  # tpacket_block_desc.hdr.bh1.block_status
+_BLOCK_HEADER = struct.Struct('III')  # block_status, num_pkts, offset_to_first_pkt
+_BLOCK_HEADER_OFFSET = 8  # after version and offset_to_priv
+_PACKET_HEADER = struct.Struct('IIIIIIHH')  # struct tpacket3_hdr up to tp_net
+_STATS = struct.Struct('III')  # struct tpacket_stats_v3
+
+Frame = Tuple[memoryview, float]  # (link-layer frame, kernel timestamp)
+
+
+class PacketRing:
+    # Receives packets through a TPACKET_V3 ring shared with the kernel. The
+    # kernel fills blocks of `block_size` bytes and hands a block over once
+    # it is full or `block_timeout` ms after its first packet, so one poll()
+    # delivers a whole batch. Frames are memoryviews into the ring: they are
+    # only valid until the block is released and must be copied to be kept.
+    # Sockets that join the same `fanout_group` share the interface's
+    # traffic; the default hash mode keeps each connection on one socket.
+    def __init__(self, iface: Optional[str], block_size: int = 1 << 20, block_count: int = 64,
+                 frame_size: int = 2048, block_timeout: int = 100, fanout_group: Optional[int] = None,
+                 fanout_mode: int = PACKET_FANOUT_HASH):
+        if block_size % mmap.PAGESIZE or block_size % frame_size:
+            raise ValueError("block_size must be a multiple of the page size and of frame_size")
+        self.iface = iface
+        self.block_size = block_size
+        self.block_count = block_count
+        self.block = 0  # next block to read
+        self.held = False  # the current block belongs to user space
+        self.totals = {'packets': 0, 'drops': 0, 'freeze_queue': 0}
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frames = block_size // frame_size * block_count
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                                 _REQ3.pack(block_size, block_count, frame_size, frames, block_timeout, 0, 0))
+            self.ring = mmap.mmap(self.sock.fileno(), block_size * block_count, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+            if iface:
+                self.sock.bind((iface, ETH_P_ALL))
+            if fanout_group is not None:
+                self.sock.setsockopt(SOL_PACKET, PACKET_FANOUT, (fanout_group & 0xffff) | (fanout_mode << 16))
+        except Exception:
+            self.sock.close()
+            raise
+        self.view = memoryview(self.ring)
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+
+    def set_filter(self, user_filter: Optional[str] = None, exclude_internal: bool = False) -> None:
+        apply_filter(self.sock, self.iface, user_filter, exclude_internal)
+
+    def next_batch(self, timeout: float = 0.5) -> Optional[List[Frame]]:
+        # Frames of the next filled block, or None if none arrived within
+        # `timeout` seconds. The block stays with user space until release().
+        self.release()
+        offset = self.block * self.block_size
+        status, = _BLOCK_STATUS.unpack_from(self.ring, offset + _BLOCK_HEADER_OFFSET)
+        if not status & TP_STATUS_USER:
+            self.poller.poll(int(timeout * 1000))
+            status, = _BLOCK_STATUS.unpack_from(self.ring, offset + _BLOCK_HEADER_OFFSET)
+            if not status & TP_STATUS_USER:
+                return None
+        self.held = True
+        _, count, position = _BLOCK_HEADER.unpack_from(self.ring, offset + _BLOCK_HEADER_OFFSET)
+        position += offset
+        view = self.view
+        frames = []
+        for _ in range(count):
+            next_offset, seconds, nanoseconds, snaplen, _, _, mac, _ = _PACKET_HEADER.unpack_from(self.ring, position)
+            start = position + mac
+            frames.append((view[start:start + snaplen], seconds + nanoseconds * 1e-9))
+            position += next_offset
+        return frames
+
+    def release(self) -> None:
+        # Hands the current block back to the kernel
+        if self.held:
+            _BLOCK_STATUS.pack_into(self.ring, self.block * self.block_size + _BLOCK_HEADER_OFFSET, TP_STATUS_KERNEL)
+            self.block = (self.block + 1) % self.block_count
+            self.held = False
+
+    def batches(self, stop_event: Optional[threading.Event] = None,
+                timeout: Optional[float] = None) -> Iterator[List[Frame]]:
+        # Yields batches until stop_event is set or `timeout` seconds passed;
+        # each block is released when the consumer asks for the next batch
+        deadline = time.time() + timeout if timeout else None
+        while stop_event is None or not stop_event.is_set():
+            if deadline is not None and time.time() >= deadline:
+                break
+            batch = self.next_batch()
+            if batch:
+                yield batch
+        self.release()
+
+    def stats(self) -> Dict[str, int]:
+        # Kernel counters since the ring was opened; 'packets' includes drops
+        packets, drops, freeze_queue = _STATS.unpack(
+            self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _STATS.size))
+        self.totals['packets'] += packets  # the kernel resets them on every read
+        self.totals['drops'] += drops
+        self.totals['freeze_queue'] += freeze_queue
+        return dict(self.totals)
+
+    def close(self) -> None:
+        self.release()
+        self.poller.unregister(self.sock.fileno())
+        try:
+            self.view.release()
+            self.ring.close()
+        except BufferError:
+            pass  # frames still referenced; the mapping goes with them
+        self.sock.close()
+
+    def __enter__(self) -> 'PacketRing':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def sniff_ring(iface: Optional[str], prn: Callable[[List[Frame]], None], timeout: Optional[float] = None,
+               stop_event: Optional[threading.Event] = None, bpf_filter: Optional[str] = None,
+               exclude_internal: ExcludeInternal = False, **ring_options) -> Dict[str, int]:
+    # Counterpart of capture.sniff_frames that hands `prn` one batch of
+    # (memoryview, timestamp) frames per ring block. Returns the kernel's
+    # packet and drop counts.
+    with PacketRing(iface, **ring_options) as ring:
+        current = exclude_internal() if callable(exclude_internal) else exclude_internal
+        ring.set_filter(bpf_filter, current)
+        next_check = time.time() + FILTER_CHECK_INTERVAL
+        for batch in ring.batches(stop_event, timeout):
+            prn(batch)
+            if callable(exclude_internal) and time.time() >= next_check:
+                next_check = time.time() + FILTER_CHECK_INTERVAL
+                if exclude_internal() != current:
+                    current = not current
+                    ring.set_filter(bpf_filter, current)
+        return ring.stats()
+
+
+def _count_worker(iface: str, seconds: float, options: Dict, results) -> None:
+    from .packet_dissector import dissect_frame
+
+    counts = {'frames': 0, 'bytes': 0, 'dissected': 0}
+
+    def count(batch: List[Frame]) -> None:
+        counts['frames'] += len(batch)
+        for frame, timestamp in batch:
+            counts['bytes'] += len(frame)
+            if dissect_frame(frame, timestamp) is not None:
+                counts['dissected'] += 1
+
+    kernel = sniff_ring(iface, count, timeout=seconds, **options)
+    results.put((os.getpid(), counts, kernel))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Capture from a TPACKET_V3 ring and report throughput")
+    parser.add_argument('interface', help="interface to capture on, e.g. lo or one end of a veth pair")
+    parser.add_argument('--seconds', type=float, default=10.0, help="capture duration")
+    parser.add_argument('--workers', type=int, default=1, help="processes sharing the interface through fanout")
+    parser.add_argument('--fanout-mode', choices=sorted(FANOUT_MODES), default='hash')
+    parser.add_argument('--block-size', type=int, default=1 << 20, help="ring block size in bytes")
+    parser.add_argument('--blocks', type=int, default=64, help="ring blocks")
+    args = parser.parse_args(argv)
+
+    options = {'block_size': args.block_size, 'block_count': args.blocks}
+    if args.workers > 1:
+        options.update(fanout_group=os.getpid() & 0xffff, fanout_mode=FANOUT_MODES[args.fanout_mode])
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_count_worker, args=(args.interface, args.seconds, options, results))
+               for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    for pid, counts, kernel in sorted(reports):
+        print(f"worker {pid}: {counts['frames']} frames ({counts['frames'] / args.seconds:.0f}/s), "
+              f"{counts['bytes']} bytes, {counts['dissected']} dissected; kernel: {kernel}")
+    total = sum(counts['frames'] for _, counts, _ in reports)
+    drops = sum(kernel['drops'] for _, _, kernel in reports)
+    print(f"total: {total} frames ({total / args.seconds:.0f}/s), kernel drops: {drops}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
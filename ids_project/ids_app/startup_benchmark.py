@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_DIR = os.path.dirname(PROJECT_DIR)
+MODEL_FILE = os.path.join(BASE_DIR, "models", "NSL-KDD-RF-model.joblib")
+FEATURE_NAMES_FILE = os.path.join(BASE_DIR, "models", "feature_names.pkl")
+
+PHASES = ('import', 'load', 'warm_up')
+
+# Runs in a fresh interpreter so that nothing is cached from an earlier run
+_CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import ids_app.IDS
+from ids_app.forest_compiler import load_feature_names, load_model, predict_proba
+from ids_app.feature_encoder import FeatureEncoder
+imported = time.perf_counter()
+model = load_model(sys.argv[1]) if sys.argv[1] else None
+encoder = FeatureEncoder(load_feature_names(sys.argv[2]))
+loaded = time.perf_counter()
+matrix = encoder.encode([{}] * int(sys.argv[3]))
+if model is not None:
+    predict_proba(model, matrix)
+warmed = time.perf_counter()
+print(json.dumps({'import': imported - started, 'load': loaded - imported, 'warm_up': warmed - loaded,
+                  'modules': sorted(name for name in ('scapy.all', 'sklearn', 'pandas', 'django.db')
+                                    if name in sys.modules)}))
+"""
+
+
+def measure_once(model_path: str, feature_names_path: str, batch_size: int) -> Dict:
+    result = subprocess.run([sys.executable, '-c', _CHILD, model_path, feature_names_path, str(batch_size)],
+                            cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(model_path: str, feature_names_path: str, batch_size: int = 100, runs: int = 5) -> Dict:
+    # Median seconds per startup phase over `runs` cold interpreters
+    samples: List[Dict] = [measure_once(model_path, feature_names_path, batch_size) for _ in range(runs)]
+    result = {phase: statistics.median(sample[phase] for sample in samples) for phase in PHASES}
+    result['total'] = sum(result[phase] for phase in PHASES)
+    result['modules'] = samples[-1]['modules']
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the cold start time of the IDS engine")
+    parser.add_argument('--model', default=MODEL_FILE, help="model file (.joblib or compiled .npz)")
+    parser.add_argument('--feature-names', default=FEATURE_NAMES_FILE, help="feature names file")
+    parser.add_argument('--batch-size', type=int, default=100, help="rows in the warm-up batch")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument('--max-import', type=float, help="fail if importing ids_app.IDS takes longer (seconds)")
+    parser.add_argument('--max-total', type=float, help="fail if the whole startup takes longer (seconds)")
+    args = parser.parse_args(argv)
+
+    model_path = args.model if os.path.exists(args.model) else ''
+    if not model_path:
+        print(f"Model {args.model} not found, measuring without it")
+    result = measure(model_path, args.feature_names, args.batch_size, args.runs)
+    for phase in PHASES + ('total',):
+        print(f"{phase}: {result[phase] * 1000:.1f} ms")
+    print(f"Heavy modules loaded: {', '.join(result['modules']) or 'none'}")
+
+    failed = False
+    if args.max_import is not None and result['import'] > args.max_import:
+        print(f"Import time exceeds {args.max_import:.3f}s")
+        failed = True
+    if args.max_total is not None and result['total'] > args.max_total:
+        print(f"Startup time exceeds {args.max_total:.3f}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
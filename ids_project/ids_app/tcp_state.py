@@ -0,0 +1,74 @@
+from typing import Tuple
+
+# NSL-KDD connection status ("flag" feature), as small integer codes
+FLAG_NAMES: Tuple[str, ...] = ('OTH', 'REJ', 'RSTO', 'RSTOS0', 'RSTR', 'S0', 'S1', 'S2', 'S3', 'SF', 'SH')
+OTH, REJ, RSTO, RSTOS0, RSTR, S0, S1, S2, S3, SF, SH = range(len(FLAG_NAMES))
+FLAG_CODES = {name: code for code, name in enumerate(FLAG_NAMES)}
+
+# Connection state bits, one per event seen from either side
+ORIG_SYN = 0x01
+RESP_SYN_ACK = 0x02
+ORIG_FIN = 0x04
+RESP_FIN = 0x08
+ORIG_RST = 0x10
+RESP_RST = 0x20
+BOTH_FIN = ORIG_FIN | RESP_FIN
+
+_FIN, _SYN, _RST, _ACK = 0x01, 0x02, 0x04, 0x10
+
+
+def _packet_bits(tcp_flags: int, from_initiator: bool) -> int:
+    bits = 0
+    if from_initiator:
+        if tcp_flags & _SYN and not tcp_flags & _ACK:
+            bits |= ORIG_SYN
+        if tcp_flags & _FIN:
+            bits |= ORIG_FIN
+        if tcp_flags & _RST:
+            bits |= ORIG_RST
+    else:
+        if tcp_flags & _SYN and tcp_flags & _ACK:
+            bits |= RESP_SYN_ACK
+        if tcp_flags & _FIN:
+            bits |= RESP_FIN
+        if tcp_flags & _RST:
+            bits |= RESP_RST
+    return bits
+
+
+def _status(state: int) -> int:
+    if not state & ORIG_SYN:
+        return OTH  # picked up mid-stream
+    if not state & RESP_SYN_ACK:
+        if state & RESP_RST:
+            return REJ
+        if state & ORIG_RST:
+            return RSTOS0
+        if state & ORIG_FIN:
+            return SH
+        return S0
+    if state & ORIG_RST:
+        return RSTO
+    if state & RESP_RST:
+        return RSTR
+    if state & BOTH_FIN == BOTH_FIN:
+        return SF
+    if state & ORIG_FIN:
+        return S2
+    if state & RESP_FIN:
+        return S3
+    return S1
+
+
+# Raw TCP flag byte -> state bits, for packets from the initiator and from
+# the responder
+INITIATOR_BITS: Tuple[int, ...] = tuple(_packet_bits(flags, True) for flags in range(256))
+RESPONDER_BITS: Tuple[int, ...] = tuple(_packet_bits(flags, False) for flags in range(256))
+
+# State bits -> flag code
+STATUS: Tuple[int, ...] = tuple(_status(state) for state in range(64))
+
+# Flag code -> SYN error (handshake never completed) / reset
+SERROR: Tuple[bool, ...] = tuple(code in (S0, RSTOS0, SH) for code in range(len(FLAG_NAMES)))
+RERROR: Tuple[bool, ...] = tuple(code in (REJ, RSTO, RSTOS0, RSTR) for code in range(len(FLAG_NAMES)))
+
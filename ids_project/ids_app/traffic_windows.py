@@ -0,0 +1,136 @@
+from collections import deque
+from typing import Dict, List, Tuple
+
+BUCKET_ID_MASK = 0xffffffff
+
+
+class TwoSecondWindow:
+    # Time-bucketed sliding window over the connections that started in the
+    # last `span` seconds. Each bucket aggregates identical (dst, port,
+    # serror, rerror) entries, and the per-host / per-service counters are
+    # updated when a bucket enters or expires, so every lookup is a handful of
+    # dict accesses. A connection's error bits are rewritten in place when
+    # its status changes. Bucket ids handed out are truncated to 32 bits.
+    __slots__ = ('span', 'resolution', 'span_buckets', 'buckets',
+                 'host_counts', 'srv_counts', 'host_srv_counts')
+
+    def __init__(self, span: float = 2.0, resolution: float = 0.1):
+        self.span = span
+        self.resolution = resolution
+        self.span_buckets = max(1, int(round(span / resolution)))
+        self.buckets: deque = deque()
+        # [connections, serror, rerror]
+        self.host_counts: Dict[str, List[int]] = {}
+        self.srv_counts: Dict[int, List[int]] = {}
+        self.host_srv_counts: Dict[Tuple[str, int], int] = {}
+
+    def __len__(self) -> int:
+        return sum(counts[0] for counts in self.host_counts.values())
+
+    def add(self, dst: str, port: int, serror: bool, rerror: bool, timestamp: float) -> int:
+        # Adds a new connection; returns the id of the bucket it went into
+        bucket_id = int(timestamp / self.resolution)
+        self.expire(bucket_id)
+
+        if self.buckets and self.buckets[-1][0] >= bucket_id:
+            # Same bucket, or a slightly out-of-order timestamp
+            bucket_id, entries = self.buckets[-1]
+        else:
+            entries = {}
+            self.buckets.append((bucket_id, entries))
+
+        entry = (dst, port, serror, rerror)
+        entries[entry] = entries.get(entry, 0) + 1
+        self._apply(entry, 1)
+        return bucket_id & BUCKET_ID_MASK
+
+    def update(self, bucket_id: int, dst: str, port: int, old: Tuple[bool, bool], new: Tuple[bool, bool]) -> None:
+        # Moves a connection from its old (serror, rerror) bits to the new
+        # ones; nothing to do once its bucket expired
+        if not self.buckets:
+            return
+        newest = self.buckets[-1][0]
+        bucket_id = newest - ((newest - bucket_id) & BUCKET_ID_MASK)
+        for candidate, entries in reversed(self.buckets):
+            if candidate > bucket_id:
+                continue
+            if candidate < bucket_id:
+                return
+            entry = (dst, port) + old
+            n = entries.get(entry, 0)
+            if not n:
+                return
+            if n == 1:
+                del entries[entry]
+            else:
+                entries[entry] = n - 1
+            self._apply(entry, -1)
+            entry = (dst, port) + new
+            entries[entry] = entries.get(entry, 0) + 1
+            self._apply(entry, 1)
+            return
+
+    def advance(self, timestamp: float) -> None:
+        self.expire(int(timestamp / self.resolution))
+
+    def expire(self, bucket_id: int) -> None:
+        oldest_kept = bucket_id - self.span_buckets + 1
+        buckets = self.buckets
+        while buckets and buckets[0][0] < oldest_kept:
+            _, entries = buckets.popleft()
+            for entry, n in entries.items():
+                self._apply(entry, -n)
+
+    def _apply(self, entry: Tuple, n: int) -> None:
+        dst, port, serror, rerror = entry
+
+        host = self.host_counts.get(dst)
+        if host is None:
+            host = self.host_counts[dst] = [0, 0, 0]
+        host[0] += n
+        host[1] += n if serror else 0
+        host[2] += n if rerror else 0
+        if host[0] == 0:
+            del self.host_counts[dst]
+
+        srv = self.srv_counts.get(port)
+        if srv is None:
+            srv = self.srv_counts[port] = [0, 0, 0]
+        srv[0] += n
+        srv[1] += n if serror else 0
+        srv[2] += n if rerror else 0
+        if srv[0] == 0:
+            del self.srv_counts[port]
+
+        key = (dst, port)
+        same = self.host_srv_counts.get(key, 0) + n
+        if same:
+            self.host_srv_counts[key] = same
+        else:
+            del self.host_srv_counts[key]
+
+    def stats(self, dst: str, port: int) -> Tuple:
+        # Returns (count, srv_count, serror_rate, srv_serror_rate, rerror_rate,
+        #          srv_rerror_rate, same_srv_rate, diff_srv_rate, srv_diff_host_rate)
+        host = self.host_counts.get(dst, (0, 0, 0))
+        srv = self.srv_counts.get(port, (0, 0, 0))
+        same = self.host_srv_counts.get((dst, port), 0)
+
+        count, srv_count = host[0], srv[0]
+        if count:
+            serror_rate = host[1] / count
+            rerror_rate = host[2] / count
+            same_srv_rate = same / count
+            diff_srv_rate = 1.0 - same_srv_rate
+        else:
+            serror_rate = rerror_rate = same_srv_rate = diff_srv_rate = 0.0
+        if srv_count:
+            srv_serror_rate = srv[1] / srv_count
+            srv_rerror_rate = srv[2] / srv_count
+            srv_diff_host_rate = (srv_count - same) / srv_count
+        else:
+            srv_serror_rate = srv_rerror_rate = srv_diff_host_rate = 0.0
+
+        return (count, srv_count, serror_rate, srv_serror_rate, rerror_rate,
+                srv_rerror_rate, same_srv_rate, diff_srv_rate, srv_diff_host_rate)
+
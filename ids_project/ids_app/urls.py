@@ -9,6 +9,7 @@ urlpatterns = [
     path('settings/', ensure_csrf_cookie(views.settings), name='settings'),
     path('api/get-ids-settings/', views.get_ids_settings, name='get_ids_settings'),
     path('api/ids-status/', views.get_ids_status, name='get_ids_status'),
+    path('api/overload-stats/', views.get_overload_stats, name='get_overload_stats'),
     path('api/toggle-ids/', views.toggle_ids, name='toggle_ids'),
     path('api/traffic-data/', views.get_traffic_data, name='get_traffic_data'),
     path('api/historical-data/', views.get_historical_data, name='get_historical_data'),
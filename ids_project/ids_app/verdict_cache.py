@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+CATEGORICAL_FIELDS = ('protocol_type', 'service', 'flag')
+
+
+class VerdictCache:
+    # Remembers the last verdict of each flow (5-tuple) together with a
+    # quantized signature of its features. A cached verdict is reused while
+    # it was a confident "normal", the signature is unchanged, fewer than
+    # `rescore_packets` packets went by and less than `rescore_interval`
+    # seconds (packet clock) passed since the flow was last scored.
+    #
+    # Quantization: rates in steps of 1/rate_buckets, counts, byte totals and
+    # durations on a log2 scale, categorical features by value. A bulk
+    # transfer therefore only gets re-scored when a counter doubles or a rate
+    # really moves.
+    def __init__(self, fields: Iterable[str], max_size: int = 100000, min_confidence: float = 0.9,
+                 rescore_packets: int = 100, rescore_interval: float = 30.0, rate_buckets: int = 10,
+                 cached_label: str = 'normal'):
+        fields = list(fields)
+        self.rate_fields = [name for name in fields if name.endswith('_rate')]
+        self.categorical_fields = [name for name in fields if name in CATEGORICAL_FIELDS]
+        self.scalar_fields = [name for name in fields
+                              if name not in self.categorical_fields and name not in self.rate_fields]
+        self.max_size = max_size
+        self.min_confidence = min_confidence
+        self.rescore_packets = rescore_packets
+        self.rescore_interval = rescore_interval
+        self.rate_buckets = rate_buckets
+        self.cached_label = cached_label
+        self.entries: OrderedDict = OrderedDict()  # flow -> [signature, verdict, packets, scored_at]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0  # misses answered by another packet of the same batch
+
+    @staticmethod
+    def flow_key(features: Dict) -> tuple:
+        return (features.get('src_ip'), features.get('dst_ip'), features.get('src_port', 0),
+                features.get('dst_port', 0), features.get('protocol_type'))
+
+    def signature(self, features: Dict) -> tuple:
+        get = features.get
+        buckets = self.rate_buckets
+        return (tuple(int(get(name, 0) * buckets) for name in self.rate_fields)
+                + tuple(int(get(name, 0)).bit_length() for name in self.scalar_fields)
+                + tuple(get(name, '') for name in self.categorical_fields))
+
+    def lookup(self, features: Dict) -> Tuple[Optional[tuple], tuple, tuple]:
+        # Returns (verdict or None, flow key, signature); the key and signature
+        # are passed back to store() after a miss
+        key = self.flow_key(features)
+        signature = self.signature(features)
+        now = features.get('timestamp', 0.0)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                cached_signature, verdict, packets, scored_at = entry
+                if (cached_signature == signature and packets < self.rescore_packets
+                        and now - scored_at < self.rescore_interval):
+                    entry[2] = packets + 1
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return verdict, key, signature
+            self.misses += 1
+        return None, key, signature
+
+    def store(self, key: tuple, signature: tuple, features: Dict, verdict: tuple, confidence: float) -> None:
+        # verdict is whatever the caller wants back on a hit, e.g.
+        # (prediction, probabilities); only confident cached_label verdicts
+        # are kept
+        with self.lock:
+            if verdict[0] != self.cached_label or confidence < self.min_confidence:
+                self.entries.pop(key, None)
+                return
+            self.entries[key] = [signature, verdict, 0, features.get('timestamp', 0.0)]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def record_coalesced(self, count: int) -> None:
+        with self.lock:
+            self.coalesced += count
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0, 'evictions': self.evictions,
+                'coalesced': self.coalesced}
@@ -7,13 +7,17 @@ from datetime import timedelta
 from django.db import models
 from .models import IDSStatus, TrafficData
 from .IDS import IntrusionDetectionSystem
+from .columnar_store import ColumnarStore
+from .record_writer import TRAFFIC_FIELDS
+import io
 import threading
 from collections import Counter
 import traceback
 from django.utils import timezone
 from datetime import timedelta
 import os
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings as django_settings
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 import csv
 from django.db.models import Sum
@@ -33,8 +37,11 @@ logger = logging.getLogger(__name__)
 PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 MODELS_DIR = os.path.join(PROJECT_DIR, "models")  # Models directory
 TRAFFIC_DATA_CSV = os.path.join(PROJECT_DIR, "traffic_data.csv")  # Traffic data CSV
+TRAFFIC_STORE_DIR = os.path.join(PROJECT_DIR, "traffic_store")  # Columnar traffic store
 SCALER_FILE = os.path.join(PROJECT_DIR, "scaler.joblib")  # Scaler file
 IDS_LOG = os.path.join(PROJECT_DIR, "ids_log.txt")  # Log file
+CSV_CHUNK_SIZE = 64 * 1024  # bytes per chunk when streaming traffic records
+CSV_CHUNK_ROWS = 1000  # columnar rows per chunk when streaming traffic records
 
 ids_instance = None
 ids_thread = None
@@ -72,13 +79,50 @@ def get_logs(request):
         return JsonResponse({'error': 'An internal error has occurred.'}, status=500)
 
 
+def record_source():
+    # (record_format, csv path, store directory) of the running IDS, or of
+    # the IDS_RECORD_FORMAT setting before one has been started
+    if ids_instance:
+        return ids_instance.record_format, ids_instance.csv_output, ids_instance.traffic_store
+    return getattr(django_settings, 'IDS_RECORD_FORMAT', 'csv'), TRAFFIC_DATA_CSV, TRAFFIC_STORE_DIR
+
+
+def _stream_columnar(store: ColumnarStore):
+    # The store in the traffic CSV layout, CSV_CHUNK_ROWS rows at a time
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in TRAFFIC_FIELDS] + ['class'])
+    rows = 0
+    for row in store.iter_rows():
+        writer.writerow(row)
+        rows += 1
+        if rows == CSV_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    yield buffer.getvalue()
+
+
+def _stream_file(path: str):
+    with open(path, 'r') as csv_file:
+        while True:
+            chunk = csv_file.read(CSV_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
 def get_traffic_data_csv(request):
-    if not os.path.exists(TRAFFIC_DATA_CSV):
-        open(TRAFFIC_DATA_CSV, 'a').close()
+    record_format, csv_path, store_dir = record_source()
     try:
-        with open(TRAFFIC_DATA_CSV, 'r') as csv_file:
-            csv_content = csv_file.read()
-        return HttpResponse(csv_content, content_type='text/csv')
+        if record_format == 'columnar':
+            content = _stream_columnar(ColumnarStore(store_dir))
+        else:
+            if not os.path.exists(csv_path):
+                open(csv_path, 'a').close()
+            content = _stream_file(csv_path)
+        return StreamingHttpResponse(content, content_type='text/csv')
     except Exception as e:
         logger.error("Error reading traffic data CSV: %s", traceback.format_exc())
         return JsonResponse({'error': 'An internal error has occurred.'}, status=500)
@@ -139,6 +183,13 @@ def get_ids_status(request):
     return JsonResponse({'is_active': status.is_active})
 
 
+def get_overload_stats(request):
+    global ids_instance
+    if ids_instance and ids_instance.is_running():
+        return JsonResponse({'overload': ids_instance.get_overload_stats()})
+    return JsonResponse({'error': 'IDS is not running'}, status=400)
+
+
 def get_available_interfaces(request):
     interfaces = IntrusionDetectionSystem.get_available_interfaces()
     return JsonResponse({'interfaces': interfaces})
@@ -177,15 +228,13 @@ def get_traffic_data(request):
         total_packets = max(total_packets, normal_packets + anomaly_packets)
 
         # Get the latest connection
-        latest_conn_key = next(
-            reversed(ids_instance.feature_extractor.connections.keys()), None)
-        latest_conn = ids_instance.feature_extractor.connections.get(
-            latest_conn_key)
+        connections = ids_instance.feature_extractor.connections
+        latest_slot = connections.latest
 
-        if latest_conn and latest_conn_key:
+        if latest_slot >= 0:
             protocol_type = ids_instance.feature_extractor.PROTOCOL_TYPES.get(
-                latest_conn_key[4], 'ARP')
-            flag = latest_conn.flags[-1] if latest_conn.flags else ''
+                connections.proto[latest_slot], 'ARP')
+            flag = connections.flag_name(latest_slot)
         else:
             protocol_type = ''
             flag = ''
@@ -281,11 +330,24 @@ def get_csv_data(request):
     anomaly_packets = 0
 
     try:
+        record_format, csv_path, store_dir = record_source()
+        if record_format == 'columnar':
+            # Aggregate straight from the memory-mapped columns
+            store = ColumnarStore(store_dir)
+            classes = store.value_counts('class')
+            return JsonResponse({
+                'total_packets': sum(classes.values()),
+                'normal_packets': classes.get('normal', 0),
+                'anomaly_packets': sum(classes.values()) - classes.get('normal', 0),
+                'protocol_types': dict(store.value_counts('protocol_type').most_common(5)),
+                'flags': dict(store.value_counts('flag').most_common(5))
+            })
+
         # Ensure the file exists
-        if not os.path.exists('traffic_data.csv'):
-            open('traffic_data.csv', 'w').close() 
-            
-        with open('traffic_data.csv', 'r') as csvfile:
+        if not os.path.exists(csv_path):
+            open(csv_path, 'w').close()
+
+        with open(csv_path, 'r') as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
                 total_packets += 1
@@ -374,7 +436,8 @@ def toggle_ids(request):
                 ids_instance = IntrusionDetectionSystem(
                     os.path.join(MODELS_DIR, "NSL-KDD-RF-model.joblib"),
                     os.path.join(MODELS_DIR, "feature_names.pkl"),
-                    detect_internal=settings.detect_internal
+                    detect_internal=settings.detect_internal,
+                    record_format=getattr(django_settings, 'IDS_RECORD_FORMAT', 'csv')
                 )
             if not ids_thread or not ids_thread.is_alive():
                 ids_thread = threading.Thread(
@@ -67,3 +67,7 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]  # Update if using static files
+
+# Where the IDS started from the dashboard records traffic: 'csv' writes
+# traffic_data.csv, 'columnar' the memory-mapped store in traffic_store/
+IDS_RECORD_FORMAT = 'csv'